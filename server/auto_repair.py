@@ -0,0 +1,159 @@
+# auto_repair.py
+import logging
+from typing import List, Optional, Set, Tuple
+
+from diagram_patch import (
+    OP_ADD_FLOW, OP_ADD_NODE, OP_REMOVE_FLOW, OP_REMOVE_NODE, OP_SET_GATEWAY_TYPE, apply_operations
+)
+from process_graph import ProcessGraph, find_structural_errors, scopes
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз повторять цикл "проверка -> правила": правка одной ошибки может открыть другую
+MAX_ROUNDS = 3
+
+
+def repair(data: dict) -> Tuple[dict, List[dict], List[dict]]:
+    """
+    Детерминированно исправляет ошибки структуры, найденные алгоритмом: отсутствие начала и конца,
+    висячие шлюзы, шлюзы без типа, битые и повторные потоки, тупики, недостижимые истоки,
+    исключающие шлюзы без ветвления. Циклы, парность шлюзов и размещение висячих задач требуют
+    понимания смысла процесса и остаются для LLM.
+    Правки выражаются теми же операциями, что и у LLM (diagram_patch.py); содержимое
+    развёрнутых подпроцессов исправляется так же, операции внутри них содержат поле "parent".
+    Возвращает (исправленная структура, применённые операции, оставшиеся ошибки).
+    """
+    applied_total = []
+    errors = find_structural_errors(data)
+    for _ in range(MAX_ROUNDS):
+        operations = plan_repairs(data, errors)
+        if not operations:
+            break
+        data, applied, rejected = apply_operations(data, operations)
+        if rejected:
+            logger.warning("Правила автоисправления дали некорректные операции: %s", rejected)
+        applied_total += applied
+        errors = find_structural_errors(data)
+        if not applied:
+            break
+    return data, applied_total, errors
+
+
+def plan_repairs(data: dict, errors: List[dict]) -> List[dict]:
+    # ID новых элементов уникальны во всей цепочке, а не только в своей области
+    taken = {node.get("id") for _, scope in scopes(data) for node in scope.get("nodes", [])}
+    operations = []
+    for parent, scope in scopes(data):
+        scope_errors = [err for err in errors if err.get("parent") == parent]
+        operations += _plan_scope(ProcessGraph(scope), scope_errors, parent, taken)
+    return operations
+
+
+def _plan_scope(graph: ProcessGraph, errors: List[dict], parent: Optional[str], taken: Set[str]) -> List[dict]:
+    planner = _Planner(graph, parent, taken)
+    by_code = {}
+    for err in errors:
+        by_code.setdefault(err["code"], []).append(err)
+
+    # Потоки с несуществующими концами и повторы удаляются первыми
+    for flow in graph.dangling_flows:
+        planner.append({"op": OP_REMOVE_FLOW, "source": flow.get("source"), "target": flow.get("target")})
+    for source, target in graph.duplicate_flows:
+        # remove_flow удаляет все одинаковые потоки - один возвращаем
+        planner.append({"op": OP_REMOVE_FLOW, "source": source, "target": target})
+        planner.append({"op": OP_ADD_FLOW, "source": source, "target": target})
+
+    # Шлюз без типа по умолчанию исключающий: он не создаёт лишних параллельных веток
+    for err in by_code.get("GATEWAY_TYPE_MISSING", []):
+        planner.append({"op": OP_SET_GATEWAY_TYPE, "id": err["elements"][0], "gateway_type": "exclusive"})
+
+    # Висячий шлюз или безымянный элемент ничего не несут - удаляем;
+    # место для висячей задачи с именем - смысловой вопрос, его решает LLM
+    for err in by_code.get("ORPHAN_ELEMENT", []):
+        node = graph.nodes[err["elements"][0]]
+        if node.get("type") == "gateway" or not node.get("name"):
+            planner.remove_node(node["id"])
+
+    # Исключающий шлюз с одним входом и одним выходом заменяется прямым потоком
+    for err in by_code.get("EXCLUSIVE_SINGLE_OUTGOING", []):
+        node_id = err["elements"][0]
+        successors, predecessors = graph.successors[node_id], graph.predecessors[node_id]
+        planner.remove_node(node_id)
+        for predecessor in predecessors:
+            for successor in successors:
+                planner.add_flow(predecessor, successor)
+
+    starts = graph.ids_of_type("start")
+    ends = graph.ids_of_type("end")
+    if "NO_START" in by_code:
+        start_id = planner.add_node("start", "Начало")
+        sources = planner.live([node_id for node_id in graph.nodes
+                                if not graph.predecessors[node_id] and graph.successors[node_id]
+                                and graph.nodes[node_id].get("type") != "end"])
+        for node_id in sources or planner.live([next(iter(graph.nodes), None)]):
+            planner.add_flow(start_id, node_id)
+        starts = [start_id]
+    if "NO_END" in by_code:
+        end_id = planner.add_node("end", "Конец")
+        sinks = planner.live([node_id for node_id in graph.nodes
+                              if not graph.successors[node_id] and graph.predecessors[node_id]])
+        for node_id in sinks:
+            planner.add_flow(node_id, end_id)
+        ends = [end_id]
+
+    # Тупик ведём в конечное событие, недостижимый исток - от стартового
+    if len(ends) == 1:
+        for err in by_code.get("DEAD_END", []):
+            for node_id in planner.live(err["elements"]):
+                planner.add_flow(node_id, ends[0])
+    if len(starts) == 1:
+        for err in by_code.get("UNREACHABLE", []):
+            for node_id in planner.live(err["elements"]):
+                if not graph.predecessors[node_id]:
+                    planner.add_flow(starts[0], node_id)
+    return planner.operations
+
+
+class _Planner:
+    """
+    Накопление операций одной области без повторов и без ссылок на уже удаляемые элементы.
+    taken - занятые ID во всей цепочке, общие для всех областей.
+    """
+
+    def __init__(self, graph: ProcessGraph, parent: Optional[str], taken: Set[str]):
+        self.graph = graph
+        self.parent = parent
+        self.taken = taken
+        self.operations: List[dict] = []
+        self.removed: Set[str] = set()
+        self.flows: Set[Tuple[str, str]] = {(source, target)
+                                             for source, successors in graph.successors.items()
+                                             for target in successors}
+
+    def append(self, operation: dict):
+        if self.parent is not None:
+            operation["parent"] = self.parent
+        self.operations.append(operation)
+
+    def live(self, node_ids: List[str]) -> List[str]:
+        return [node_id for node_id in node_ids if node_id is not None and node_id not in self.removed]
+
+    def remove_node(self, node_id: str):
+        if node_id not in self.removed:
+            self.removed.add(node_id)
+            self.append({"op": OP_REMOVE_NODE, "id": node_id})
+
+    def add_node(self, node_type: str, name: str) -> str:
+        node_id, suffix = f"auto_{node_type}", 1
+        while node_id in self.taken:
+            suffix += 1
+            node_id = f"auto_{node_type}_{suffix}"
+        self.taken.add(node_id)
+        self.append({"op": OP_ADD_NODE, "id": node_id, "name": name, "type": node_type})
+        return node_id
+
+    def add_flow(self, source: str, target: str):
+        if source in self.removed or target in self.removed or source == target or (source, target) in self.flows:
+            return
+        self.flows.add((source, target))
+        self.append({"op": OP_ADD_FLOW, "source": source, "target": target})
@@ -0,0 +1,257 @@
+# batch.py
+"""
+Пакетное преобразование описаний процессов в BPMN (миграции каталога процессов).
+
+Вход - JSONL, строка на процесс: {"id": "...", "process_description": "...", "hierarchical": false,
+"filename": "..."}; обязательно только process_description. Выход - JSONL, строка на процесс
+в порядке готовности: {"id", "key", "index", "status": "ok", "event_chain", "bpmn_xml", "filename",
+"analysis"?, "seconds"} или {"id", "index", "status": "error", "error"}.
+
+Успешные результаты дописываются в файл контрольной точки; при повторном запуске с тем же
+файлом готовые процессы не генерируются заново, а их результаты выдаются из контрольной точки.
+Процесс в контрольной точке узнаётся по "id", а без него - по хэшу описания (см. checkpoint_key),
+поэтому перестановка или вставка строк во входном файле не подменяет результаты.
+
+    python batch.py descriptions.jsonl -o results.jsonl --checkpoint results.ckpt --analyze
+    python batch.py descriptions.jsonl --server http://localhost:8000 --checkpoint run1
+"""
+import argparse
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, Optional, Set
+
+from critic_agent import MODE_AUTO
+from inference_scheduler import PRIORITY_LOW, InferenceError, request_options
+from response_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+
+def checkpoint_key(item: dict) -> Optional[str]:
+    """
+    Ключ элемента в контрольной точке: явный "id" или хэш описания и режима генерации.
+    Номер строки ключом не служит - при правке входного файла он указывал бы на чужой результат.
+    """
+    if "id" in item:
+        return str(item["id"])
+    description = item.get("process_description")
+    if not isinstance(description, str):
+        return None
+    raw = json.dumps([normalize_text(description), bool(item.get("hierarchical")), item.get("filename")],
+                     ensure_ascii=False)
+    return "sha256:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Checkpoint:
+    """
+    Журнал успешных результатов (JSONL): запись дописывается и сбрасывается на диск сразу после готовности.
+    Записи хранятся по полю "key" (см. checkpoint_key)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Строка, оборванная при аварийном завершении
+                        logger.warning("Пропущена повреждённая строка контрольной точки %s", path)
+                        continue
+                    self.records[record.get("key", record["id"])] = record
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def add(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.records[record["key"]] = record
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def parse_jsonl(lines: Iterable[str]) -> Iterator[dict]:
+    """Строки JSONL -> элементы пакета; пустые строки пропускаются, ошибки разбора становятся элементами с "error" """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            item = {"error": f"Некорректная строка JSONL: {e}"}
+        if not isinstance(item, dict):
+            item = {"error": "Строка пакета должна быть JSON-объектом"}
+        yield item
+
+
+class BatchRunner:
+    """
+    Прогон пакета через пайплайн: цепочка событий -> BPMN -> (необязательно) анализ.
+    Одновременно обрабатывается не больше concurrency процессов - на все пакеты, идущие через
+    этот объект (на сервере - все запросы /batch процесса); запросы к модели идут через общий
+    планировщик с низким приоритетом, чтобы интерактивные запросы не ждали пакет.
+    """
+
+    def __init__(self, pipeline: Any, bpmn_agent: Any, concurrency: int = 4):
+        self.pipeline = pipeline
+        self.bpmn_agent = bpmn_agent
+        self.concurrency = concurrency
+        self._slots = threading.Semaphore(concurrency)
+
+    def run(self, items: Iterable[dict], analyze: bool = False, mode: str = MODE_AUTO, no_cache: bool = False,
+            persist: Optional[bool] = None, checkpoint: Optional[Checkpoint] = None) -> Iterator[dict]:
+        """
+        Результаты отдаются по мере готовности. Вход читается лениво - в памяти не больше
+        concurrency элементов. Если потребитель прекратил чтение, ещё не начатые элементы отменяются.
+        """
+        done: Set[str] = set(checkpoint.records) if checkpoint is not None else set()
+        pending: Set[Future] = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            try:
+                for index, item in enumerate(items):
+                    item_id = str(item.get("id", index))
+                    key = checkpoint_key(item)
+                    if key in done:
+                        yield {**checkpoint.records[key], "id": item_id, "index": index, "resumed": True}
+                        continue
+                    if len(pending) >= self.concurrency:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        yield from self._collect(finished, checkpoint)
+                    pending.add(pool.submit(contextvars.copy_context().run, self._process,
+                                            index, item_id, key, item, analyze, mode, no_cache, persist))
+                while pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from self._collect(finished, checkpoint)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _collect(finished: Set[Future], checkpoint: Optional[Checkpoint]) -> Iterator[dict]:
+        for future in finished:
+            record = future.result()
+            if checkpoint is not None and record["status"] == STATUS_OK:
+                checkpoint.add(record)
+            yield record
+
+    def _process(self, index: int, item_id: str, key: Optional[str], item: dict, analyze: bool, mode: str,
+                 no_cache: bool, persist: Optional[bool]) -> dict:
+        with self._slots:
+            return self._process_item(index, item_id, key, item, analyze, mode, no_cache, persist)
+
+    def _process_item(self, index: int, item_id: str, key: Optional[str], item: dict, analyze: bool, mode: str,
+                      no_cache: bool, persist: Optional[bool]) -> dict:
+        started = time.monotonic()
+        try:
+            if item.get("error"):
+                raise ValueError(item["error"])
+            description = item.get("process_description")
+            if not isinstance(description, str) or not description.strip():
+                raise ValueError("Описание процесса не может быть пустым")
+            with request_options(priority=PRIORITY_LOW):
+                chain = self.pipeline.generate_chain(description, no_cache, bool(item.get("hierarchical")))
+                bpmn_xml, filename = self.bpmn_agent.generate_raw_bpmn(chain, item.get("filename"), persist,
+                                                                      description)
+                record = {"id": item_id, "key": key, "status": STATUS_OK, "event_chain": chain,
+                          "bpmn_xml": bpmn_xml, "filename": filename}
+                if analyze:
+                    record["analysis"] = self.pipeline.analyze(chain, no_cache, mode)
+        except Exception as e:
+            # Ошибка одного элемента не останавливает пакет; трассировка нужна только для неожиданных
+            logger.warning("Элемент пакета %s не обработан: %s", item_id, e,
+                           exc_info=not isinstance(e, (InferenceError, ValueError)))
+            return {"id": item_id, "index": index, "status": STATUS_ERROR, "error": str(e),
+                    "error_type": type(e).__name__}
+        record["index"] = index
+        record["seconds"] = round(time.monotonic() - started, 3)
+        return record
+
+
+def _run_remote(server: str, lines: Iterable[str], args) -> Iterator[dict]:
+    """Отправляет пакет работающему серверу (POST /batch) и читает поток результатов"""
+    import httpx
+
+    params = {"analyze": args.analyze, "no_cache": args.no_cache}
+    if args.mode:
+        params["mode"] = args.mode
+    if args.checkpoint:
+        params["checkpoint"] = args.checkpoint
+    body = "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+    with httpx.stream("POST", server.rstrip("/") + "/batch", params=params, content=body.encode("utf-8"),
+                      headers={"Content-Type": "application/x-ndjson"}, timeout=None) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL с описаниями ('-' - стандартный ввод)")
+    parser.add_argument("-o", "--output", help="файл результатов JSONL (по умолчанию - стандартный вывод)")
+    parser.add_argument("--checkpoint", help="файл контрольной точки (с --server - имя контрольной точки на сервере)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--analyze", action="store_true", help="анализировать каждую диаграмму")
+    parser.add_argument("--mode", help="режим анализа: fast, auto, full")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--server", help="адрес работающего сервера; без него модель загружается в этом процессе")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    checkpoint = None
+    counts = {STATUS_OK: 0, STATUS_ERROR: 0, "resumed": 0}
+    try:
+        if args.server:
+            records = _run_remote(args.server, source, args)
+        else:
+            # Модель, планировщик и кэши настраиваются так же, как у сервера
+            # (с MODEL_SERVER_URL - через общий сервер модели)
+            from main_server import bpmn_agent, pipeline, model_runtime, ANALYSIS_MODE
+
+            model_runtime.start()
+            if not model_runtime.wait():
+                raise SystemExit(f"Модель не загружена: {model_runtime.status()['error']}")
+            checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+            records = BatchRunner(pipeline, bpmn_agent, args.concurrency).run(
+                parse_jsonl(source), analyze=args.analyze, mode=args.mode or ANALYSIS_MODE,
+                no_cache=args.no_cache, checkpoint=checkpoint
+            )
+        for record in records:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            counts["resumed" if record.get("resumed") else record["status"]] += 1
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    print(f"Готово: {counts[STATUS_OK]}, из контрольной точки: {counts['resumed']}, "
+          f"ошибок: {counts[STATUS_ERROR]}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
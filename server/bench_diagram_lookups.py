@@ -0,0 +1,129 @@
+# bench_diagram_lookups.py
+"""
+Замер стоимости запросов к BpmnDiagramGraph на больших диаграммах:
+индексированные методы против прежних линейных проходов по графу.
+
+    python bench_diagram_lookups.py --nodes 1000 5000 20000
+
+Диаграмма строится через add_*_to_diagram, экспортируется в XML и загружается обратно
+через load_diagram_from_xml_file (если импорт bpmn_python недоступен в текущей версии
+networkx, замер идёт на построенном графе).
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import bpmn_python.bpmn_python_consts as consts
+from bpmn_python.bpmn_diagram_rep import BpmnDiagramGraph
+
+LOOKUPS = 2000
+
+
+# Прежние реализации запросов (полный проход по графу) - для сравнения
+def scan_node_by_id(graph, node_id):
+    for node in graph.diagram_graph.nodes(data=True):
+        if node[0] == node_id:
+            return node
+
+
+def scan_flow_by_id(graph, flow_id):
+    for flow in graph.diagram_graph.edges(data=True):
+        if flow[2][consts.Consts.id] == flow_id:
+            return flow
+
+
+def scan_nodes_by_type(graph, node_type):
+    return [node for node in graph.diagram_graph.nodes(data=True) if node[1][consts.Consts.type] == node_type]
+
+
+def scan_flows_by_process(graph, process_id):
+    return [flow for flow in graph.diagram_graph.edges(data=True)
+            if flow[2].get(consts.Consts.process) == process_id]
+
+
+def build_diagram(size: int) -> BpmnDiagramGraph:
+    """Цепочка задач со шлюзами каждые 10 узлов"""
+    graph = BpmnDiagramGraph()
+    graph.create_new_diagram_graph(diagram_name="bench")
+    process_id = graph.add_process_to_diagram("bench")
+    previous, _ = graph.add_start_event_to_diagram(process_id, "start")
+    for i in range(size - 2):
+        if i % 10 == 0:
+            node_id, _ = graph.add_exclusive_gateway_to_diagram(process_id, f"gateway {i}")
+        else:
+            node_id, _ = graph.add_task_to_diagram(process_id, f"task {i}")
+        graph.add_sequence_flow_to_diagram(process_id, previous, node_id)
+        previous = node_id
+    end_id, _ = graph.add_end_event_to_diagram(process_id, "end")
+    graph.add_sequence_flow_to_diagram(process_id, previous, end_id)
+    return graph
+
+
+def import_diagram(graph: BpmnDiagramGraph) -> BpmnDiagramGraph:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.bpmn")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(graph.export_xml_string())
+        imported = BpmnDiagramGraph()
+        try:
+            imported.load_diagram_from_xml_file(path)
+        except Exception as e:
+            print(f"  импорт недоступен ({type(e).__name__}: {e}), используется построенный граф")
+            return graph
+    return imported
+
+
+def timed(func, args_list) -> float:
+    """Среднее время одного вызова, мкс"""
+    started = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - started) / len(args_list) * 1e6
+
+
+def run(size: int):
+    graph = import_diagram(build_diagram(size))
+    process_id = next(iter(graph.process_elements))
+    node_ids = [node_id for node_id, _ in graph.get_nodes()]
+    flow_ids = [flow[2][consts.Consts.id] for flow in graph.get_flows()]
+    rnd = random.Random(size)
+    node_sample = [(graph, rnd.choice(node_ids)) for _ in range(LOOKUPS)]
+    flow_sample = [(graph, rnd.choice(flow_ids)) for _ in range(LOOKUPS)]
+    # Проходы по всему графу медленные - для них берём меньшую выборку
+    scan_node_sample = node_sample[:max(10, LOOKUPS * 1000 // size)]
+    scan_flow_sample = flow_sample[:max(10, LOOKUPS * 1000 // size)]
+    type_sample = [(graph, consts.Consts.exclusive_gateway)] * 20
+    process_sample = [(graph, process_id)] * 20
+
+    started = time.perf_counter()
+    graph.reindex()
+    reindex_ms = (time.perf_counter() - started) * 1e3
+
+    rows = [
+        ("get_node_by_id", timed(BpmnDiagramGraph.get_node_by_id, node_sample),
+         timed(scan_node_by_id, scan_node_sample)),
+        ("get_flow_by_id", timed(BpmnDiagramGraph.get_flow_by_id, flow_sample),
+         timed(scan_flow_by_id, scan_flow_sample)),
+        ("get_nodes(type)", timed(BpmnDiagramGraph.get_nodes, type_sample),
+         timed(scan_nodes_by_type, type_sample)),
+        ("get_flows_list_by_process_id", timed(BpmnDiagramGraph.get_flows_list_by_process_id, process_sample),
+         timed(scan_flows_by_process, process_sample)),
+    ]
+    print(f"\n{len(node_ids)} узлов, {len(flow_ids)} потоков; reindex(): {reindex_ms:.1f} мс")
+    print(f"  {'запрос':<30}{'индекс, мкс':>14}{'проход, мкс':>14}{'ускорение':>12}")
+    for name, indexed, scanned in rows:
+        print(f"  {name:<30}{indexed:>14.2f}{scanned:>14.2f}{scanned / indexed:>11.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1000, 5000, 20000])
+    args = parser.parse_args()
+    for size in args.nodes:
+        run(size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench_prompt_tokens.py
+"""
+Сравнение размера диаграммы в промпте: прежний формат (json.dumps(..., indent=2)
+с экранированием кириллицы) против компактного из prompt_format.py.
+
+    python bench_prompt_tokens.py --model path/to/model.gguf
+
+С --model токены считаются токенизатором модели (загружается только словарь);
+без него выводятся длина в символах и в байтах UTF-8.
+"""
+import argparse
+import json
+import random
+
+from process_graph import find_structural_errors
+from prompt_format import encode_diagram, encode_errors
+
+TASK_NAMES = [
+    "Принять заявку клиента", "Проверить комплектность документов", "Согласовать договор с юристом",
+    "Выставить счёт на оплату", "Отгрузить товар со склада", "Уведомить менеджера по продажам",
+    "Подготовить коммерческое предложение", "Зарегистрировать обращение", "Провести оценку рисков",
+]
+GATEWAY_NAMES = ["Документы в порядке?", "Оплата получена?", "Требуется согласование?"]
+
+
+def build_diagram(size: int, seed: int = 0) -> dict:
+    """Процесс из size элементов: цепочка задач, исключающие ветвления и параллельные блоки"""
+    rnd = random.Random(seed)
+    nodes = [{"id": "start", "name": "Начало процесса", "type": "start"}]
+    flows = []
+    last = "start"
+    i = 0
+    while len(nodes) < size - 1:
+        i += 1
+        if i % 7 == 0 and len(nodes) < size - 5:
+            kind = rnd.choice(["exclusive", "parallel"])
+            split, join = f"g{i}", f"g{i}j"
+            a, b = f"t{i}a", f"t{i}b"
+            nodes += [
+                {"id": split, "name": rnd.choice(GATEWAY_NAMES), "type": "gateway", "gateway_type": kind},
+                {"id": a, "name": rnd.choice(TASK_NAMES), "type": "task"},
+                {"id": b, "name": rnd.choice(TASK_NAMES), "type": "task"},
+                {"id": join, "name": "Слияние", "type": "gateway", "gateway_type": kind},
+            ]
+            flows += [{"source": last, "target": split}, {"source": split, "target": a},
+                      {"source": split, "target": b}, {"source": a, "target": join}, {"source": b, "target": join}]
+            last = join
+        else:
+            node_id = f"t{i}"
+            nodes.append({"id": node_id, "name": rnd.choice(TASK_NAMES), "type": "task"})
+            flows.append({"source": last, "target": node_id})
+            last = node_id
+    nodes.append({"id": "end", "name": "Процесс завершён", "type": "end"})
+    flows.append({"source": last, "target": "end"})
+    return {"nodes": nodes, "flows": flows}
+
+
+def break_diagram(data: dict, seed: int = 0) -> dict:
+    """Та же диаграмма с типичными ошибками - чтобы список ошибок был непустым"""
+    rnd = random.Random(seed)
+    flows = list(data["flows"])
+    for _ in range(max(1, len(flows) // 20)):
+        flows.pop(rnd.randrange(len(flows)))
+    return {"nodes": data["nodes"], "flows": flows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="GGUF-модель для подсчёта токенов")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 300])
+    args = parser.parse_args()
+
+    count_tokens = None
+    if args.model:
+        from llama_cpp import Llama
+        tokenizer = Llama(model_path=args.model, vocab_only=True, verbose=False)
+        count_tokens = lambda text: len(tokenizer.tokenize(text.encode("utf-8"), add_bos=False))
+
+    unit = "токенов" if count_tokens else "символов / байт"
+    print(f"{'узлов':>6}  {'формат':<10}{'диаграмма':>22}{'ошибки':>22}")
+    for size in args.sizes:
+        data = break_diagram(build_diagram(size, seed=size), seed=size)
+        errors = find_structural_errors(data)
+        variants = [
+            ("indent=2", json.dumps(data, indent=2), json.dumps(errors, indent=2)),
+            ("compact", encode_diagram(data), encode_errors(errors)),
+        ]
+        baseline = None
+        for name, diagram, error_list in variants:
+            if count_tokens:
+                cells = [count_tokens(diagram), count_tokens(error_list)]
+                text = [str(c) for c in cells]
+            else:
+                cells = [len(diagram.encode("utf-8")), len(error_list.encode("utf-8"))]
+                text = [f"{len(diagram)} / {cells[0]}", f"{len(error_list)} / {cells[1]}"]
+            ratio = "" if baseline is None else f"  x{baseline / max(sum(cells), 1):.1f} меньше"
+            baseline = baseline or sum(cells)
+            print(f"{size:>6}  {name:<10}{text[0]:>22}{text[1]:>22}{ratio}")
+    print(f"\nЕдиницы: {unit}")
+
+
+if __name__ == "__main__":
+    main()
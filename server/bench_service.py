@@ -0,0 +1,413 @@
+# bench_service.py
+"""
+Офлайн-замеры собственных накладных расходов сервиса, без GPU и без модели.
+
+Модель заменяется детерминированной FakeLlama: она воспроизводит записанные ответы
+(по умолчанию - синтетические) и может имитировать скорость обработки промпта
+и генерации. С нулевыми скоростями (по умолчанию) модель отвечает мгновенно,
+и замер показывает только время сервиса.
+
+Наборы:
+    bpmn    - сборка BpmnDiagramGraph, раскладка и экспорт XML (BPMNAgent.generate_raw_bpmn)
+    critic  - анализ CriticAgent: алгоритмический (fast) и с моделью (full)
+    routes  - маршруты FastAPI целиком (TestClient, одновременные запросы)
+
+    python bench_service.py
+    python bench_service.py --suites bpmn critic --sizes 10 100 1000 10000
+    python bench_service.py --suites routes --requests 100 --concurrency 8 --gen-tps 25 --prompt-tps 600
+    python bench_service.py --recordings completions.json --history bench_history.jsonl
+
+--recordings - JSON {"event_chain": [текст, ...], "outline": [...], "critique": [...], "patch": [...]}:
+ответы каждого вида выдаются по кругу. --history - файл JSONL, в который дописывается
+результат с хэшем коммита; новый результат сравнивается с предыдущим при тех же параметрах.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from typing import Callable, Dict, Iterator, List, Optional
+
+from bench_prompt_tokens import break_diagram, build_diagram
+
+# Символов на токен у FakeLlama: порядок величины для кириллицы у токенизаторов Qwen
+CHARS_PER_TOKEN = 3
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+# Размер цепочки в синтетическом ответе модели для маршрутов
+ROUTE_CHAIN_SIZE = 30
+
+
+def synthetic_completions(chain_size: int = ROUTE_CHAIN_SIZE) -> Dict[str, List[str]]:
+    chain = build_diagram(chain_size, seed=chain_size)
+    outline = {
+        "nodes": [
+            {"id": "start", "name": "Начало", "type": "start"},
+            {"id": "p1", "name": "Приём заявки", "type": "subprocess", "description": "Принять и проверить заявку"},
+            {"id": "p2", "name": "Исполнение", "type": "subprocess", "description": "Выполнить заказ и отгрузить"},
+            {"id": "end", "name": "Конец", "type": "end"},
+        ],
+        "flows": [{"source": "start", "target": "p1"}, {"source": "p1", "target": "p2"},
+                  {"source": "p2", "target": "end"}],
+    }
+    critique = {
+        "assessment": "Процесс в целом корректен",
+        "recommendations": ["Добавить обработку отказа клиента"],
+        "critical_issues": [],
+    }
+    patch = {"operations": [{"op": "add_node", "id": "notify", "name": "Уведомить клиента", "type": "task"}]}
+    return {kind: [json.dumps(value, ensure_ascii=False)]
+            for kind, value in (("event_chain", chain), ("outline", outline),
+                                ("critique", critique), ("patch", patch))}
+
+
+class _TokenIds(list):
+    """Токены контекста; PrefixCache сравнивает их через срез и tolist(), как массив numpy"""
+
+    def __getitem__(self, item):
+        value = super().__getitem__(item)
+        return _TokenIds(value) if isinstance(item, slice) else value
+
+    def tolist(self) -> list:
+        return list(self)
+
+
+class FakeLlama:
+    """
+    Детерминированная замена llama_cpp.Llama с тем же интерфейсом, которым пользуются
+    планировщик и кэш префиксов: вызов (в том числе stream=True), tokenize, eval, reset,
+    save_state/load_state, n_tokens и input_ids.
+
+    Вид ответа определяется по response_schema (если агент вызывает модель напрямую)
+    или по началу промпта (через планировщик, который заменяет схему грамматикой).
+    Как и llama.cpp, обрабатывает только часть промпта после общего с контекстом префикса.
+    prompt_tps и gen_tps - имитируемые скорости в токенах в секунду (0 - без задержки).
+    """
+
+    def __init__(self, completions: Dict[str, List[str]], prompt_tps: float = 0.0, gen_tps: float = 0.0):
+        self.prompt_tps = prompt_tps
+        self.gen_tps = gen_tps
+        self._completions = {kind: cycle(texts) for kind, texts in completions.items()}
+        self._prefixes: List[tuple] = []
+        self._lock = threading.Lock()
+        self.input_ids = _TokenIds()
+        self.calls = 0
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.input_ids)
+
+    def route_prefix(self, prefix: str, kind: str):
+        """Промпты, начинающиеся с prefix, получают ответы вида kind"""
+        self._prefixes.append((prefix, kind))
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        decoded = text.decode("utf-8", errors="ignore")
+        return [zlib.crc32(decoded[i:i + CHARS_PER_TOKEN].encode("utf-8"))
+                for i in range(0, len(decoded), CHARS_PER_TOKEN)]
+
+    def reset(self):
+        self.input_ids = _TokenIds()
+
+    def eval(self, tokens: List[int]):
+        self._process(list(tokens))
+
+    def save_state(self) -> list:
+        return list(self.input_ids)
+
+    def load_state(self, state: list):
+        self.input_ids = _TokenIds(state)
+
+    def __call__(self, prompt: str, stream: bool = False, response_schema: Optional[str] = None, **kwargs):
+        self.calls += 1
+        self._process(self.tokenize(prompt.encode("utf-8")))
+        # Для схем без своих ответов (hierarchical_chain у исправлений) вид - по промпту
+        kind = response_schema if response_schema in self._completions else self._kind(prompt)
+        with self._lock:
+            text = next(self._completions[kind])
+        tokens = [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+        if stream:
+            return self._stream(tokens)
+        self._sleep(len(tokens), self.gen_tps)
+        return {"choices": [{"text": text, "index": 0, "finish_reason": "stop"}]}
+
+    def _stream(self, tokens: List[str]) -> Iterator[dict]:
+        for token in tokens:
+            self._sleep(1, self.gen_tps)
+            yield {"choices": [{"text": token, "index": 0, "finish_reason": None}]}
+        yield {"choices": [{"text": "", "index": 0, "finish_reason": "stop"}]}
+
+    def _process(self, tokens: List[int]):
+        common = 0
+        for cached, token in zip(self.input_ids, tokens):
+            if cached != token:
+                break
+            common += 1
+        self._sleep(len(tokens) - common, self.prompt_tps)
+        self.input_ids = _TokenIds(tokens)
+
+    def _kind(self, prompt: str) -> str:
+        for prefix, kind in self._prefixes:
+            if prompt.startswith(prefix):
+                return kind
+        return "event_chain"
+
+    @staticmethod
+    def _sleep(tokens: int, rate: float):
+        if rate and tokens > 0:
+            time.sleep(tokens / rate)
+
+
+def make_fake_llama(args) -> FakeLlama:
+    from critic_agent import CriticAgent
+    from event_chain_agent import EventChainAgent
+
+    completions = synthetic_completions()
+    if args.recordings:
+        with open(args.recordings, encoding="utf-8") as f:
+            completions.update({kind: texts if isinstance(texts, list) else [texts]
+                                for kind, texts in json.load(f).items()})
+    fake = FakeLlama(completions, prompt_tps=args.prompt_tps, gen_tps=args.gen_tps)
+    fake.route_prefix(EventChainAgent.OUTLINE_PROMPT_PREFIX, "outline")
+    fake.route_prefix(EventChainAgent.PROMPT_PREFIX, "event_chain")
+    fake.route_prefix(CriticAgent.ANALYSIS_PROMPT_PREFIX, "critique")
+    fake.route_prefix(CriticAgent.FIXES_PROMPT_PREFIX, "event_chain")
+    fake.route_prefix(CriticAgent.PATCH_PROMPT_PREFIX, "patch")
+    return fake
+
+
+# Статистика
+def summarize(durations: List[float], wall: Optional[float] = None) -> dict:
+    """Задержки в мс (p50, p95, max) и, если задано общее время, пропускная способность"""
+    ordered = sorted(durations)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))] * 1000
+
+    result = {"n": len(ordered), "p50_ms": round(percentile(0.5), 3), "p95_ms": round(percentile(0.95), 3),
+              "max_ms": round(ordered[-1] * 1000, 3)}
+    if wall:
+        result["rps"] = round(len(ordered) / wall, 2)
+    return result
+
+
+def measure(func: Callable[[], object], repeat: int) -> List[float]:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def repeats_for(size: int, repeat: int) -> int:
+    # Большие диаграммы считаются секундами - им хватает меньшего числа повторов
+    return max(1, repeat * 100 // max(size, 100))
+
+
+# Наборы
+def bench_bpmn(args) -> Dict[str, dict]:
+    import metrics
+    from bpmn_agent import BPMNAgent
+
+    agent = BPMNAgent(store=None, persist=False)
+    results = {}
+    for size in args.sizes:
+        chain = build_diagram(size, seed=size)
+        # Разбивка по стадиям - из замеров metrics, как в заголовке Server-Timing
+        timings = metrics.start_request()
+        durations = measure(lambda: agent.generate_raw_bpmn(chain), repeats_for(size, args.repeat))
+        result = summarize(durations)
+        result["stages_ms"] = {stage: round(seconds / len(durations) * 1000, 3)
+                               for stage, seconds in timings.stages().items()}
+        results[f"bpmn/{size}"] = result
+    return results
+
+
+def bench_critic(args) -> Dict[str, dict]:
+    from critic_agent import MODE_FAST, MODE_FULL, CriticAgent
+
+    agent = CriticAgent(make_fake_llama(args))
+    results = {}
+    for size in args.sizes:
+        diagram = break_diagram(build_diagram(size, seed=size), seed=size)
+        repeat = repeats_for(size, args.repeat)
+        results[f"critic_fast/{size}"] = summarize(measure(lambda: agent.analyze_diagram(diagram, MODE_FAST), repeat))
+        results[f"critic_full/{size}"] = summarize(measure(lambda: agent.analyze_diagram(diagram, MODE_FULL), repeat))
+    return results
+
+
+def load_server(args):
+    """
+    Импортирует main_server с FakeLlama вместо модели. Если llama_cpp не установлен,
+    подставляется модуль-заглушка: грамматики не строятся, FakeLlama их и не использует.
+    """
+    fake = make_fake_llama(args)
+    try:
+        import llama_cpp
+    except ImportError:
+        llama_cpp = types.ModuleType("llama_cpp")
+        llama_cpp.LlamaGrammar = type("LlamaGrammar", (), {"from_json_schema": staticmethod(lambda *a, **k: None)})
+        sys.modules["llama_cpp"] = llama_cpp
+    # И Llama(model_path=...), и Llama.from_pretrained(...) возвращают FakeLlama
+    llama_cpp.Llama = type("Llama", (), {"__new__": lambda cls, *a, **k: fake,
+                                         "from_pretrained": classmethod(lambda cls, *a, **k: fake)})
+    workdir = tempfile.mkdtemp(prefix="bench_service_")
+    os.environ.setdefault("DIAGRAM_DB", os.path.join(workdir, "diagrams.sqlite3"))
+    os.environ.setdefault("BATCH_CHECKPOINT_DIR", os.path.join(workdir, "checkpoints"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import main_server
+    return main_server
+
+
+def route_cases(client) -> Dict[str, Callable[[], object]]:
+    """Имя -> запрос; генерация идёт без кэша ответов, кроме отдельного случая "(кэш)" """
+    chain = build_diagram(ROUTE_CHAIN_SIZE, seed=ROUTE_CHAIN_SIZE)
+    broken = break_diagram(chain, seed=1)
+    bpmn_xml = client.post("/generate-bpmn", json={"event_chain": chain, "persist": False}).json()["bpmn_xml"]
+    analysis = client.post("/analyze-diagram", json={"bpmn_json": broken, "mode": "full"}).json()
+    description = "Клиент оформляет заказ, менеджер проверяет оплату и передаёт заказ на склад"
+
+    def check(response):
+        # Ошибка потокового ответа приходит событием при статусе 200
+        if response.status_code >= 400 or "event: error" in response.text[-2000:]:
+            raise RuntimeError(f"{response.request.method} {response.request.url.path}: "
+                               f"{response.status_code} {response.text[:200]}")
+        return response
+
+    return {
+        "POST /generate-event-chain": lambda: check(client.post(
+            "/generate-event-chain", json={"process_description": description, "hierarchical": False,
+                                           "no_cache": True})),
+        "POST /generate-event-chain (кэш)": lambda: check(client.post(
+            "/generate-event-chain", json={"process_description": description, "hierarchical": False})),
+        "POST /generate-event-chain (иерархия)": lambda: check(client.post(
+            "/generate-event-chain", json={"process_description": description, "hierarchical": True,
+                                           "no_cache": True})),
+        "POST /stream/generate-event-chain": lambda: check(client.post(
+            "/stream/generate-event-chain", json={"process_description": description, "hierarchical": False,
+                                                  "no_cache": True})),
+        "POST /generate-bpmn": lambda: check(client.post(
+            "/generate-bpmn", json={"event_chain": chain, "persist": False})),
+        "POST /analyze-diagram (fast)": lambda: check(client.post(
+            "/analyze-diagram", json={"bpmn_json": broken, "mode": "fast"})),
+        "POST /analyze-diagram (full)": lambda: check(client.post(
+            "/analyze-diagram", json={"bpmn_json": broken, "mode": "full", "no_cache": True})),
+        "POST /apply-fixes": lambda: check(client.post(
+            "/apply-fixes", json={"original": broken, "analysis": analysis, "no_cache": True})),
+        "POST /import-bpmn": lambda: check(client.post(
+            "/import-bpmn", files={"file": ("bench.bpmn", bpmn_xml.encode("utf-8"), "application/xml")})),
+        "GET /diagrams": lambda: check(client.get("/diagrams")),
+    }
+
+
+def bench_routes(args) -> Dict[str, dict]:
+    from fastapi.testclient import TestClient
+
+    server = load_server(args)
+    results = {}
+    with TestClient(server.app) as client:
+        if not server.model_runtime.wait():
+            raise RuntimeError(f"Модель не загружена: {server.model_runtime.status()['error']}")
+        for name, call in route_cases(client).items():
+            durations: List[float] = []
+
+            def timed_call(_):
+                started = time.perf_counter()
+                call()
+                durations.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(timed_call, range(args.requests)))
+            results[f"route/{name}"] = summarize(durations, time.perf_counter() - started)
+    return results
+
+
+SUITES = {"bpmn": bench_bpmn, "critic": bench_critic, "routes": bench_routes}
+
+
+# Отслеживание между коммитами
+def git_revision() -> str:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_run(history_path: str, params: dict) -> Optional[dict]:
+    if not os.path.exists(history_path):
+        return None
+    previous = None
+    with open(history_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("params") == params:
+                previous = record
+    return previous
+
+
+def print_results(results: Dict[str, dict], previous: Optional[dict]):
+    baseline = previous["results"] if previous else {}
+    header = f"{'замер':<44}{'n':>5}{'p50, мс':>11}{'p95, мс':>11}{'запр/с':>9}"
+    if previous:
+        header += f"{'p50 vs ' + previous['commit']:>22}"
+    print(header)
+    for name, result in results.items():
+        line = (f"{name:<44}{result['n']:>5}{result['p50_ms']:>11.2f}{result['p95_ms']:>11.2f}"
+                f"{result['rps'] if 'rps' in result else '':>9}")
+        before = baseline.get(name)
+        if before and before["p50_ms"]:
+            line += f"{(result['p50_ms'] / before['p50_ms'] - 1) * 100:>+21.1f}%"
+        print(line)
+        if "stages_ms" in result:
+            print("    " + ", ".join(f"{stage} {ms:.2f}" for stage, ms in result["stages_ms"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suites", nargs="+", choices=list(SUITES), default=list(SUITES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="размеры диаграмм (узлов)")
+    parser.add_argument("--repeat", type=int, default=20, help="повторов для диаграмм до 100 узлов")
+    parser.add_argument("--requests", type=int, default=50, help="запросов на маршрут")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных запросов к маршруту")
+    parser.add_argument("--prompt-tps", type=float, default=0.0, help="имитируемая обработка промпта, токенов/с")
+    parser.add_argument("--gen-tps", type=float, default=0.0, help="имитируемая генерация, токенов/с")
+    parser.add_argument("--recordings", help="JSON с записанными ответами модели по видам")
+    parser.add_argument("--history", help="JSONL истории результатов по коммитам")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    # Пути к static/ и модулям сервера считаются от каталога скрипта
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    results: Dict[str, dict] = {}
+    for suite in args.suites:
+        results.update(SUITES[suite](args))
+
+    params = {key: getattr(args, key) for key in ("suites", "sizes", "repeat", "requests", "concurrency",
+                                                  "prompt_tps", "gen_tps", "recordings")}
+    record = {"commit": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "params": params, "results": results}
+    previous = previous_run(args.history, params) if args.history else None
+    if args.json:
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+    else:
+        print_results(results, previous)
+    if args.history:
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,47 @@
 import os
+import copy
+import uuid
 import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 import bpmn_python.bpmn_python_consts as consts
 from bpmn_python.bpmn_diagram_rep import BpmnDiagramGraph
+from bpmn_layout import layout_diagram
+from diagram_store import DiagramStore
+from metrics import timed
 from datetime import datetime
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Как часто повторять поиск диаграммы, которую дописывает другой веб-процесс (см. load_diagram)
+STORE_RETRY_INTERVAL = 0.1
+
 class BPMNAgent:
-    def __init__(self, client=None):
+    """
+    XML диаграммы собирается в памяти и возвращается сразу; сохранение в хранилище
+    (вместе с цепочкой событий) выполняется фоновым потоком и на время ответа не влияет.
+    output_dir - каталог файлов, сохранённых до появления хранилища; из него диаграммы только читаются.
+    """
+
+    def __init__(self, client=None, store: Optional[DiagramStore] = None,
+                 output_dir: str = "exported_diagrams/", persist: bool = True):
         self.client = client
-
-    def generate_raw_bpmn(self, bpmn_data: dict, filename: str = None) -> Tuple[str, str]:
+        self.store = store
+        self.output_dir = output_dir
+        self.persist = persist
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bpmn-writer")
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def generate_raw_bpmn(self, bpmn_data: dict, filename: str = None,
+                          persist: Optional[bool] = None, description: Optional[str] = None) -> Tuple[str, str]:
         """
-        Генерирует "сырую" BPMN-диаграмму (без ручных координат).
+        Генерирует BPMN-диаграмму с готовой раскладкой (координаты узлов и ломаные потоков в DI).
         Возвращает кортеж (bpmn_xml, filename).
+        persist=None - сохранять ли диаграмму, решает настройка агента. Повторное сохранение
+        под тем же именем добавляет версию; description - исходное описание процесса для поиска.
         """
         try:
             logger.info("Начало генерации сырого BPMN")
@@ -23,84 +50,162 @@ class BPMNAgent:
                 raise ValueError("Ожидался словарь, но получен другой тип данных")
 
             # Создание нового графа диаграммы
-            bpmn_graph = BpmnDiagramGraph()
-            bpmn_graph.create_new_diagram_graph(diagram_name="Process")
-            process_id = bpmn_graph.add_process_to_diagram("MainProcess")
-            node_map = {}
+            with timed("bpmn_build"):
+                bpmn_graph = BpmnDiagramGraph()
+                bpmn_graph.create_new_diagram_graph(diagram_name="Process")
+                process_id = bpmn_graph.add_process_to_diagram("MainProcess")
+                self._add_elements(bpmn_graph, process_id, bpmn_data)
 
-            # Добавляем узлы
-            for node in bpmn_data.get("nodes", []):
-                node_type = node.get("type")
-                node_name = node.get("name", "Unnamed")
-
-                if node_type == "start":
-                    node_id, _ = bpmn_graph.add_start_event_to_diagram(
-                        process_id,
-                        node_name,
-                        start_event_definition="message"
-                    )
-                elif node_type == "end":
-                    node_id, _ = bpmn_graph.add_end_event_to_diagram(
-                        process_id,
-                        node_name,
-                        end_event_definition="terminate"
-                    )
-                elif node_type == "gateway":
-                    gateway_type = node.get("gateway_type")
-                    if gateway_type == "exclusive":
-                        node_id, _ = bpmn_graph.add_exclusive_gateway_to_diagram(
-                            process_id,
-                            node_name,
-                            gateway_direction="Diverging"
-                        )
-                    else:
-                        node_id, _ = bpmn_graph.add_parallel_gateway_to_diagram(
-                            process_id,
-                            node_name,
-                            gateway_direction="Diverging"
-                        )
-                else:
-                    node_id, _ = bpmn_graph.add_task_to_diagram(
-                        process_id,
-                        node_name
-                    )
-
-                node_map[node["id"]] = node_id
-
-            # Добавляем потоки
-            for flow in bpmn_data.get("flows", []):
-                src = node_map.get(flow["source"])
-                trg = node_map.get(flow["target"])
-                if src and trg:
-                    bpmn_graph.add_sequence_flow_to_diagram(
-                        process_id,
-                        src,
-                        trg,
-                        "Flow"
-                    )
+            # Раскладка на сервере: клиенту остаётся только отрисовать XML
+            with timed("bpmn_layout"):
+                layout_diagram(bpmn_graph)
 
             # Подготовка имени файла
             if not filename:
+                # Суффикс исключает совпадение имён у диаграмм, созданных в одну секунду
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"diagram_{timestamp}.bpmn"
-
-            output_dir = "exported_diagrams/"
-            os.makedirs(output_dir, exist_ok=True)
-            bpmn_graph.export_xml_file(output_dir, filename)
-
-            file_path = os.path.join(output_dir, filename)
+                filename = f"diagram_{timestamp}_{uuid.uuid4().hex[:8]}.bpmn"
 
-            # Проверяем, что файл есть
-            if not os.path.exists(file_path):
-                logger.error("BPMN-файл не найден после экспорта: %s", file_path)
-                raise FileNotFoundError(f"BPMN-файл не создан: {file_path}")
+            # Сериализуем в строку, без записи и повторного чтения файла
+            with timed("xml_export"):
+                bpmn_xml = bpmn_graph.export_xml_string()
 
-            # Читаем и возвращаем XML
-            with open(file_path, "r", encoding="utf-8") as f:
-                bpmn_xml = f.read()
+            if self.store is not None and (self.persist if persist is None else persist):
+                self._save_async(filename, bpmn_xml, copy.deepcopy(bpmn_data), description)
 
             return bpmn_xml, filename
 
         except Exception as e:
             logger.error("Ошибка генерации сырого BPMN: %s", e, exc_info=True)
             raise
+
+    def _add_elements(self, bpmn_graph: BpmnDiagramGraph, process_id: str, bpmn_data: dict):
+        """
+        Добавляет узлы и потоки цепочки в процесс. Узел type="subprocess" со своими "nodes"
+        и "flows" становится развёрнутым подпроцессом, содержимое добавляется в него рекурсивно.
+        ID узлов сопоставляются в пределах одного уровня - потоки не пересекают границу подпроцесса.
+        """
+        node_map = {}
+
+        # Добавляем узлы
+        for node in bpmn_data.get("nodes", []):
+            node_type = node.get("type")
+            node_name = node.get("name", "Unnamed")
+
+            if node_type == "start":
+                node_id, _ = bpmn_graph.add_start_event_to_diagram(
+                    process_id,
+                    node_name,
+                    start_event_definition="message"
+                )
+            elif node_type == "end":
+                node_id, _ = bpmn_graph.add_end_event_to_diagram(
+                    process_id,
+                    node_name,
+                    end_event_definition="terminate"
+                )
+            elif node_type == "gateway":
+                gateway_type = node.get("gateway_type")
+                if gateway_type == "exclusive":
+                    node_id, _ = bpmn_graph.add_exclusive_gateway_to_diagram(
+                        process_id,
+                        node_name,
+                        gateway_direction="Diverging"
+                    )
+                else:
+                    node_id, _ = bpmn_graph.add_parallel_gateway_to_diagram(
+                        process_id,
+                        node_name,
+                        gateway_direction="Diverging"
+                    )
+            elif node_type == "subprocess":
+                node_id, _ = bpmn_graph.add_subprocess_to_diagram(
+                    process_id,
+                    node_name,
+                    is_expanded=bool(node.get("nodes"))
+                )
+                self._add_elements(bpmn_graph, node_id, node)
+            else:
+                node_id, _ = bpmn_graph.add_task_to_diagram(
+                    process_id,
+                    node_name
+                )
+
+            node_map[node["id"]] = node_id
+
+        # Добавляем потоки
+        for flow in bpmn_data.get("flows", []):
+            src = node_map.get(flow["source"])
+            trg = node_map.get(flow["target"])
+            if src and trg:
+                bpmn_graph.add_sequence_flow_to_diagram(
+                    process_id,
+                    src,
+                    trg,
+                    "Flow"
+                )
+
+    def load_diagram(self, filename: str, timeout: Optional[float] = None, retry: float = 0.0) -> Optional[str]:
+        """
+        XML последней версии сохранённой диаграммы или None. Если запись ещё идёт - дожидается её,
+        чтобы /diagram/{file_name} сразу после генерации не получал 404.
+        Об идущей записи знает только процесс, который её начал; при нескольких веб-процессах
+        retry - сколько секунд повторять поиск в общем хранилище, прежде чем вернуть None.
+        """
+        with self._lock:
+            pending = self._pending.get(filename)
+        if pending is not None:
+            try:
+                pending.result(timeout=timeout)
+            except Exception:
+                pass
+        deadline = time.monotonic() + retry
+        while True:
+            if self.store is not None:
+                record = self.store.get(filename, with_chain=False)
+                if record is not None:
+                    return record["bpmn_xml"]
+            path = os.path.join(self.output_dir, filename)
+            if os.path.basename(filename) == filename and os.path.isfile(path):
+                return self._load_legacy(path)
+            if self.store is None or pending is not None or time.monotonic() >= deadline:
+                return None
+            time.sleep(STORE_RETRY_INTERVAL)
+
+    def _load_legacy(self, path: str) -> str:
+        """
+        Файлы из output_dir сохранялись без раскладки (её делал клиент), поэтому
+        раскладка выполняется при чтении. Если файл не разбирается - отдаётся как есть.
+        """
+        try:
+            bpmn_graph = BpmnDiagramGraph()
+            bpmn_graph.load_diagram_from_xml_file(path)
+            with timed("bpmn_layout"):
+                layout_diagram(bpmn_graph)
+            return bpmn_graph.export_xml_string()
+        except Exception:
+            logger.warning("Не удалось разложить диаграмму %s, отдаётся без изменений", path, exc_info=True)
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+
+    def shutdown(self):
+        """Дожидается незавершённых записей"""
+        self._writer.shutdown(wait=True)
+
+    def _save_async(self, filename: str, bpmn_xml: str, chain: dict, description: Optional[str]):
+        with self._lock:
+            future = self._writer.submit(self._write, filename, bpmn_xml, chain, description)
+            self._pending[filename] = future
+        future.add_done_callback(lambda f: self._forget(filename, f))
+
+    def _forget(self, filename: str, future: Future):
+        with self._lock:
+            if self._pending.get(filename) is future:
+                del self._pending[filename]
+
+    def _write(self, filename: str, bpmn_xml: str, chain: dict, description: Optional[str]):
+        try:
+            self.store.save(filename, bpmn_xml, chain, description)
+        except Exception:
+            logger.exception("Не удалось сохранить диаграмму %s", filename)
+            raise
@@ -3,6 +3,7 @@
 Package with BPMNDiagramGraph - graph representation of BPMN diagram
 """
 import uuid
+import xml.etree.ElementTree as eTree
 
 import networkx as nx
 
@@ -35,6 +36,10 @@ class BpmnDiagramGraph(object):
     an ID of process, value is a dictionary of all process attributes,
     - diagram_attributes - dictionary that contains BPMN diagram element attributes,
     - plane_attributes - dictionary that contains BPMN plane element attributes.
+
+    Querying methods use secondary indexes (flow ID -> edge, node type -> node IDs, process ID -> nodes / flows)
+    instead of scanning the whole graph. Indexes are updated by add_*_to_diagram methods and rebuilt after import.
+    If diagram_graph is modified directly, call reindex() (only adding or removing nodes is detected automatically).
     """
 
     # String "constants" used in multiple places
@@ -51,16 +56,21 @@ class BpmnDiagramGraph(object):
         self.diagram_attributes = {}
         self.plane_attributes = {}
         self.collaboration = {}
+        self._reset_indexes()
 
     def load_diagram_from_xml_file(self, filepath):
         """
         Reads an XML file from given filepath and maps it into inner representation of BPMN diagram.
         Returns an instance of BPMNDiagramGraph class.
 
-        :param filepath: string with output filepath.
+        :param filepath: string with output filepath or a binary file-like object (parsed by minidom).
         """
-
+        # Importer uses Graph.node and Graph.edge, which were removed in networkx 2.4
+        if not hasattr(self.diagram_graph, "node"):
+            self.diagram_graph.node = self.diagram_graph.nodes
+            self.diagram_graph.edge = self.diagram_graph.adj
         bpmn_import.BpmnDiagramGraphImport.load_diagram_from_xml(filepath, self)
+        self.reindex()
 
     def export_xml_file(self, directory, filename):
         """
@@ -71,6 +81,83 @@ class BpmnDiagramGraph(object):
         """
         bpmn_export.BpmnDiagramGraphExport.export_xml_file(directory, filename, self)
 
+    def export_xml_string(self):
+        """
+        Exports diagram inner graph to BPMN 2.0 XML string (with Diagram Interchange data) without writing any file.
+        Returns the same document that export_xml_file writes to disk.
+
+        :return: string with BPMN 2.0 XML document.
+        """
+        definitions = self.export_xml_tree()
+        return eTree.tostring(definitions, encoding="utf-8", xml_declaration=True).decode("utf-8")
+
+    def export_xml_tree(self):
+        """
+        Builds BPMN 2.0 XML element tree (with Diagram Interchange data) for diagram inner graph.
+        Mirrors BpmnDiagramGraphExport.export_xml_file, but keeps the result in memory.
+
+        :return: 'definitions' XML element, root of BPMN 2.0 document.
+        """
+        exporter = bpmn_export.BpmnDiagramGraphExport
+        definitions = exporter.export_definitions_element()
+        [_, plane] = exporter.export_diagram_plane_elements(definitions, self.diagram_attributes,
+                                                            self.plane_attributes)
+
+        collaboration = self.collaboration
+        if collaboration is not None and len(collaboration) > 0:
+            collaboration_xml = eTree.SubElement(definitions, consts.Consts.collaboration)
+            collaboration_xml.set(consts.Consts.id, collaboration[consts.Consts.id])
+
+            for message_flow_id, message_flow_attr in collaboration[consts.Consts.message_flows].items():
+                message_flow = eTree.SubElement(collaboration_xml, consts.Consts.message_flow)
+                message_flow.set(consts.Consts.id, message_flow_id)
+                message_flow.set(consts.Consts.name, message_flow_attr[consts.Consts.name])
+                message_flow.set(consts.Consts.source_ref, message_flow_attr[consts.Consts.source_ref])
+                message_flow.set(consts.Consts.target_ref, message_flow_attr[consts.Consts.target_ref])
+
+                message_flow_params = self.get_flow_by_id(message_flow_id)[2]
+                output_flow = eTree.SubElement(plane, exporter.bpmndi_namespace + consts.Consts.bpmn_edge)
+                output_flow.set(consts.Consts.id, message_flow_id + "_gui")
+                output_flow.set(consts.Consts.bpmn_element, message_flow_id)
+                for waypoint in message_flow_params[consts.Consts.waypoints]:
+                    waypoint_element = eTree.SubElement(output_flow, "omgdi:waypoint")
+                    waypoint_element.set(consts.Consts.x, waypoint[0])
+                    waypoint_element.set(consts.Consts.y, waypoint[1])
+
+            for participant_id, participant_attr in collaboration[consts.Consts.participants].items():
+                participant = eTree.SubElement(collaboration_xml, consts.Consts.participant)
+                participant.set(consts.Consts.id, participant_id)
+                participant.set(consts.Consts.name, participant_attr[consts.Consts.name])
+                participant.set(consts.Consts.process_ref, participant_attr[consts.Consts.process_ref])
+
+                output_element_di = eTree.SubElement(plane, exporter.bpmndi_namespace + consts.Consts.bpmn_shape)
+                output_element_di.set(consts.Consts.id, participant_id + "_gui")
+                output_element_di.set(consts.Consts.bpmn_element, participant_id)
+                output_element_di.set(consts.Consts.is_horizontal, participant_attr[consts.Consts.is_horizontal])
+                bounds = eTree.SubElement(output_element_di, "omgdc:Bounds")
+                bounds.set(consts.Consts.width, participant_attr[consts.Consts.width])
+                bounds.set(consts.Consts.height, participant_attr[consts.Consts.height])
+                bounds.set(consts.Consts.x, participant_attr[consts.Consts.x])
+                bounds.set(consts.Consts.y, participant_attr[consts.Consts.y])
+
+        for process_id, process_element_attr in self.process_elements.items():
+            process = exporter.export_process_element(definitions, process_id, process_element_attr)
+            if consts.Consts.lane_set in process_element_attr:
+                exporter.export_lane_set(process, process_element_attr[consts.Consts.lane_set], plane)
+            for node_id, params in self.get_nodes_list_by_process_id(process_id):
+                exporter.export_node_data(self, node_id, params, process)
+            for flow in self.get_flows_list_by_process_id(process_id):
+                exporter.export_flow_process_data(flow[2], process)
+
+        # Export DI data
+        for node_id, params in self.get_nodes():
+            exporter.export_node_di_data(node_id, params, plane)
+        for flow in self.get_flows():
+            exporter.export_flow_di_data(flow[2], plane)
+
+        exporter.indent(definitions)
+        return definitions
+
     def export_xml_file_no_di(self, directory, filename):
         """
         Exports diagram inner graph to BPMN 2.0 XML file (without Diagram Interchange data).
@@ -89,6 +176,7 @@ class BpmnDiagramGraph(object):
         """
 
         bpmn_csv_import.BpmnDiagramGraphCSVImport.load_diagram_from_csv(filepath, self)
+        self.reindex()
 
     def export_csv_file(self, directory, filename):
         """
@@ -107,15 +195,11 @@ class BpmnDiagramGraph(object):
 
         :param node_type: string with valid BPMN XML tag name (e.g. 'task', 'sequenceFlow').
         """
-        tmp_nodes = self.diagram_graph.nodes(True)
         if node_type == "":
-            return tmp_nodes
-        else:
-            nodes = []
-            for node in tmp_nodes:
-                if node[1][consts.Consts.type] == node_type:
-                    nodes.append(node)
-            return nodes
+            return self.diagram_graph.nodes(True)
+        self._ensure_indexes()
+        graph_nodes = self.diagram_graph.nodes
+        return [(node_id, graph_nodes[node_id]) for node_id in self._nodes_by_type.get(node_type, ())]
 
     def get_nodes_list_by_process_id(self, process_id):
         """
@@ -124,12 +208,9 @@ class BpmnDiagramGraph(object):
 
         :param process_id: string object, representing an ID of parent process element.
         """
-        tmp_nodes = self.diagram_graph.nodes(True)
-        nodes = []
-        for node in tmp_nodes:
-            if node[1][consts.Consts.process] == process_id:
-                nodes.append(node)
-        return nodes
+        self._ensure_indexes()
+        graph_nodes = self.diagram_graph.nodes
+        return [(node_id, graph_nodes[node_id]) for node_id in self._nodes_by_process.get(process_id, ())]
 
     def get_node_by_id(self, node_id):
         """
@@ -138,10 +219,8 @@ class BpmnDiagramGraph(object):
 
         :param node_id: string with ID of node.
         """
-        tmp_nodes = self.diagram_graph.nodes(data=True)
-        for node in tmp_nodes:
-            if node[0] == node_id:
-                return node
+        if node_id in self.diagram_graph:
+            return node_id, self.diagram_graph.nodes[node_id]
 
     def get_nodes_id_list_by_type(self, node_type):
         """
@@ -150,12 +229,8 @@ class BpmnDiagramGraph(object):
 
         :param node_type: string with valid BPMN XML tag name (e.g. 'task', 'sequenceFlow').
         """
-        tmp_nodes = self.diagram_graph.nodes(data=True)
-        id_list = []
-        for node in tmp_nodes:
-            if node[1][consts.Consts.type] == node_type:
-                id_list.append(node[0])
-        return id_list
+        self._ensure_indexes()
+        return list(self._nodes_by_type.get(node_type, ()))
 
     def get_flows(self):
         """
@@ -172,10 +247,10 @@ class BpmnDiagramGraph(object):
 
         :param flow_id: string with edge ID.
         """
-        tmp_flows = self.diagram_graph.edges(data=True)
-        for flow in tmp_flows:
-            if flow[2][consts.Consts.id] == flow_id:
-                return flow
+        self._ensure_indexes()
+        edge = self._flows_by_id.get(flow_id)
+        if edge is not None:
+            return self._flow_tuple(edge)
 
     def get_flows_list_by_process_id(self, process_id):
         """
@@ -184,12 +259,62 @@ class BpmnDiagramGraph(object):
 
         :param process_id: string object, representing an ID of parent process element.
         """
-        tmp_flows = self.diagram_graph.edges(data=True)
-        flows = []
-        for flow in tmp_flows:
-            if consts.Consts.process in flow[2] and flow[2][consts.Consts.process] == process_id:
-                flows.append(flow)
-        return flows
+        self._ensure_indexes()
+        return [self._flow_tuple(self._flows_by_id[flow_id]) for flow_id in self._flows_by_process.get(process_id, ())]
+
+    # Secondary indexes
+    def reindex(self):
+        """
+        Rebuilds secondary indexes used by querying methods from current content of diagram_graph.
+        Must be called after diagram_graph was modified directly (not through add_*_to_diagram methods).
+        """
+        self._reset_indexes()
+        for node_id, node_attrs in self.diagram_graph.nodes(data=True):
+            self._index_node(node_id, node_attrs)
+        for source_id, target_id, flow_attrs in self.diagram_graph.edges(data=True):
+            self._index_flow(source_id, target_id, flow_attrs)
+        self._indexed_nodes = self.diagram_graph.number_of_nodes()
+
+    def _reset_indexes(self):
+        # Dictionaries with None values are used as insertion-ordered sets
+        self._flows_by_id = {}
+        self._nodes_by_type = {}
+        self._nodes_by_process = {}
+        self._flows_by_process = {}
+        self._indexed_nodes = 0
+
+    def _ensure_indexes(self):
+        """
+        Cheap consistency check: number of nodes differs from indexed one only if graph was changed bypassing
+        add_* methods. Number of edges is not compared, networkx counts edges in linear time.
+        """
+        if self._indexed_nodes != self.diagram_graph.number_of_nodes():
+            self.reindex()
+
+    def _index_node(self, node_id, node_attrs):
+        self._nodes_by_type.setdefault(node_attrs.get(consts.Consts.type), {})[node_id] = None
+        self._nodes_by_process.setdefault(node_attrs.get(consts.Consts.process), {})[node_id] = None
+
+    def _unindex_node(self, node_id, node_attrs):
+        self._nodes_by_type.get(node_attrs.get(consts.Consts.type), {}).pop(node_id, None)
+        self._nodes_by_process.get(node_attrs.get(consts.Consts.process), {}).pop(node_id, None)
+
+    def _index_flow(self, source_id, target_id, flow_attrs):
+        flow_id = flow_attrs.get(consts.Consts.id)
+        if flow_id is None:
+            return
+        self._flows_by_id[flow_id] = (source_id, target_id)
+        if consts.Consts.process in flow_attrs:
+            self._flows_by_process.setdefault(flow_attrs[consts.Consts.process], {})[flow_id] = None
+
+    def _unindex_flow(self, flow_attrs):
+        flow_id = flow_attrs.get(consts.Consts.id)
+        self._flows_by_id.pop(flow_id, None)
+        self._flows_by_process.get(flow_attrs.get(consts.Consts.process), {}).pop(flow_id, None)
+
+    def _flow_tuple(self, edge):
+        source_id, target_id = edge
+        return source_id, target_id, self.diagram_graph[source_id][target_id]
 
     # Diagram creating methods
     def create_new_diagram_graph(self, diagram_name=""):
@@ -250,6 +375,9 @@ class BpmnDiagramGraph(object):
         """
         if node_id is None:
             node_id = BpmnDiagramGraph.id_prefix + str(uuid.uuid4())
+        self._ensure_indexes()
+        if node_id in self.diagram_graph:
+            self._unindex_node(node_id, self.diagram_graph.nodes[node_id])
         self.diagram_graph.add_node(node_id)
         self.diagram_graph.nodes[node_id][consts.Consts.id] = node_id
         self.diagram_graph.nodes[node_id][consts.Consts.type] = node_type
@@ -263,6 +391,9 @@ class BpmnDiagramGraph(object):
         self.diagram_graph.nodes[node_id][consts.Consts.height] = "100"
         self.diagram_graph.nodes[node_id][consts.Consts.x] = str(x)
         self.diagram_graph.nodes[node_id][consts.Consts.y] = str(y)
+
+        self._index_node(node_id, self.diagram_graph.nodes[node_id])
+        self._indexed_nodes = self.diagram_graph.number_of_nodes()
         return node_id, self.diagram_graph.nodes[node_id]
 
     def add_task_to_diagram(self, process_id, task_name="", node_id=None):
@@ -497,6 +628,10 @@ class BpmnDiagramGraph(object):
         self.sequence_flows[sequence_flow_id] = {consts.Consts.name: sequence_flow_name,
                                                  consts.Consts.source_ref: source_ref_id,
                                                  consts.Consts.target_ref: target_ref_id}
+        self._ensure_indexes()
+        if self.diagram_graph.has_edge(source_ref_id, target_ref_id):
+            # Graph keeps a single edge per pair of nodes, previous flow is replaced
+            self._unindex_flow(self.diagram_graph[source_ref_id][target_ref_id])
         self.diagram_graph.add_edge(source_ref_id, target_ref_id)
         flow = self.diagram_graph[source_ref_id][target_ref_id]
         flow[consts.Consts.id] = sequence_flow_id
@@ -515,6 +650,8 @@ class BpmnDiagramGraph(object):
 
         # add source node (source_ref_id) as incoming node to target node (target_ref_id)
         target_node[consts.Consts.incoming_flow].append(sequence_flow_id)
+
+        self._index_flow(source_ref_id, target_ref_id, flow)
         return sequence_flow_id, flow
 
     def get_nodes_positions(self):
@@ -0,0 +1,126 @@
+# bpmn_import.py
+import copy
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from xml.parsers.expat import ExpatError
+
+import bpmn_python.bpmn_python_consts as consts
+from bpmn_python.bpmn_diagram_rep import BpmnDiagramGraph
+
+logger = logging.getLogger(__name__)
+
+# Типы элементов BPMN -> типы цепочки событий; неизвестные виды задач считаются задачами
+EVENT_TYPES = {
+    consts.Consts.start_event: "start",
+    consts.Consts.end_event: "end",
+    consts.Consts.intermediate_catch_event: "intermediate",
+    consts.Consts.intermediate_throw_event: "intermediate",
+    consts.Consts.boundary_event: "intermediate",
+}
+# Цепочка различает только исключающие и параллельные шлюзы; остальные ближе к исключающим
+GATEWAY_TYPES = {
+    consts.Consts.exclusive_gateway: "exclusive",
+    consts.Consts.inclusive_gateway: "exclusive",
+    consts.Consts.event_based_gateway: "exclusive",
+    consts.Consts.complex_gateway: "exclusive",
+    consts.Consts.parallel_gateway: "parallel",
+}
+# Не являются шагами процесса
+SKIPPED_TYPES = {consts.Consts.participant, consts.Consts.data_object, consts.Consts.lane}
+
+
+class DiagramImporter:
+    """
+    Преобразование BPMN XML (сохранённого или загруженного из другого редактора) в цепочку
+    {"nodes": [...], "flows": [...]}, с которой работают анализ и исправления.
+    Результаты хранятся в LRU по SHA-256 содержимого: повторный анализ того же файла
+    не разбирает XML вовсе.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def load_file(self, path: str) -> Tuple[dict, str]:
+        with open(path, "rb") as f:
+            return self.load_bytes(f.read())
+
+    def load_bytes(self, content: bytes) -> Tuple[dict, str]:
+        """Возвращает (цепочка событий, хэш содержимого); некорректный BPMN - ValueError"""
+        content_hash = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            chain = self._entries.get(content_hash)
+            if chain is not None:
+                self._entries.move_to_end(content_hash)
+                self._stats["hits"] += 1
+                return copy.deepcopy(chain), content_hash
+            self._stats["misses"] += 1
+
+        chain = parse_bpmn(content)
+        with self._lock:
+            self._entries[content_hash] = chain
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return copy.deepcopy(chain), content_hash
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "max_entries": self.max_entries}
+
+
+def parse_bpmn(content: bytes) -> dict:
+    bpmn_graph = BpmnDiagramGraph()
+    try:
+        bpmn_graph.load_diagram_from_xml_file(io.BytesIO(content))
+    except (ExpatError, IndexError, KeyError) as e:
+        # IndexError - нет BPMNDiagram/BPMNPlane, KeyError - ссылка на несуществующий элемент
+        raise ValueError(f"Некорректный BPMN-файл: {e}") from e
+    nodes, flows = [], []
+    for process_id in bpmn_graph.process_elements:
+        chain = _container_chain(bpmn_graph, process_id)
+        nodes += chain["nodes"]
+        flows += chain["flows"]
+    return {"nodes": nodes, "flows": flows}
+
+
+def _container_chain(bpmn_graph: BpmnDiagramGraph, container_id: str) -> dict:
+    """Узлы и потоки процесса или подпроцесса; подпроцесс с содержимым получает вложенные nodes/flows"""
+    nodes = []
+    for node_id, attrs in bpmn_graph.get_nodes_list_by_process_id(container_id):
+        node = _convert_node(bpmn_graph, node_id, attrs)
+        if node is not None:
+            nodes.append(node)
+    known = {node["id"] for node in nodes}
+    flows = []
+    for _, _, attrs in bpmn_graph.get_flows_list_by_process_id(container_id):
+        source, target = attrs.get(consts.Consts.source_ref), attrs.get(consts.Consts.target_ref)
+        if source in known and target in known:
+            flows.append({"source": source, "target": target})
+    return {"nodes": nodes, "flows": flows}
+
+
+def _convert_node(bpmn_graph: BpmnDiagramGraph, node_id: str, attrs: dict) -> Optional[dict]:
+    bpmn_type = attrs.get(consts.Consts.type)
+    if bpmn_type in SKIPPED_TYPES:
+        return None
+    node = {"id": node_id, "name": attrs.get(consts.Consts.node_name) or ""}
+    if bpmn_type in EVENT_TYPES:
+        node["type"] = EVENT_TYPES[bpmn_type]
+    elif bpmn_type in GATEWAY_TYPES:
+        node["type"] = "gateway"
+        node["gateway_type"] = GATEWAY_TYPES[bpmn_type]
+    elif bpmn_type == consts.Consts.subprocess:
+        node["type"] = "subprocess"
+        inner = _container_chain(bpmn_graph, node_id)
+        if inner["nodes"]:
+            node.update(inner)
+    else:
+        node["type"] = "task"
+    return node
@@ -0,0 +1,353 @@
+# bpmn_layout.py
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import bpmn_python.bpmn_python_consts as consts
+
+logger = logging.getLogger(__name__)
+
+# Размеры фигур (ширина, высота) как в bpmn-js
+TASK_SIZE = (100, 80)
+EVENT_SIZE = (36, 36)
+GATEWAY_SIZE = (50, 50)
+SHAPE_SIZES = {
+    consts.Consts.start_event: EVENT_SIZE,
+    consts.Consts.end_event: EVENT_SIZE,
+    consts.Consts.intermediate_catch_event: EVENT_SIZE,
+    consts.Consts.intermediate_throw_event: EVENT_SIZE,
+    consts.Consts.boundary_event: EVENT_SIZE,
+    consts.Consts.exclusive_gateway: GATEWAY_SIZE,
+    consts.Consts.parallel_gateway: GATEWAY_SIZE,
+    consts.Consts.inclusive_gateway: GATEWAY_SIZE,
+    consts.Consts.event_based_gateway: GATEWAY_SIZE,
+    consts.Consts.complex_gateway: GATEWAY_SIZE,
+}
+
+MARGIN = 50
+LAYER_GAP = 80       # расстояние между слоями по горизонтали
+NODE_GAP = 40        # расстояние между узлами слоя по вертикали
+PROCESS_GAP = 120    # расстояние между процессами (пулами)
+ORDER_SWEEPS = 8     # проходов минимизации пересечений
+PLACEMENT_SWEEPS = 3  # проходов выравнивания по вертикали
+SELF_LOOP_OFFSET = 20
+SUBPROCESS_PADDING = 20   # отступ содержимого развёрнутого подпроцесса от рамки
+SUBPROCESS_HEADER = 20    # место под имя подпроцесса над содержимым
+
+
+def layout_diagram(bpmn_graph) -> None:
+    """
+    Послойная (Sugiyama) раскладка диаграммы слева направо:
+    разрыв циклов, назначение слоёв, минимизация пересечений, расчёт координат
+    и ортогональные ломаные для потоков. Результат записывается в DI-атрибуты
+    узлов (x, y, width, height) и потоков (waypoints); процессы располагаются друг под другом.
+    Развёрнутые подпроцессы раскладываются изнутри наружу: размер рамки определяется содержимым.
+    """
+    top = MARGIN
+    for process_id in bpmn_graph.process_elements:
+        extent = _layout_container(bpmn_graph, process_id, MARGIN, top)
+        if extent is not None:
+            top = extent[1] + PROCESS_GAP
+
+
+def _layout_container(bpmn_graph, container_id: str, left: float, top: float) -> Optional[Tuple[float, float]]:
+    """Раскладывает узлы процесса или подпроцесса; возвращает (правый край, нижний край) или None, если узлов нет"""
+    nodes = [node_id for node_id, _ in bpmn_graph.get_nodes_list_by_process_id(container_id)]
+    if not nodes:
+        return None
+    # Сначала содержимое подпроцессов - в собственных координатах от нуля
+    sizes = {}
+    for node_id in nodes:
+        if bpmn_graph.diagram_graph.nodes[node_id][consts.Consts.type] != consts.Consts.subprocess:
+            continue
+        extent = _layout_container(bpmn_graph, node_id, 0, 0)
+        if extent is not None:
+            sizes[node_id] = (extent[0] + 2 * SUBPROCESS_PADDING,
+                              extent[1] + 2 * SUBPROCESS_PADDING + SUBPROCESS_HEADER)
+    flows = [flow[2] for flow in bpmn_graph.get_flows_list_by_process_id(container_id)]
+    extent = _LayeredLayout(bpmn_graph, nodes, flows, top, left, sizes).apply()
+    # Затем содержимое сдвигается внутрь рамок, получивших координаты
+    for node_id in sizes:
+        attrs = bpmn_graph.diagram_graph.nodes[node_id]
+        _shift_container(bpmn_graph, node_id,
+                         int(attrs[consts.Consts.x]) + SUBPROCESS_PADDING,
+                         int(attrs[consts.Consts.y]) + SUBPROCESS_PADDING + SUBPROCESS_HEADER)
+    return extent
+
+
+def _shift_container(bpmn_graph, container_id: str, dx: int, dy: int):
+    """Сдвигает узлы и потоки подпроцесса вместе с вложенными подпроцессами"""
+    for node_id, attrs in bpmn_graph.get_nodes_list_by_process_id(container_id):
+        attrs[consts.Consts.x] = str(int(attrs[consts.Consts.x]) + dx)
+        attrs[consts.Consts.y] = str(int(attrs[consts.Consts.y]) + dy)
+        if attrs[consts.Consts.type] == consts.Consts.subprocess:
+            _shift_container(bpmn_graph, node_id, dx, dy)
+    for flow in bpmn_graph.get_flows_list_by_process_id(container_id):
+        flow[2][consts.Consts.waypoints] = [(str(int(x) + dx), str(int(y) + dy))
+                                            for x, y in flow[2][consts.Consts.waypoints]]
+
+
+class _LayeredLayout:
+    def __init__(self, bpmn_graph, nodes: List[str], flows: List[dict], top: float, left: float = MARGIN,
+                 sizes: Optional[Dict[str, Tuple[float, float]]] = None):
+        """sizes - размеры узлов, отличные от стандартных (развёрнутые подпроцессы)"""
+        self.graph = bpmn_graph
+        self.nodes = nodes
+        self.flows = flows
+        self.top = top
+        self.left = left
+        self.index = {node_id: i for i, node_id in enumerate(nodes)}
+        n = len(nodes)
+        sizes = sizes or {}
+        sizes = [sizes.get(node_id) or
+                 SHAPE_SIZES.get(bpmn_graph.diagram_graph.nodes[node_id][consts.Consts.type], TASK_SIZE)
+                 for node_id in nodes]
+        self.width = np.array([s[0] for s in sizes], dtype=float)
+        self.height = np.array([s[1] for s in sizes], dtype=float)
+        self.n_real = n
+
+    def apply(self) -> Tuple[float, float]:
+        """Раскладывает узлы и потоки; возвращает (правый край, нижний край)"""
+        edges, self_loops = self._edges()
+        dag_edges, reversed_mask = self._break_cycles(edges)
+        layer = self._assign_layers(dag_edges)
+        chains = self._insert_dummies(dag_edges, layer)
+        layers = self._order_layers()
+        self._assign_coordinates(layers)
+        self._write_nodes()
+        self._write_flows(edges, reversed_mask, chains, self_loops)
+        real = slice(0, self.n_real)
+        return (float(np.max(self.xc[real] + self.width[real] / 2)),
+                float(np.max(self.yc[real] + self.height[real] / 2)))
+
+    # Шаг 0: рёбра в направлении потока
+    def _edges(self) -> Tuple[List[Tuple[int, int, dict]], List[dict]]:
+        edges, self_loops = [], []
+        for flow in self.flows:
+            source = self.index.get(flow.get(consts.Consts.source_ref))
+            target = self.index.get(flow.get(consts.Consts.target_ref))
+            if source is None or target is None:
+                continue
+            if source == target:
+                self_loops.append(flow)
+            else:
+                edges.append((source, target, flow))
+        return edges, self_loops
+
+    # Шаг 1: разрыв циклов - обратные рёбра обхода в глубину разворачиваются
+    def _break_cycles(self, edges) -> Tuple[List[Tuple[int, int]], List[bool]]:
+        n = self.n_real
+        successors: List[List[Tuple[int, int]]] = [[] for _ in range(n)]
+        in_degree = np.zeros(n, dtype=int)
+        for k, (u, v, _) in enumerate(edges):
+            successors[u].append((v, k))
+            in_degree[v] += 1
+
+        state = np.zeros(n, dtype=np.int8)  # 0 - не посещён, 1 - в стеке, 2 - завершён
+        reversed_mask = [False] * len(edges)
+        # Обход начинается с истоков (стартовых событий), затем - с оставшихся узлов
+        roots = [v for v in range(n) if in_degree[v] == 0] + list(range(n))
+        for root in roots:
+            if state[root]:
+                continue
+            state[root] = 1
+            stack = [(root, iter(successors[root]))]
+            while stack:
+                u, it = stack[-1]
+                for v, k in it:
+                    if state[v] == 1:
+                        reversed_mask[k] = True
+                    elif state[v] == 0:
+                        state[v] = 1
+                        stack.append((v, iter(successors[v])))
+                        break
+                else:
+                    state[u] = 2
+                    stack.pop()
+
+        dag_edges = [(v, u) if reversed_mask[k] else (u, v) for k, (u, v, _) in enumerate(edges)]
+        return dag_edges, reversed_mask
+
+    # Шаг 2: слой узла - длина самого длинного пути от истока
+    def _assign_layers(self, dag_edges) -> np.ndarray:
+        n = self.n_real
+        successors: List[List[int]] = [[] for _ in range(n)]
+        in_degree = np.zeros(n, dtype=int)
+        for u, v in dag_edges:
+            successors[u].append(v)
+            in_degree[v] += 1
+        layer = np.zeros(n, dtype=int)
+        queue = [v for v in range(n) if in_degree[v] == 0]
+        while queue:
+            u = queue.pop()
+            for v in successors[u]:
+                layer[v] = max(layer[v], layer[u] + 1)
+                in_degree[v] -= 1
+                if in_degree[v] == 0:
+                    queue.append(v)
+        return layer
+
+    # Шаг 3: длинные рёбра разбиваются фиктивными узлами, чтобы все рёбра соединяли соседние слои
+    def _insert_dummies(self, dag_edges, layer: np.ndarray) -> List[List[int]]:
+        layers = list(layer)
+        chains = []
+        for u, v in dag_edges:
+            chain = [u]
+            for k in range(layer[u] + 1, layer[v]):
+                layers.append(k)
+                chain.append(len(layers) - 1)
+            chain.append(v)
+            chains.append(chain)
+        n_total = len(layers)
+        self.layer = np.array(layers, dtype=int)
+        self.width = np.concatenate([self.width, np.zeros(n_total - self.n_real)])
+        self.height = np.concatenate([self.height, np.zeros(n_total - self.n_real)])
+        # Рёбра между соседними слоями: (верхний, нижний) в терминах слоёв
+        pairs = {(a, b) for chain in chains for a, b in zip(chain, chain[1:])}
+        self.up = np.array([a for a, _ in sorted(pairs)], dtype=int)
+        self.down = np.array([b for _, b in sorted(pairs)], dtype=int)
+        # Индексы рёбер, выходящих из каждого слоя (они же входят в следующий)
+        self.n_layers = int(self.layer.max()) + 1
+        edge_layer = self.layer[self.up]
+        order = np.argsort(edge_layer, kind="stable")
+        bounds = np.searchsorted(edge_layer[order], np.arange(self.n_layers + 1))
+        self.edges_from = [order[bounds[k]:bounds[k + 1]] for k in range(self.n_layers)]
+        return chains
+
+    def _edges_into(self, k: int) -> np.ndarray:
+        return self.edges_from[k - 1] if k > 0 else self.edges_from[0][:0]
+
+    def _neighbour_mean(self, members: np.ndarray, local: np.ndarray, edge_idx: np.ndarray,
+                        moving: np.ndarray, fixed: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Среднее значение values по соседям каждого узла слоя; узлы без соседей сохраняют своё значение"""
+        slots = local[moving[edge_idx]]
+        sums = np.bincount(slots, weights=values[fixed[edge_idx]], minlength=len(members))
+        counts = np.bincount(slots, minlength=len(members))
+        return np.where(counts > 0, sums / np.maximum(counts, 1), values[members])
+
+    # Шаг 4: порядок узлов в слоях - барицентрический метод с проходами вниз и вверх
+    def _order_layers(self) -> List[np.ndarray]:
+        n_layers = self.n_layers
+        layers = [np.flatnonzero(self.layer == k) for k in range(n_layers)]
+        self.pos = np.zeros(len(self.layer), dtype=float)
+        local = np.zeros(len(self.layer), dtype=int)
+        for members in layers:
+            self.pos[members] = np.arange(len(members))
+            local[members] = np.arange(len(members))
+
+        best_pos, best_crossings = self.pos.copy(), self._crossings()
+        for sweep in range(ORDER_SWEEPS):
+            if best_crossings == 0:
+                break
+            downward = sweep % 2 == 0
+            order = range(1, n_layers) if downward else range(n_layers - 2, -1, -1)
+            for k in order:
+                self._reorder_layer(k, layers[k], local, downward)
+            crossings = self._crossings()
+            if crossings < best_crossings:
+                best_pos, best_crossings = self.pos.copy(), crossings
+        self.pos = best_pos
+        return [members[np.argsort(self.pos[members])] for members in layers]
+
+    def _reorder_layer(self, k: int, members: np.ndarray, local: np.ndarray, downward: bool):
+        # Соседи в предыдущем (при проходе вниз) или следующем слое
+        if downward:
+            barycenter = self._neighbour_mean(members, local, self._edges_into(k), self.down, self.up, self.pos)
+        else:
+            barycenter = self._neighbour_mean(members, local, self.edges_from[k], self.up, self.down, self.pos)
+        order = np.lexsort((self.pos[members], barycenter))
+        self.pos[members[order]] = np.arange(len(members))
+
+    def _crossings(self) -> int:
+        total = 0
+        for edge_idx in self.edges_from:
+            if len(edge_idx) < 2:
+                continue
+            a, b = self.pos[self.up[edge_idx]], self.pos[self.down[edge_idx]]
+            order = np.lexsort((b, a))
+            b = b[order]
+            # Пересекаются пары рёбер с обратным порядком концов в нижнем слое
+            total += int(np.triu(b[:, None] > b[None, :], 1).sum())
+        return total
+
+    # Шаг 5: координаты - колонки по слоям, по вертикали - к среднему соседей без наложений
+    def _assign_coordinates(self, layers: List[np.ndarray]):
+        layer_width = np.array([self.width[members].max() for members in layers])
+        self.layer_left = self.left + np.concatenate([[0], np.cumsum(layer_width + LAYER_GAP)[:-1]])
+        self.xc = self.layer_left[self.layer] + layer_width[self.layer] / 2
+
+        self.yc = np.zeros(len(self.layer), dtype=float)
+        for members in layers:
+            separation = (self.height[members][:-1] + self.height[members][1:]) / 2 + NODE_GAP
+            self.yc[members] = np.concatenate([[0], np.cumsum(separation)])
+
+        local = np.zeros(len(self.layer), dtype=int)
+        for members in layers:
+            local[members] = np.arange(len(members))
+        for _ in range(PLACEMENT_SWEEPS):
+            for k in range(1, len(layers)):
+                desired = self._neighbour_mean(layers[k], local, self._edges_into(k), self.down, self.up, self.yc)
+                self._align_layer(layers[k], desired)
+            for k in range(len(layers) - 2, -1, -1):
+                desired = self._neighbour_mean(layers[k], local, self.edges_from[k], self.up, self.down, self.yc)
+                self._align_layer(layers[k], desired)
+
+        real = slice(0, self.n_real)
+        self.yc += self.top - np.min(self.yc[real] - self.height[real] / 2)
+
+    def _align_layer(self, members: np.ndarray, desired: np.ndarray):
+        separation = (self.height[members][:-1] + self.height[members][1:]) / 2 + NODE_GAP
+
+        # Две допустимые расстановки (сдвигом вниз и сдвигом вверх); их среднее тоже допустимо
+        pushed_down = desired.copy()
+        for i in range(1, len(members)):
+            pushed_down[i] = max(desired[i], pushed_down[i - 1] + separation[i - 1])
+        pushed_up = desired.copy()
+        for i in range(len(members) - 2, -1, -1):
+            pushed_up[i] = min(desired[i], pushed_up[i + 1] - separation[i])
+        self.yc[members] = (pushed_down + pushed_up) / 2
+
+    # Шаг 6: запись DI
+    def _write_nodes(self):
+        left = self.xc - self.width / 2
+        top = self.yc - self.height / 2
+        for i, node_id in enumerate(self.nodes):
+            attrs = self.graph.diagram_graph.nodes[node_id]
+            attrs[consts.Consts.width] = str(int(self.width[i]))
+            attrs[consts.Consts.height] = str(int(self.height[i]))
+            attrs[consts.Consts.x] = str(int(round(left[i])))
+            attrs[consts.Consts.y] = str(int(round(top[i])))
+
+    def _write_flows(self, edges, reversed_mask, chains, self_loops):
+        for (_, _, flow), is_reversed, chain in zip(edges, reversed_mask, chains):
+            points = self._route(chain)
+            if is_reversed:
+                points.reverse()
+            flow[consts.Consts.waypoints] = _as_waypoints(points)
+        for flow in self_loops:
+            i = self.index[flow[consts.Consts.source_ref]]
+            right, left = self.xc[i] + self.width[i] / 2, self.xc[i] - self.width[i] / 2
+            above = self.yc[i] - self.height[i] / 2 - SELF_LOOP_OFFSET
+            flow[consts.Consts.waypoints] = _as_waypoints([
+                (right, self.yc[i]), (right + SELF_LOOP_OFFSET, self.yc[i]),
+                (right + SELF_LOOP_OFFSET, above), (left - SELF_LOOP_OFFSET, above),
+                (left - SELF_LOOP_OFFSET, self.yc[i]), (left, self.yc[i]),
+            ])
+
+    def _route(self, chain: List[int]) -> List[Tuple[float, float]]:
+        """Ломаная из правого края первого узла цепочки в левый край последнего; изломы - в промежутках между слоями"""
+        first, last = chain[0], chain[-1]
+        points = [(self.xc[first] + self.width[first] / 2, self.yc[first])]
+        for previous, current in zip(chain, chain[1:]):
+            if self.yc[previous] != self.yc[current]:
+                gap_x = self.layer_left[self.layer[current]] - LAYER_GAP / 2
+                points.append((gap_x, self.yc[previous]))
+                points.append((gap_x, self.yc[current]))
+        points.append((self.xc[last] - self.width[last] / 2, self.yc[last]))
+        return points
+
+
+def _as_waypoints(points) -> List[Tuple[str, str]]:
+    return [(str(int(round(x))), str(int(round(y)))) for x, y in points]
+
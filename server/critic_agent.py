@@ -1,89 +1,53 @@
 import json
 import logging
-import re
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from inference_scheduler import InferenceError
+from json_stream import JSONEventStream
+from metrics import PARSE_FAILURES, timed
+from auto_repair import repair
+from diagram_patch import apply_operations
+from process_graph import SEVERITY_CRITICAL, find_structural_errors, nesting_depth
+from prompt_format import encode_diagram, encode_errors, encode_issues
+from response_schemas import HIERARCHICAL_CHAIN_MAX_DEPTH
+
+# Режимы анализа: только алгоритм / LLM только если алгоритм не дал однозначного ответа / всегда LLM
+MODE_FAST = "fast"
+MODE_AUTO = "auto"
+MODE_FULL = "full"
+ANALYSIS_MODES = (MODE_FAST, MODE_AUTO, MODE_FULL)
+
+# Режимы исправления: список операций правки / полная перегенерация структуры
+FIX_PATCH = "patch"
+FIX_FULL = "full"
+FIX_MODES = (FIX_PATCH, FIX_FULL)
+
+# Уровни, на которых получена находка
+TIER_ALGORITHM = "algorithm"
+TIER_LLM = "llm"
+
+# Итог алгоритмического уровня
+VERDICT_SOUND = "sound"            # ошибок нет
+VERDICT_BROKEN = "broken"          # есть критические ошибки структуры
+VERDICT_UNCERTAIN = "uncertain"    # только замечания - решает LLM
 
 class CriticAgent:
-    def __init__(self, llm_callable: Any):
-        """
-        Ожидает LLM-функцию с сигнатурой:
-        llm_callable(prompt: str, **kwargs) -> {"choices": [{"text": str}]}
-        или
-        llm_callable(prompt: str, **kwargs) -> {"choices": [{"message": {"content": str}}]}
-        """
-        self.llm = llm_callable
-
-    def analyze_diagram(self, bpmn_json: dict) -> dict:
-        """Основной метод анализа диаграммы"""
-        errors = self._find_structural_errors(bpmn_json)
-        llm_analysis = self._analyze_with_llm(bpmn_json, errors)
-
-        return {
-            "algorithm_errors": errors,
-            "llm_recommendations": llm_analysis
-        }
-
-    def _find_structural_errors(self, data: dict) -> list[dict]:
-        """Алгоритмическая проверка базовых ошибок"""
-        errors = []
-
-        # 1. Проверка стартового события
-        if not any(n['type'] == 'start' for n in data['nodes']):
-            errors.append({
-                "code": "NO_START",
-                "message": "Отсутствует стартовое событие",
-                "elements": []
-            })
-
-        # 2. Проверка конечного события
-        if not any(n['type'] == 'end' for n in data['nodes']):
-            errors.append({
-                "code": "NO_END",
-                "message": "Отсутствует конечное событие",
-                "elements": []
-            })
-
-        # 3. Поиск висячих элементов
-        all_elements = {n['id']: n for n in data['nodes']}
-        connected = set()
-        for flow in data['flows']:
-            connected.add(flow['source'])
-            connected.add(flow['target'])
-
-        for elem_id, elem in all_elements.items():
-            if elem_id not in connected and elem['type'] not in ['start', 'end']:
-                errors.append({
-                    "code": "ORPHAN_ELEMENT",
-                    "message": f"Несвязанный элемент: {elem['name']}",
-                    "elements": [elem_id]
-                })
-
-        # 4. Проверка шлюзов
-        for node in data['nodes']:
-            if node['type'] == 'gateway':
-                if 'gateway_type' not in node:
-                    errors.append({
-                        "code": "GATEWAY_TYPE_MISSING",
-                        "message": f"Шлюз {node['name']} не имеет типа",
-                        "elements": [node['id']]
-                    })
-
-        return errors
-
-    def _analyze_with_llm(self, data: dict, found_errors: list[dict]) -> dict:
-        """Анализ с помощью LLM"""
-        prompt = f"""
-**Ты эксперт в BPMN 2.0. Проанализируйте диаграмму:**
-
-Текущая структура:
-{json.dumps(data, indent=2)}
-
-Имеется список известных проблем, которые нужно исправить обязательно. 
-Найденные ошибки:
-{json.dumps(found_errors, indent=2)}
-
-Используй не только этот список, но также и самостоятельно попробуй найти ошибки, нестыковки или 
-нарушения стандартов BPMN 2.0.
+    # Версия промптов и параметры сэмплирования входят в ключ кэша ответов:
+    # при изменении промптов версию нужно увеличить
+    PROMPT_VERSION = "6"
+    SAMPLING = {"max_tokens": 4096, "temperature": 0.3}
+
+    # Неизменные части промптов: их KV-состояние вычисляется один раз (см. prompt_cache.py),
+    # поэтому диаграмма и список ошибок подставляются только в конце
+    ANALYSIS_PROMPT_PREFIX = """
+**Ты эксперт в BPMN 2.0. Проанализируйте диаграмму, приведённую в конце.**
+
+Вместе с диаграммой приведён список известных проблем, которые нужно исправить обязательно.
+Этот список составлен алгоритмом, который уже проверил структуру графа: наличие начала и конца,
+достижимость элементов, пути к концу, тупики, парность параллельных шлюзов, шлюзы без ветвления,
+циклы без выхода и повторяющиеся потоки. Эти проверки не повторяй - сосредоточься на том, что
+алгоритм найти не может: смысл и порядок шагов, названия элементов, пропущенные шаги, выбор типа
+шлюза и события, нестыковки и нарушения стандартов BPMN 2.0.
 Рассуждай последовательно, шаг за шагом, это очень важно.
 При формировании ответа указывай элементы по имени, а не по индексам, например, не
 "Убрать задачу t5", а "Убрать задачу 'Ожидание'";
@@ -93,6 +57,7 @@ class CriticAgent:
 - Задачи (Tasks)
 - События: start, end, intermediate
 - Шлюзы: exclusive (условия), parallel (параллельные потоки)
+- Подпроцессы (subprocess): их элементы и потоки приведены в отдельных разделах "Подпроцесс <id>"
 - Последовательности потоков (Sequence Flow)
 
 **Сформулируй:**
@@ -108,61 +73,24 @@ class CriticAgent:
 
 Используй только указанный далее формат ответа, ни в коем случае не нарушайте его.
 **Формат ответа:**
-{{
+{
   "assessment": "текст оценки качества диаграммы",
   "recommendations": ["список рекомендаций по улучшению"],
   "critical_issues": ["список проблем"]
-}}
+}
 
 ВАЖНО: Только JSON без пояснений и любого лишнего текста! Проверьте валидность перед отправкой.
-"""
-
-        try:
-            response = self.llm(
-                prompt=prompt,
-                max_tokens=4096,
-                temperature=0.3,
-                stop=["\n\n"]
-            )
 
-            content = self._extract_llm_content(response)
-            if not content:
-                return {}
-
-            # Извлекаем первый валидный JSON
-            json_data = self._parse_first_json(content)
-            if not json_data:
-                return {}
-
-            # Валидация структуры
-            if not all(k in json_data for k in ['assessment', 'recommendations', 'critical_issues']):
-                logging.error("Неполный JSON ответ: %s", json_data)
-                return {}
-
-            return json_data
-
-        except json.JSONDecodeError as e:
-            logging.error(f"JSON Decode Error: {str(e)}")
-            logging.debug(f"Problem content: {content}")
-            return {}
-        except Exception as e:
-            logging.exception("LLM analysis failed")
-            return {}
-    def generate_llm_fixes(self, data: dict, issues: list[str]) -> dict:
-        """Генерация полного исправления через LLM с учетом как ошибок, так и рекомендаций"""
-        prompt = f"""
-**Ты эксперт в BPMN 2.0. Исправь все ошибки в диаграмме:**
+"""
 
-**Текущая структура:**
-{json.dumps(data, indent=2)}
-
-**Список проблем и рекомендаций:**
-{chr(10).join(issues)}
+    FIXES_PROMPT_PREFIX = """
+**Ты эксперт в BPMN 2.0. Исправь все ошибки в диаграмме, приведённой в конце, по списку проблем и рекомендаций.**
 
 Использовать можно следующие элементы:
 - Задачи (Tasks)
 - События: start, end, intermediate
 - Шлюзы: exclusive (условия), parallel (параллельные потоки)
+- Подпроцессы (subprocess) со своими элементами и потоками
 - Последовательности потоков (Sequence Flow)
 
 **ОБЯЗАТЕЛЬНЫЕ ТРЕБОВАНИЯ:**
@@ -175,60 +103,377 @@ class CriticAgent:
    - Есть ровно одно стартовое и одно конечное событие
    - Все элементы связаны корректными потоками
    - Шлюзы имеют явно указанный тип (exclusive/parallel)
+7. Подпроцессы из раздела "Подпроцесс <id>" верни с их элементами и потоками в полях nodes и flows
+   самого подпроцесса; внутри подпроцесса тоже одно стартовое и одно конечное событие, а потоки
+   соединяют только элементы одного уровня. ID уникальны во всей диаграмме
 
 **Верни ТОЛЬКО исправленный JSON без комментариев.**
 
 Формат ответа:
-{{
+{
   "nodes": [
-    {{"id": "str", "name": "str", "type": "start/end/task/gateway/intermediate"}},
-    {{"id": "g1", "name": "Пример шлюза", "type": "gateway", "gateway_type": "exclusive/parallel"}}
+    {"id": "str", "name": "str", "type": "start/end/task/gateway/intermediate"},
+    {"id": "g1", "name": "Пример шлюза", "type": "gateway", "gateway_type": "exclusive/parallel"},
+    {"id": "p1", "name": "Пример подпроцесса", "type": "subprocess",
+     "nodes": [{"id": "p1_s", "name": "Начало этапа", "type": "start"}, ...],
+     "flows": [{"source": "p1_s", "target": "p1_t1"}, ...]}
   ],
   "flows": [
-    {{"source": "source_id", "target": "target_id"}}
+    {"source": "source_id", "target": "target_id"}
   ]
-}}
+}
 
 **Правила:**
 1. Используй ДВОЙНЫЕ КАВЫЧКИ для всех ключей и значений
 2. Все элементы должны быть связаны корректными потоками
 3. Для шлюзов (gateway) обязательно поле gateway_type
 4. Пример использования intermediate события:
-   {{"id": "i1", "name": "Уведомление", "type": "intermediate"}}
+   {"id": "i1", "name": "Уведомление", "type": "intermediate"}
 
 ВАЖНО: Только JSON без пояснений и любого лишнего текста! Проверь валидность перед отправкой.
+
+"""
+
+    PATCH_PROMPT_PREFIX = """
+**Ты эксперт в BPMN 2.0. Исправь ошибки в диаграмме, приведённой в конце, по списку проблем и рекомендаций.**
+
+Не переписывай диаграмму целиком: верни только список операций правки, которые нужно к ней применить.
+
+Допустимые операции:
+- {"op": "add_node", "id": "новый ID", "name": "имя", "type": "start/end/task/gateway/intermediate/subprocess"}
+  (для шлюза добавь "gateway_type": "exclusive/parallel")
+- {"op": "remove_node", "id": "ID"} - удаляет элемент вместе с его потоками
+- {"op": "rename_node", "id": "ID", "name": "новое имя"}
+- {"op": "add_flow", "source": "ID", "target": "ID"}
+- {"op": "remove_flow", "source": "ID", "target": "ID"}
+- {"op": "set_gateway_type", "id": "ID", "gateway_type": "exclusive/parallel"}
+Чтобы добавить элемент или поток внутрь подпроцесса (раздел "Подпроцесс <id>"), укажи в операции
+"parent": "ID подпроцесса"; без него элемент добавляется на верхний уровень.
+
+**Правила:**
+1. Ссылайся только на ID существующих элементов или добавленных раньше в этом же списке
+2. Операции применяются по порядку
+3. Меняй только то, что нужно для исправления указанных проблем, и сохрани логику процесса
+4. Чтобы перенаправить поток, удали старый и добавь новый
+5. После правок должно быть ровно одно стартовое и одно конечное событие, все элементы связаны потоками;
+   то же внутри каждого подпроцесса. Поток соединяет только элементы одного уровня
+
+Формат ответа:
+{
+  "operations": [
+    {"op": "add_flow", "source": "t3", "target": "end"}
+  ]
+}
+
+ВАЖНО: Только JSON без пояснений и любого лишнего текста!
+
 """
 
+    def __init__(self, llm_callable: Any):
+        """
+        Ожидает LLM-функцию с сигнатурой:
+        llm_callable(prompt: str, **kwargs) -> {"choices": [{"text": str}]}
+        или
+        llm_callable(prompt: str, **kwargs) -> {"choices": [{"message": {"content": str}}]}
+        """
+        self.llm = llm_callable
+
+    def analyze_diagram(self, bpmn_json: dict, mode: str = MODE_AUTO) -> dict:
+        """
+        Основной метод анализа диаграммы. Сначала выполняется алгоритмическая проверка;
+        LLM вызывается в режиме full или в режиме auto, если алгоритм не дал однозначного ответа.
+        """
+        errors = self._find_structural_errors(bpmn_json)
+        if not self.llm_tier_needed(errors, mode):
+            return self._build_result(errors, None)
+        return self._build_result(errors, self._analyze_with_llm(bpmn_json, errors))
+
+    def fast_analysis(self, bpmn_json: dict, mode: str = MODE_AUTO) -> Optional[dict]:
+        """Готовый результат, если для данного режима достаточно алгоритмического уровня, иначе None"""
+        errors = self._find_structural_errors(bpmn_json)
+        if self.llm_tier_needed(errors, mode):
+            return None
+        return self._build_result(errors, None)
+
+    @staticmethod
+    def llm_tier_needed(errors: list[dict], mode: str) -> bool:
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f"Неизвестный режим анализа '{mode}', допустимы: {', '.join(ANALYSIS_MODES)}")
+        if mode == MODE_AUTO:
+            return CriticAgent._verdict(errors) == VERDICT_UNCERTAIN
+        return mode == MODE_FULL
+
+    @staticmethod
+    def fix_mode_for(data: dict, fix_mode: str) -> str:
+        """
+        Режим исправления, который подходит диаграмме: схема полного ответа описывает один уровень
+        подпроцессов, более глубокую вложенность она потеряла бы - такие диаграммы правятся операциями
+        """
+        if fix_mode == FIX_FULL and nesting_depth(data) > HIERARCHICAL_CHAIN_MAX_DEPTH:
+            logging.info("Вложенность подпроцессов больше %d - исправление операциями правки",
+                         HIERARCHICAL_CHAIN_MAX_DEPTH)
+            return FIX_PATCH
+        return fix_mode
+
+    @staticmethod
+    def _verdict(errors: list[dict]) -> str:
+        if not errors:
+            return VERDICT_SOUND
+        if any(err.get("severity") == SEVERITY_CRITICAL for err in errors):
+            return VERDICT_BROKEN
+        return VERDICT_UNCERTAIN
+
+    def _build_result(self, errors: list[dict], llm_analysis: Optional[dict]) -> dict:
+        """
+        Ответ анализа: прежние поля algorithm_errors и llm_recommendations (пустой словарь,
+        если LLM не вызывалась), а также tiers, verdict и общий список findings с уровнем каждой находки.
+        """
+        findings = [{"tier": TIER_ALGORITHM, "kind": "error", **err} for err in errors]
+        if llm_analysis:
+            findings += [{"tier": TIER_LLM, "kind": "recommendation", "message": text}
+                         for text in llm_analysis.get("recommendations", [])]
+            findings += [{"tier": TIER_LLM, "kind": "critical_issue", "message": text}
+                         for text in llm_analysis.get("critical_issues", [])]
+        return {
+            "algorithm_errors": errors,
+            "llm_recommendations": llm_analysis or {},
+            "tiers": [TIER_ALGORITHM] if llm_analysis is None else [TIER_ALGORITHM, TIER_LLM],
+            "verdict": self._verdict(errors),
+            "findings": findings
+        }
+
+    def _find_structural_errors(self, data: dict) -> list[dict]:
+        """Алгоритмическая проверка структуры по ориентированному графу (см. process_graph.py)"""
+        return [dict(err, tier=TIER_ALGORITHM) for err in find_structural_errors(data)]
+
+    def _build_analysis_prompt(self, data: dict, found_errors: list[dict]) -> str:
+        # Переменная часть идёт последней, чтобы префикс брался из KV-кэша
+        return f"""{self.ANALYSIS_PROMPT_PREFIX}Текущая структура:
+{encode_diagram(data)}
+
+Найденные ошибки:
+{encode_errors(found_errors)}
+
+Ответ (только JSON):
+"""
+
+    def _analyze_with_llm(self, data: dict, found_errors: list[dict]) -> dict:
+        """Анализ с помощью LLM"""
+        prompt = self._build_analysis_prompt(data, found_errors)
+
         try:
             response = self.llm(
                 prompt=prompt,
-                max_tokens=4096,
-                temperature=0.3,
-                stop=["\n\n"]
+                **self.SAMPLING,
+                response_schema="critique"
             )
 
             content = self._extract_llm_content(response)
             if not content:
-                return data
+                return {}
+
+            return self._validate_analysis(content)
 
-            json_data = self._parse_first_json(content)
-            if not json_data:
-                return data
+        except json.JSONDecodeError as e:
+            logging.error(f"JSON Decode Error: {str(e)}")
+            logging.debug(f"Problem content: {content}")
+            return {}
+        except InferenceError:
+            raise
+        except Exception as e:
+            logging.exception("LLM analysis failed")
+            return {}
+
+    def _build_fixes_prompt(self, data: dict, issues: list[str]) -> str:
+        return f"""{self.FIXES_PROMPT_PREFIX}**Текущая структура:**
+{encode_diagram(data)}
+
+**Список проблем и рекомендаций:**
+{encode_issues(issues)}
 
-            # Валидация ключей
-            if not all(k in json_data for k in ['nodes', 'flows']):
-                logging.error("Некорректный формат исправлений: %s", json_data)
-                return data
+Исправленный JSON:
+"""
+
+    def generate_llm_fixes(self, data: dict, issues: list[str]) -> dict:
+        """Генерация полного исправления через LLM с учетом как ошибок, так и рекомендаций"""
+        prompt = self._build_fixes_prompt(data, issues)
+
+        try:
+            response = self.llm(
+                prompt=prompt,
+                **self.SAMPLING,
+                response_schema="hierarchical_chain"
+            )
 
-            return json_data
+            content = self._extract_llm_content(response)
+            return self._validate_fixes(content, data)
 
         except json.JSONDecodeError as e:
             logging.error(f"JSON Decode Error: {str(e)}")
             return data
+        except InferenceError:
+            raise
         except Exception as e:
             logging.exception("Fix generation failed")
             return data
 
+    def _build_patch_prompt(self, data: dict, issues: list[str]) -> str:
+        return f"""{self.PATCH_PROMPT_PREFIX}**Текущая структура:**
+{encode_diagram(data)}
+
+**Список проблем и рекомендаций:**
+{encode_issues(issues)}
+
+Операции (только JSON):
+"""
+
+    def generate_llm_patch(self, data: dict, issues: list[str]) -> list[dict]:
+        """
+        Генерация исправления в виде списка операций правки: объём ответа зависит
+        от числа проблем, а не от размера диаграммы. При ошибке LLM - пустой список.
+        """
+        try:
+            response = self.llm(
+                prompt=self._build_patch_prompt(data, issues),
+                **self.SAMPLING,
+                response_schema="patch"
+            )
+            return self._validate_patch(self._extract_llm_content(response))
+        except InferenceError:
+            raise
+        except Exception:
+            logging.exception("Patch generation failed")
+            return []
+
+    def apply_patch(self, data: dict, operations: list[dict], tier: str = TIER_LLM) -> dict:
+        """
+        Применяет операции к исходной структуре и заново выполняет алгоритмическую проверку.
+        Возвращает исправленную структуру, применённые (с уровнем tier) и отклонённые операции
+        и оставшиеся ошибки.
+        """
+        modified, applied, rejected = apply_operations(data, operations)
+        return {
+            "modified_data": modified,
+            "operations": [dict(op, tier=tier) for op in applied],
+            "rejected_operations": [dict(op, tier=tier) for op in rejected],
+            "algorithm_errors": self._find_structural_errors(modified)
+        }
+
+    def auto_repair(self, data: dict) -> dict:
+        """
+        Исправление ошибок структуры правилами, без LLM (см. auto_repair.py).
+        Результат в формате apply_patch; в algorithm_errors - то, что правила исправить не смогли.
+        """
+        modified, applied, errors = repair(data)
+        return {
+            "modified_data": modified,
+            "operations": [dict(op, tier=TIER_ALGORITHM) for op in applied],
+            "rejected_operations": [],
+            "algorithm_errors": [dict(err, tier=TIER_ALGORITHM) for err in errors]
+        }
+
+    def stream_analysis(self, bpmn_json: dict, mode: str = MODE_AUTO) -> Iterator[Tuple[str, Any]]:
+        """
+        Потоковый анализ: сначала ("algorithm_errors", список), затем ("token", текст),
+        ("recommendation", str) и ("critical_issue", str) по мере генерации
+        и финальное ("result", ответ в формате analyze_diagram).
+        Если LLM для режима не нужна, сразу за ошибками идёт ("result", ...).
+        """
+        errors = self._find_structural_errors(bpmn_json)
+        yield "algorithm_errors", errors
+        if not self.llm_tier_needed(errors, mode):
+            yield "result", self._build_result(errors, None)
+            return
+        stream = JSONEventStream(
+            self.llm(
+                prompt=self._build_analysis_prompt(bpmn_json, errors),
+                **self.SAMPLING,
+                response_schema="critique",
+                stream=True
+            ),
+            {"recommendations": "recommendation", "critical_issues": "critical_issue"}
+        )
+        yield from stream
+        yield "result", self._build_result(errors, self._validate_analysis(stream.text.strip()))
+
+    def stream_fixes(self, data: dict, issues: list[str]) -> Iterator[Tuple[str, Any]]:
+        """Потоковая генерация исправлений: ("token"), ("node"), ("flow") и ("result", структура)"""
+        stream = JSONEventStream(
+            self.llm(
+                prompt=self._build_fixes_prompt(data, issues),
+                **self.SAMPLING,
+                response_schema="hierarchical_chain",
+                stream=True
+            ),
+            {"nodes": "node", "flows": "flow"}
+        )
+        yield from stream
+        yield "result", self._validate_fixes(stream.text.strip(), data)
+
+    def stream_patch(self, data: dict, issues: list[str]) -> Iterator[Tuple[str, Any]]:
+        """Потоковая генерация операций правки: ("token"), ("operation", dict) и ("result", список операций)"""
+        stream = JSONEventStream(
+            self.llm(
+                prompt=self._build_patch_prompt(data, issues),
+                **self.SAMPLING,
+                response_schema="patch",
+                stream=True
+            ),
+            {"operations": "operation"}
+        )
+        yield from stream
+        yield "result", self._validate_patch(stream.text.strip())
+
+    @timed("parse")
+    def _validate_patch(self, content: str) -> list[dict]:
+        json_data = self._parse_first_json(content) if content else {}
+        operations = json_data.get("operations")
+        if not isinstance(operations, list):
+            logging.error("Некорректный формат операций правки: %s", json_data)
+            PARSE_FAILURES.inc(agent="critic_patch")
+            return []
+        return [op for op in operations if isinstance(op, dict)]
+
+    @timed("parse")
+    def _validate_analysis(self, content: str) -> dict:
+        if not content:
+            PARSE_FAILURES.inc(agent="critic_analysis")
+            return {}
+
+        # Извлекаем первый валидный JSON
+        json_data = self._parse_first_json(content)
+        if not json_data:
+            PARSE_FAILURES.inc(agent="critic_analysis")
+            return {}
+
+        # Валидация структуры
+        if not all(k in json_data for k in ['assessment', 'recommendations', 'critical_issues']):
+            logging.error("Неполный JSON ответ: %s", json_data)
+            PARSE_FAILURES.inc(agent="critic_analysis")
+            return {}
+
+        return json_data
+
+    @timed("parse")
+    def _validate_fixes(self, content: str, data: dict) -> dict:
+        """Возвращает исправленную структуру или исходную, если ответ LLM некорректен"""
+        if not content:
+            PARSE_FAILURES.inc(agent="critic_fixes")
+            return data
+
+        json_data = self._parse_first_json(content)
+        if not json_data:
+            PARSE_FAILURES.inc(agent="critic_fixes")
+            return data
+
+        # Валидация ключей
+        if not all(k in json_data for k in ['nodes', 'flows']):
+            logging.error("Некорректный формат исправлений: %s", json_data)
+            PARSE_FAILURES.inc(agent="critic_fixes")
+            return data
+
+        return json_data
+
     def _extract_llm_content(self, response: dict) -> str:
         """Универсальное извлечение содержимого из ответа LLM"""
         content = ""
@@ -238,11 +483,16 @@ class CriticAgent:
         return content.strip()
 
     def _parse_first_json(self, text: str) -> dict:
-        pattern = r'\{[\s\S]*?\}'
-        for match in re.finditer(pattern, text):
-            snippet = match.group(0)
+        # При грамматике ответ - ровно один объект; иначе ищем первый разбираемый объект,
+        # включая вложенные (нежадная регулярка обрезала бы его на первой "}")
+        decoder = json.JSONDecoder()
+        start = text.find("{")
+        while start != -1:
             try:
-                return json.loads(snippet)
+                obj, _ = decoder.raw_decode(text, start)
+                if isinstance(obj, dict):
+                    return obj
             except json.JSONDecodeError:
-                continue
+                pass
+            start = text.find("{", start + 1)
         return {}
@@ -0,0 +1,160 @@
+# diagram_patch.py
+import copy
+import logging
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from process_graph import is_container
+
+logger = logging.getLogger(__name__)
+
+# Операции правки цепочки событий {"nodes": [...], "flows": [...]}. Поле "parent" - ID подпроцесса,
+# в который добавляется элемент или поток (без него - верхний уровень, для потока - область его
+# источника); остальные операции находят элемент по ID на любой глубине
+OP_ADD_NODE = "add_node"
+OP_REMOVE_NODE = "remove_node"
+OP_RENAME_NODE = "rename_node"
+OP_ADD_FLOW = "add_flow"
+OP_REMOVE_FLOW = "remove_flow"
+OP_SET_GATEWAY_TYPE = "set_gateway_type"
+OPERATIONS = (OP_ADD_NODE, OP_REMOVE_NODE, OP_RENAME_NODE, OP_ADD_FLOW, OP_REMOVE_FLOW, OP_SET_GATEWAY_TYPE)
+
+NODE_TYPES = ("start", "end", "task", "gateway", "intermediate", "subprocess")
+GATEWAY_TYPES = ("exclusive", "parallel")
+
+
+class PatchError(ValueError):
+    pass
+
+
+def apply_operations(data: dict, operations: List[dict]) -> Tuple[dict, List[dict], List[dict]]:
+    """
+    Применяет операции по порядку к копии структуры.
+    Некорректная операция (ссылка на несуществующий элемент, повтор потока, неизвестный тип)
+    отклоняется и не мешает остальным.
+    Возвращает (новая структура, применённые операции, отклонённые операции с причиной в поле "error").
+    """
+    patched = {"nodes": copy.deepcopy(data.get("nodes", [])), "flows": copy.deepcopy(data.get("flows", []))}
+    applied, rejected = [], []
+    aliases = {}
+    for operation in operations:
+        try:
+            applied.append(_apply(patched, operation, aliases))
+        except PatchError as e:
+            logger.debug("Операция отклонена: %s (%s)", operation, e)
+            rejected.append({**operation, "error": str(e)})
+    return patched, applied, rejected
+
+
+def _apply(data: dict, operation: dict, aliases: dict) -> dict:
+    op = operation.get("op")
+    nodes, owners = _index(data)
+
+    if op == OP_ADD_NODE:
+        node_type = operation.get("type")
+        if node_type not in NODE_TYPES:
+            raise PatchError(f"недопустимый тип элемента: {node_type}")
+        scope = _scope(data, nodes, operation, aliases)
+        node_id = operation.get("id")
+        if not node_id or node_id in nodes:
+            # Модель может повторить занятый ID - генерируем свой; последующие операции
+            # с этим ID относятся к новому элементу
+            new_id = f"n_{uuid.uuid4().hex[:8]}"
+            if node_id:
+                aliases[node_id] = new_id
+            node_id = new_id
+        node = {"id": node_id, "name": operation.get("name") or node_id, "type": node_type}
+        if node_type == "gateway":
+            node["gateway_type"] = _gateway_type(operation)
+        scope.setdefault("nodes", []).append(node)
+        scope.setdefault("flows", [])
+        return {**operation, "id": node_id}
+
+    if op == OP_REMOVE_NODE:
+        node_id = _existing_node(nodes, operation, aliases)
+        scope = owners[node_id]
+        scope["nodes"] = [node for node in scope["nodes"] if node["id"] != node_id]
+        scope["flows"] = [flow for flow in scope.get("flows", [])
+                          if node_id not in (flow.get("source"), flow.get("target"))]
+        return {**operation, "id": node_id}
+
+    if op == OP_RENAME_NODE:
+        node_id = _existing_node(nodes, operation, aliases)
+        if not operation.get("name"):
+            raise PatchError("не указано новое имя")
+        nodes[node_id]["name"] = operation["name"]
+        return {**operation, "id": node_id}
+
+    if op == OP_SET_GATEWAY_TYPE:
+        node_id = _existing_node(nodes, operation, aliases)
+        if nodes[node_id].get("type") != "gateway":
+            raise PatchError(f"элемент {node_id} не является шлюзом")
+        nodes[node_id]["gateway_type"] = _gateway_type(operation)
+        return {**operation, "id": node_id}
+
+    if op in (OP_ADD_FLOW, OP_REMOVE_FLOW):
+        source = aliases.get(operation.get("source"), operation.get("source"))
+        target = aliases.get(operation.get("target"), operation.get("target"))
+        if operation.get("parent"):
+            scope = _scope(data, nodes, operation, aliases)
+        else:
+            scope = owners.get(source) or owners.get(target) or data
+        flows = scope.get("flows", [])
+        exists = any(flow.get("source") == source and flow.get("target") == target for flow in flows)
+        if op == OP_ADD_FLOW:
+            for ref in (source, target):
+                if ref not in nodes:
+                    raise PatchError(f"элемент {ref} не найден")
+                if owners[ref] is not scope:
+                    raise PatchError(f"поток {source} -> {target} пересекает границу подпроцесса")
+            if exists:
+                raise PatchError(f"поток {source} -> {target} уже есть")
+            scope.setdefault("flows", []).append({"source": source, "target": target})
+        else:
+            # Удалить можно и поток со ссылкой на несуществующий элемент
+            if not exists:
+                raise PatchError(f"потока {source} -> {target} нет")
+            scope["flows"] = [flow for flow in flows
+                              if not (flow.get("source") == source and flow.get("target") == target)]
+        return {**operation, "source": source, "target": target}
+
+    raise PatchError(f"неизвестная операция: {op}")
+
+
+def _index(data: dict) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+    """Элементы по ID на любой глубине и область каждого (словарь, в чьих nodes он лежит)"""
+    nodes, owners = {}, {}
+    pending = [data]
+    while pending:
+        scope = pending.pop()
+        for node in scope.get("nodes", []):
+            if node.get("id") not in nodes:
+                nodes[node.get("id")] = node
+                owners[node.get("id")] = scope
+            if is_container(node):
+                pending.append(node)
+    return nodes, owners
+
+
+def _scope(data: dict, nodes: dict, operation: dict, aliases: dict) -> dict:
+    parent: Optional[str] = operation.get("parent")
+    if not parent:
+        return data
+    parent = aliases.get(parent, parent)
+    if nodes.get(parent, {}).get("type") != "subprocess":
+        raise PatchError(f"подпроцесс {parent} не найден")
+    return nodes[parent]
+
+
+def _existing_node(nodes: dict, operation: dict, aliases: dict) -> str:
+    node_id = aliases.get(operation.get("id"), operation.get("id"))
+    if node_id not in nodes:
+        raise PatchError(f"элемент {node_id} не найден")
+    return node_id
+
+
+def _gateway_type(operation: dict) -> str:
+    gateway_type = operation.get("gateway_type")
+    if gateway_type not in GATEWAY_TYPES:
+        raise PatchError(f"недопустимый тип шлюза: {gateway_type}")
+    return gateway_type
@@ -0,0 +1,263 @@
+# diagram_store.py
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from response_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в сохранениях) применять политику хранения
+GC_EVERY = 512
+COMPRESSION_LEVEL = 6
+# Сколько секунд ждать, пока другой процесс освободит блокировку записи
+BUSY_TIMEOUT = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diagrams (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    latest_version INTEGER NOT NULL,
+    description TEXT,
+    description_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS diagrams_updated ON diagrams (updated_at, id);
+CREATE INDEX IF NOT EXISTS diagrams_description ON diagrams (description_hash);
+CREATE TABLE IF NOT EXISTS versions (
+    diagram_id INTEGER NOT NULL REFERENCES diagrams (id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    content_hash TEXT NOT NULL,
+    xml BLOB NOT NULL,
+    chain BLOB,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (diagram_id, version)
+);
+CREATE INDEX IF NOT EXISTS versions_hash ON versions (content_hash);
+"""
+
+
+def content_hash(bpmn_xml: str) -> str:
+    return hashlib.sha256(bpmn_xml.encode("utf-8")).hexdigest()
+
+
+class DiagramStore:
+    """
+    Хранилище диаграмм в SQLite: XML и цепочка событий сжимаются zlib, у каждого имени -
+    история версий (сохранение под существующим именем добавляет версию).
+    Индексы по имени, времени изменения, хэшу содержимого и исходному описанию
+    держат поиск и постраничный список быстрыми при сотнях тысяч диаграмм, а политика
+    хранения (число версий, возраст, общее число диаграмм) ограничивает размер на диске.
+    """
+
+    def __init__(self, db_path: str, max_versions: int = 20, max_age: float = 0.0, max_diagrams: int = 0,
+                 timeout: float = BUSY_TIMEOUT):
+        """
+        max_age - в секундах; 0 в max_age и max_diagrams - без ограничения.
+        Базу могут делить несколько веб-процессов: транзакции открываются явно (см. _write).
+        """
+        self.db_path = db_path
+        self.max_versions = max_versions
+        self.max_age = max_age
+        self.max_diagrams = max_diagrams
+        self._lock = threading.Lock()
+        self._saves = 0
+        self._db = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        # auto_vacuum действует только на новую базу: освобождённые страницы возвращаются файлу при GC
+        self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(_SCHEMA)
+
+    @contextmanager
+    def _write(self):
+        """
+        Транзакция записи. BEGIN IMMEDIATE берёт блокировку сразу, а не при первой записи:
+        чтение и запись внутри (номер следующей версии, наличие имени) не перемежаются
+        с сохранением той же диаграммы в другом процессе. Вызывается под self._lock.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def save(self, name: str, bpmn_xml: str, chain: Optional[dict] = None,
+             description: Optional[str] = None) -> dict:
+        """Сохраняет новую версию диаграммы name; возвращает {"name", "version", "content_hash"}"""
+        now = time.time()
+        digest = content_hash(bpmn_xml)
+        xml_blob = zlib.compress(bpmn_xml.encode("utf-8"), COMPRESSION_LEVEL)
+        chain_blob = None
+        if chain is not None:
+            chain_blob = zlib.compress(json.dumps(chain, ensure_ascii=False).encode("utf-8"), COMPRESSION_LEVEL)
+        description_hash = _description_hash(description)
+        with self._lock, self._write():
+            row = self._db.execute("SELECT id, latest_version FROM diagrams WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                version = 1
+                diagram_id = self._db.execute(
+                    "INSERT INTO diagrams (name, created_at, updated_at, latest_version, description, description_hash)"
+                    " VALUES (?, ?, ?, 1, ?, ?)",
+                    (name, now, now, description, description_hash)
+                ).lastrowid
+            else:
+                diagram_id, version = row["id"], row["latest_version"] + 1
+                self._db.execute(
+                    "UPDATE diagrams SET updated_at = ?, latest_version = ?,"
+                    " description = COALESCE(?, description), description_hash = COALESCE(?, description_hash)"
+                    " WHERE id = ?",
+                    (now, version, description, description_hash, diagram_id)
+                )
+            self._db.execute(
+                "INSERT INTO versions (diagram_id, version, created_at, content_hash, xml, chain, size)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (diagram_id, version, now, digest, xml_blob, chain_blob, len(xml_blob) + len(chain_blob or b""))
+            )
+            if self.max_versions and version > self.max_versions:
+                self._db.execute("DELETE FROM versions WHERE diagram_id = ? AND version <= ?",
+                                 (diagram_id, version - self.max_versions))
+            self._saves += 1
+            run_gc = self._saves % GC_EVERY == 0
+        if run_gc:
+            self.gc()
+        return {"name": name, "version": version, "content_hash": digest}
+
+    def get(self, name: str, version: Optional[int] = None, with_chain: bool = True) -> Optional[dict]:
+        """Версия диаграммы (по умолчанию последняя) с распакованными XML и цепочкой; None - нет такой"""
+        query = ("SELECT d.name, d.description, v.version, v.created_at, v.content_hash, v.xml, v.chain"
+                 " FROM diagrams d JOIN versions v ON v.diagram_id = d.id WHERE d.name = ? AND v.version = ")
+        with self._lock:
+            if version is None:
+                row = self._db.execute(query + "d.latest_version", (name,)).fetchone()
+            else:
+                row = self._db.execute(query + "?", (name, version)).fetchone()
+        if row is None:
+            return None
+        record = {
+            "name": row["name"],
+            "version": row["version"],
+            "created_at": row["created_at"],
+            "content_hash": row["content_hash"],
+            "description": row["description"],
+            "bpmn_xml": zlib.decompress(row["xml"]).decode("utf-8"),
+        }
+        if with_chain:
+            record["event_chain"] = json.loads(zlib.decompress(row["chain"])) if row["chain"] is not None else None
+        return record
+
+    def versions(self, name: str) -> Optional[List[dict]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT v.version, v.created_at, v.content_hash, v.size FROM versions v"
+                " JOIN diagrams d ON v.diagram_id = d.id WHERE d.name = ? ORDER BY v.version DESC",
+                (name,)
+            ).fetchall()
+        if not rows:
+            return None
+        return [dict(row) for row in rows]
+
+    def list(self, limit: int = 50, cursor: Optional[str] = None, name_prefix: Optional[str] = None,
+             description: Optional[str] = None, content: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        Диаграммы от недавно изменённых к старым, постранично по курсору (без OFFSET - страница
+        стоит одинаково независимо от глубины). Фильтры: префикс имени, исходное описание
+        (совпадение без учёта пробелов и переносов строк, регистр учитывается), хэш содержимого любой из версий.
+        Возвращает (страница, курсор следующей страницы или None).
+        """
+        conditions, params = [], []
+        if cursor:
+            updated_at, diagram_id = _parse_cursor(cursor)
+            conditions.append("(d.updated_at < ? OR (d.updated_at = ? AND d.id < ?))")
+            params += [updated_at, updated_at, diagram_id]
+        if name_prefix:
+            conditions.append("d.name >= ? AND d.name < ?")
+            params += [name_prefix, name_prefix + "\U0010ffff"]
+        if description:
+            conditions.append("d.description_hash = ?")
+            params.append(_description_hash(description))
+        if content:
+            conditions.append("d.id IN (SELECT diagram_id FROM versions WHERE content_hash = ?)")
+            params.append(content)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT d.id, d.name, d.created_at, d.updated_at, d.latest_version, d.description"
+                f" FROM diagrams d {where} ORDER BY d.updated_at DESC, d.id DESC LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+        page = [dict(row) for row in rows[:limit]]
+        next_cursor = f"{page[-1]['updated_at']!r}:{page[-1]['id']}" if len(rows) > limit else None
+        for item in page:
+            del item["id"]
+        return page, next_cursor
+
+    def delete(self, name: str) -> bool:
+        with self._lock, self._write():
+            deleted = self._db.execute("DELETE FROM diagrams WHERE name = ?", (name,)).rowcount
+        return deleted > 0
+
+    def gc(self) -> dict:
+        """
+        Применяет политику хранения: лишние версии, диаграммы старше max_age и сверх max_diagrams
+        (самые давно изменённые) удаляются, освобождённое место возвращается файлу базы.
+        """
+        removed = {"versions": 0, "diagrams": 0}
+        with self._lock:
+            with self._write():
+                if self.max_versions:
+                    removed["versions"] = self._db.execute(
+                        "DELETE FROM versions WHERE version <= "
+                        "(SELECT latest_version FROM diagrams WHERE id = versions.diagram_id) - ?",
+                        (self.max_versions,)
+                    ).rowcount
+                if self.max_age:
+                    removed["diagrams"] += self._db.execute(
+                        "DELETE FROM diagrams WHERE updated_at < ?", (time.time() - self.max_age,)
+                    ).rowcount
+                if self.max_diagrams:
+                    removed["diagrams"] += self._db.execute(
+                        "DELETE FROM diagrams WHERE id IN (SELECT id FROM diagrams"
+                        " ORDER BY updated_at DESC, id DESC LIMIT -1 OFFSET ?)",
+                        (self.max_diagrams,)
+                    ).rowcount
+            self._db.execute("PRAGMA incremental_vacuum").fetchall()
+        if removed["versions"] or removed["diagrams"]:
+            logger.info("Очистка хранилища диаграмм: %s", removed)
+        return removed
+
+    def metrics(self) -> dict:
+        with self._lock:
+            diagrams, = self._db.execute("SELECT COUNT(*) FROM diagrams").fetchone()
+            versions, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM versions").fetchone()
+        return {"diagrams": diagrams, "versions": versions, "stored_bytes": size,
+                "max_versions": self.max_versions, "max_age": self.max_age, "max_diagrams": self.max_diagrams}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _description_hash(description: Optional[str]) -> Optional[str]:
+    if not description:
+        return None
+    return hashlib.sha256(normalize_text(description).encode("utf-8")).hexdigest()
+
+
+def _parse_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        updated_at, diagram_id = cursor.rsplit(":", 1)
+        return float(updated_at), int(diagram_id)
+    except ValueError:
+        raise ValueError(f"Некорректный курсор: {cursor}")
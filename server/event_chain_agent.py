@@ -2,7 +2,12 @@
 import re
 import json
 import logging
-from typing import Any, Dict
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from json_stream import JSONEventStream
+from metrics import PARSE_FAILURES, timed
 
 logger = logging.getLogger(__name__)
 
@@ -10,15 +15,13 @@ class JSONParseError(Exception):
     pass
 
 class EventChainAgent:
+    # Версия промпта и параметры сэмплирования входят в ключ кэша ответов:
+    # при изменении промпта версию нужно увеличить
+    PROMPT_VERSION = "2"
+    SAMPLING = {"max_tokens": 4096, "temperature": 0.3}
 
-    def __init__(self, llm_callable: Any):
-            """
-            llm_callable(prompt: str, **kwargs) -> {"choices": [{"text": str}, ...]}
-            """
-            self.llm = llm_callable
-
-    def generate_chain(self, process_description):
-        prompt = f"""
+    # Неизменная часть промпта: её KV-состояние вычисляется один раз (см. prompt_cache.py)
+    PROMPT_PREFIX = """
 **Вы эксперт в BPMN 2.0. Создайте максимально информативную и логичную диаграмму, используя:**
 - Задачи (Tasks)
 - События: start, end, intermediate
@@ -26,44 +29,215 @@ class EventChainAgent:
 - Последовательности потоков (Sequence Flow)
 
 **Формат ответа:**
-{{
+{
   "nodes": [
-    {{"id": "str", "name": "str", "type": "start/end/task/gateway/intermediate"}},
-    {{"id": "g1", "name": "Пример шлюза", "type": "gateway", "gateway_type": "exclusive/parallel"}}
+    {"id": "str", "name": "str", "type": "start/end/task/gateway/intermediate"},
+    {"id": "g1", "name": "Пример шлюза", "type": "gateway", "gateway_type": "exclusive/parallel"}
   ],
   "flows": [
-    {{"source": "source_id", "target": "target_id"}}
+    {"source": "source_id", "target": "target_id"}
   ]
-}}
+}
 
 **Правила:**
 1. Используйте ДВОЙНЫЕ КАВЫЧКИ для всех ключей и значений
 2. Все элементы должны быть связаны корректными потоками
 3. Для шлюзов (gateway) обязательно поле gateway_type
 4. Пример использования intermediate события:
-   {{"id": "i1", "name": "Уведомление", "type": "intermediate"}}
+   {"id": "i1", "name": "Уведомление", "type": "intermediate"}
 
-Описание процесса: {process_description}
 ВАЖНО: Только JSON без пояснений! Проверьте валидность перед отправкой.
-```json
+
 """
-        logging.debug("Формирование промпта для генерации цепочки: %s", prompt)
-        
+
+    # Иерархическая генерация: сначала план из этапов-подпроцессов, затем каждый этап
+    # разворачивается отдельным вызовом с обычным промптом (PROMPT_PREFIX)
+    OUTLINE_SAMPLING = {"max_tokens": 1024, "temperature": 0.3}
+    OUTLINE_PROMPT_PREFIX = """
+**Вы эксперт в BPMN 2.0. Составьте план процесса верхнего уровня: разбейте процесс на крупные этапы.**
+- Каждый этап - подпроцесс (type "subprocess"); в поле description перечислите все шаги, условия
+  и участников этапа - детали этапа будут построены отдельно только по этому описанию
+- События: start, end, intermediate
+- Шлюзы между этапами: exclusive (условия), parallel (параллельные этапы)
+
+**Формат ответа:**
+{
+  "nodes": [
+    {"id": "start", "name": "Начало", "type": "start"},
+    {"id": "p1", "name": "Название этапа", "type": "subprocess", "description": "Шаги этапа"},
+    {"id": "end", "name": "Конец", "type": "end"}
+  ],
+  "flows": [
+    {"source": "start", "target": "p1"},
+    {"source": "p1", "target": "end"}
+  ]
+}
+
+**Правила:**
+1. От 2 до 8 этапов, без мелких задач на верхнем уровне
+2. Все элементы должны быть связаны корректными потоками
+3. Для шлюзов (gateway) обязательно поле gateway_type
+
+ВАЖНО: Только JSON без пояснений!
+
+"""
+
+    def __init__(self, llm_callable: Any, phase_workers: int = 4):
+            """
+            llm_callable(prompt: str, **kwargs) -> {"choices": [{"text": str}, ...]}
+            Ответ ограничивается грамматикой схемы response_schema="event_chain"
+            (поддерживается InferenceScheduler).
+            phase_workers - сколько этапов иерархической генерации отправлять в модель одновременно.
+            """
+            self.llm = llm_callable
+            self.phase_workers = phase_workers
+
+    def _build_prompt(self, process_description: str) -> str:
+        # Переменная часть идёт последней, чтобы префикс брался из KV-кэша
+        return f"{self.PROMPT_PREFIX}Описание процесса: {process_description}\n```json\n"
+
+    def generate_chain(self, process_description):
+        prompt = self._build_prompt(process_description)
+        # Промпт целиком не логируем: неизменная часть известна, а описание может быть очень длинным
+        logger.debug("Промпт генерации цепочки: %d символов", len(prompt))
+
         response = self.llm(
             prompt=prompt,
-            max_tokens=4096,
-            temperature=0.3,
-            stop=["\n\n"]
+            **self.SAMPLING,
+            response_schema="event_chain"
         )
         raw = response["choices"][0]["text"]
         logger.debug("Сырой ответ LLM:\n%s", raw)
-        
-        json_str = self._extract_json(raw)
-        logging.debug("Выделенный JSON-строковый блок: %s", json_str)
-        
-        data = self._validate_json(json_str)
-        logging.debug("Валидированный event_chain: %s", data)
+
+        data = self._parse(raw)
+        logger.debug("Валидированный event_chain: %s", data)
         return data
+
+    def stream_chain(self, process_description: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Потоковая генерация: события ("token", текст), ("node", узел), ("flow", поток)
+        по мере генерации и финальное ("result", event_chain) после валидации.
+        """
+        stream = JSONEventStream(
+            self.llm(
+                prompt=self._build_prompt(process_description),
+                **self.SAMPLING,
+                response_schema="event_chain",
+                stream=True
+            ),
+            {"nodes": "node", "flows": "flow"}
+        )
+        yield from stream
+        logger.debug("Сырой ответ LLM (поток):\n%s", stream.text)
+        yield "result", self._parse(stream.text)
+
+    def generate_outline(self, process_description: str) -> dict:
+        """План верхнего уровня: цепочка событий, где этапы - узлы type="subprocess" с полем description"""
+        response = self.llm(
+            prompt=f"{self.OUTLINE_PROMPT_PREFIX}Описание процесса: {process_description}\n```json\n",
+            **self.OUTLINE_SAMPLING,
+            response_schema="outline"
+        )
+        raw = response["choices"][0]["text"]
+        logger.debug("Сырой ответ LLM (план):\n%s", raw)
+        outline = self._parse(raw, "event_outline")
+        if not any(node["type"] == "subprocess" for node in outline["nodes"]):
+            raise ValueError("План процесса не содержит этапов")
+        return outline
+
+    def generate_hierarchical(self, process_description: str) -> dict:
+        """
+        Генерация крупного процесса по частям: план из этапов, затем этапы параллельно
+        разворачиваются в подпроцессы. Каждый вызов модели видит только своё описание,
+        поэтому размер процесса не ограничен max_tokens одного ответа.
+        """
+        return self.expand_outline(self.generate_outline(process_description))
+
+    def expand_outline(self, outline: dict,
+                       generate_phase: Optional[Callable[[str], dict]] = None) -> dict:
+        """
+        Разворачивает этапы плана в подпроцессы с вложенными "nodes" и "flows".
+        generate_phase(описание этапа) -> цепочка событий; по умолчанию generate_chain
+        (пайплайн подставляет вариант с кэшем ответов).
+        """
+        return self._assemble(outline, dict(self.iter_phases(outline, generate_phase)))
+
+    def stream_outline(self, outline: dict,
+                       generate_phase: Optional[Callable[[str], dict]] = None) -> Iterator[Tuple[str, Any]]:
+        """Потоковый вариант expand_outline: ("phase", этап) по готовности каждого этапа и финальное ("result", ...)"""
+        phases = {}
+        for phase_id, chain in self.iter_phases(outline, generate_phase):
+            phases[phase_id] = chain
+            yield "phase", {"id": phase_id, **(chain or {"nodes": [], "flows": []})}
+        yield "result", self._assemble(outline, phases)
+
+    def iter_phases(self, outline: dict,
+                    generate_phase: Optional[Callable[[str], dict]] = None) -> Iterator[Tuple[str, Optional[dict]]]:
+        """
+        Генерирует этапы плана одновременно (до phase_workers запросов в очереди модели)
+        и отдаёт (id этапа, цепочка) по мере готовности. Этап, для которого модель
+        не дала корректного JSON, остаётся свёрнутым подпроцессом (цепочка None).
+        """
+        generate_phase = generate_phase or self.generate_chain
+        phases = [node for node in outline["nodes"] if node["type"] == "subprocess"]
+        if not phases:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, min(self.phase_workers, len(phases))),
+                                thread_name_prefix="outline-phase") as pool:
+            # Копия контекста на каждый этап: параметры запроса (приоритет, отмена) и задача
+            # фонового выполнения должны действовать и в потоках пула
+            futures = {
+                pool.submit(contextvars.copy_context().run, generate_phase, self._phase_description(phase)): phase
+                for phase in phases
+            }
+            try:
+                for future in as_completed(futures):
+                    phase = futures[future]
+                    try:
+                        chain = future.result()
+                    except ValueError as e:
+                        logger.warning("Этап '%s' не развёрнут: %s", phase["name"], e)
+                        chain = None
+                    yield phase["id"], None if chain is None else self._prefix_ids(phase["id"], chain)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    @staticmethod
+    def _phase_description(phase: dict) -> str:
+        description = phase.get("description") or phase["name"]
+        return f"Этап «{phase['name']}»: {description}"
+
+    @staticmethod
+    def _prefix_ids(phase_id: str, chain: dict) -> dict:
+        """ID внутри этапа получают префикс этапа, чтобы не совпадать с элементами других этапов"""
+        return {
+            "nodes": [{**node, "id": f"{phase_id}_{node['id']}"} for node in chain["nodes"]],
+            "flows": [{**flow, "source": f"{phase_id}_{flow['source']}", "target": f"{phase_id}_{flow['target']}"}
+                      for flow in chain["flows"]],
+        }
+
+    @staticmethod
+    def _assemble(outline: dict, phases: Dict[str, Optional[dict]]) -> dict:
+        nodes = []
+        for node in outline["nodes"]:
+            if node["type"] == "subprocess":
+                node = {key: value for key, value in node.items() if key != "description"}
+                chain = phases.get(node["id"])
+                if chain is not None:
+                    node.update(nodes=chain["nodes"], flows=chain["flows"])
+            nodes.append(node)
+        return {"nodes": nodes, "flows": outline["flows"]}
+
+    def _parse(self, text: str, agent: str = "event_chain") -> dict:
+        """Выделение и проверка JSON из ответа модели; неудачи учитываются в метриках"""
+        with timed("parse"):
+            try:
+                return self._validate_json(self._extract_json(text))
+            except ValueError:
+                PARSE_FAILURES.inc(agent=agent)
+                raise
+
     def _extract_json(self, text: str) -> str:
         # Извлекаем JSON из блока кода
         match = re.search(r"```json\s*(.*?)\s*```", text, re.DOTALL)
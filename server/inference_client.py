@@ -0,0 +1,170 @@
+# inference_client.py
+import json
+import logging
+import time
+from typing import Iterator, Optional, Tuple
+
+import httpx
+
+from inference_scheduler import (
+    PRIORITY_NORMAL, DeadlineExceededError, InferenceError, ModelNotReadyError, QueueFullError,
+    RequestCancelledError, current_request_options
+)
+from metrics import RequestTimings, current_timings
+
+logger = logging.getLogger(__name__)
+
+# Ошибки сервера модели передаются именем класса и восстанавливаются на стороне клиента
+_ERRORS = {cls.__name__: cls for cls in (InferenceError, QueueFullError, DeadlineExceededError,
+                                         RequestCancelledError, ModelNotReadyError)}
+# Сервер шлёт пустую строку раз в секунду, пока запрос ждёт в очереди (см. model_server.py);
+# если за это время не пришло ничего, соединение считается оборванным
+READ_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 5.0
+# Адрес для запросов через Unix-сокет: хост в нём не используется
+UDS_BASE_URL = "http://model-server"
+
+
+def _error(data: dict) -> InferenceError:
+    return _ERRORS.get(data.get("error"), InferenceError)(data.get("detail") or "Ошибка сервера модели")
+
+
+class InferenceClient:
+    """
+    Тонкий клиент отдельного сервера модели (model_server.py) с тем же интерфейсом, что у
+    InferenceScheduler: llm_callable(prompt, stream=False, **kwargs), параметры запроса -
+    из request_options(). Агенты и пайплайн не отличают его от планировщика в этом процессе.
+
+    url - "http://host:port" или "unix:/путь/к/сокету". Ответ сервера - NDJSON: чанки
+    llama.cpp, затем длительности стадий модели (они попадают в Server-Timing веб-запроса).
+    Ошибки очереди и готовности приходят сразу, до первого чанка, поэтому, как и у
+    планировщика, вызов с stream=True бросает QueueFullError/ModelNotReadyError немедленно.
+    """
+
+    def __init__(self, url: str, read_timeout: float = READ_TIMEOUT, connect_timeout: float = CONNECT_TIMEOUT):
+        self.url = url
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        if url.startswith("unix:"):
+            self._client = httpx.Client(base_url=UDS_BASE_URL, timeout=timeout,
+                                        transport=httpx.HTTPTransport(uds=url[len("unix:"):]))
+        else:
+            self._client = httpx.Client(base_url=url.rstrip("/"), timeout=timeout)
+
+    def __call__(self, prompt: str, stream: bool = False, **kwargs):
+        options = current_request_options()
+        # Замеры запроса берутся в потоке вызывающего, как и в InferenceRequest
+        timings = current_timings()
+        response = self._open({
+            "prompt": prompt,
+            "kwargs": kwargs,
+            "priority": options.get("priority", PRIORITY_NORMAL),
+            "timeout": options.get("timeout"),
+        })
+        chunks = self._chunks(response, options.get("cancel_event"), timings)
+        if stream:
+            return chunks
+        parts = []
+        finish_reason = None
+        for chunk in chunks:
+            choice = chunk["choices"][0]
+            parts.append(choice.get("text", ""))
+            finish_reason = choice.get("finish_reason") or finish_reason
+        return {"choices": [{"text": "".join(parts), "index": 0, "finish_reason": finish_reason}]}
+
+    def _open(self, payload: dict) -> httpx.Response:
+        request = self._client.build_request("POST", "/v1/completions", json=payload)
+        try:
+            response = self._client.send(request, stream=True)
+        except httpx.TransportError as e:
+            # Сервер модели перезапускается или ещё не открыл сокет - для клиента это "модель не готова"
+            raise ModelNotReadyError(f"Сервер модели недоступен: {e}")
+        if response.status_code != 200:
+            try:
+                data = json.loads(response.read())
+            except ValueError:
+                data = {"detail": f"Сервер модели ответил {response.status_code}"}
+            finally:
+                response.close()
+            raise _error(data)
+        return response
+
+    @staticmethod
+    def _chunks(response: httpx.Response, cancel_event, timings: Optional[RequestTimings]) -> Iterator[dict]:
+        """
+        Чанки ответа; отмена проверяется на каждой строке, включая пустые строки ожидания.
+        Закрытие соединения отменяет генерацию на сервере.
+        """
+        try:
+            for line in response.iter_lines():
+                if cancel_event is not None and cancel_event.is_set():
+                    raise RequestCancelledError("Запрос отменён клиентом")
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    raise _error(data)
+                if "timings" in data:
+                    if timings is not None:
+                        for stage, seconds in data["timings"].items():
+                            timings.add(stage, seconds)
+                    continue
+                yield data
+        except httpx.TransportError as e:
+            raise InferenceError(f"Соединение с сервером модели прервано: {e}")
+        finally:
+            response.close()
+
+    def metrics(self) -> dict:
+        return self.get("/scheduler/metrics").json()
+
+    def get(self, path: str) -> httpx.Response:
+        return self._client.get(path, timeout=CONNECT_TIMEOUT)
+
+    def close(self):
+        self._client.close()
+
+
+class RemoteModel:
+    """
+    Состояние модели на отдельном сервере - замена ModelRuntime (model_runtime.py) для
+    веб-процессов: загрузкой и остановкой модели управляет сам сервер модели.
+    """
+
+    # Как часто wait() опрашивает готовность
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    def start(self):
+        logger.info("Модель обслуживает сервер %s", self.client.url)
+
+    def stop(self, timeout: Optional[float] = None):
+        self.client.close()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ready, _ = self.readiness()
+            if ready or (deadline is not None and time.monotonic() >= deadline):
+                return ready
+            time.sleep(self.POLL_INTERVAL)
+
+    def status(self) -> dict:
+        return self.readiness()[1]["model"]
+
+    def liveness(self) -> Tuple[bool, dict]:
+        # Недоступный сервер модели перезапускает supervisord; веб-процесс при этом исправен.
+        # Сбой загрузки модели сам не пройдёт - о нём сообщаем, чтобы контейнер перезапустили
+        try:
+            response = self.client.get("/health/live")
+        except httpx.TransportError as e:
+            return True, {"status": "ok", "model_server": f"недоступен: {e}"}
+        return response.status_code == 200, response.json()
+
+    def readiness(self) -> Tuple[bool, dict]:
+        try:
+            response = self.client.get("/health/ready")
+        except httpx.TransportError as e:
+            return False, {"ready": False, "model": {"state": "unavailable", "error": str(e)}}
+        return response.status_code == 200, response.json()
@@ -0,0 +1,397 @@
+# inference_scheduler.py
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from metrics import (
+    LLM_COMPLETION_TOKENS, LLM_GENERATION, LLM_PROMPT_EVAL, LLM_PROMPT_TOKENS, LLM_QUEUE_WAIT,
+    LLM_REQUESTS, LLM_TOKENS_PER_SECOND, current_timings
+)
+from response_schemas import build_grammar
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов: чем меньше число, тем раньше запрос попадёт в модель
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+# Как часто ожидающий поток проверяет отмену и дедлайн
+WAIT_POLL_INTERVAL = 0.25
+# Без грамматики JSON-ответ ничто не останавливает: генерация обрывается на пустой строке
+FALLBACK_STOP = ["\n\n"]
+
+
+class InferenceError(Exception):
+    """Базовая ошибка планировщика инференса"""
+
+
+class QueueFullError(InferenceError):
+    pass
+
+
+class DeadlineExceededError(InferenceError):
+    pass
+
+
+class RequestCancelledError(InferenceError):
+    pass
+
+
+class ModelNotReadyError(InferenceError):
+    pass
+
+
+# Параметры текущего запроса (приоритет, таймаут, событие отмены).
+# Агенты вызывают планировщик как обычную LLM-функцию, а HTTP-слой
+# задаёт эти параметры через request_options().
+_request_options: ContextVar[Dict[str, Any]] = ContextVar("inference_request_options", default={})
+
+
+@contextmanager
+def request_options(priority: Optional[int] = None, timeout: Optional[float] = None,
+                    cancel_event: Optional[threading.Event] = None):
+    """Задаёт параметры для всех вызовов планировщика внутри блока with"""
+    options = dict(_request_options.get())
+    if priority is not None:
+        options["priority"] = priority
+    if timeout is not None:
+        options["timeout"] = timeout
+    if cancel_event is not None:
+        options["cancel_event"] = cancel_event
+    token = _request_options.set(options)
+    try:
+        yield
+    finally:
+        _request_options.reset(token)
+
+
+def current_request_options() -> Dict[str, Any]:
+    """Параметры, заданные request_options() (для клиента сервера модели, см. inference_client.py)"""
+    return _request_options.get()
+
+
+class InferenceRequest:
+    def __init__(self, prompt: str, kwargs: dict, priority: int,
+                 deadline: Optional[float], cancel_event: Optional[threading.Event],
+                 on_token: Optional[Callable[[str], None]] = None):
+        self.prompt = prompt
+        self.kwargs = kwargs
+        self.priority = priority
+        self.deadline = deadline
+        self.cancel_event = cancel_event
+        self.on_token = on_token
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        # Метка метрик и замеры HTTP-запроса, от имени которого идёт генерация (поток вызывающего)
+        self.schema = kwargs.get("response_schema") or "none"
+        self.timings = current_timings()
+        self._abandoned = False
+
+    def abandon(self):
+        """Отменяет только этот запрос (например, потребитель потока перестал читать)"""
+        self._abandoned = True
+
+    def cancelled(self) -> bool:
+        return self._abandoned or (self.cancel_event is not None and self.cancel_event.is_set())
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+class InferenceScheduler:
+    """
+    Единственный владелец модели: все агенты отправляют запросы в ограниченную
+    очередь с приоритетами, а один рабочий поток по очереди выполняет генерацию.
+
+    Экземпляр совместим с сигнатурой llm_callable(prompt: str, **kwargs) -> dict,
+    поэтому его можно передавать агентам вместо самой модели. Как и llama.cpp,
+    при stream=True возвращает итератор чанков {"choices": [{"text": str}]}.
+    Дополнительно принимает response_schema="<имя>" (см. response_schemas.py) -
+    генерация ограничивается грамматикой этой схемы.
+
+    Модель можно передать позже через attach() (фоновая загрузка, см. model_loader.py);
+    до этого запросы сразу отклоняются ModelNotReadyError.
+    """
+
+    def __init__(self, model: Any = None, max_queue_size: int = 32, default_timeout: float = 300.0,
+                 prefix_cache: Any = None):
+        self.model = model
+        self.prefix_cache = prefix_cache
+        self.max_queue_size = max_queue_size
+        self.default_timeout = default_timeout
+        self._queue: queue.PriorityQueue = queue.PriorityQueue(max_queue_size)
+        self._seq = itertools.count()
+        self._stopping = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._busy = False
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "cancelled": 0,
+            "timed_out": 0,
+            "wait_seconds_total": 0.0,
+            "run_seconds_total": 0.0,
+            "prompt_tokens_total": 0,
+            "completion_tokens_total": 0,
+            "generation_seconds_total": 0.0,
+        }
+
+    def start(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stopping.clear()
+        self._worker = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+        self._worker.start()
+        logger.info("Планировщик инференса запущен (очередь: %d)", self.max_queue_size)
+
+    def attach(self, model: Any):
+        """Подключает загруженную модель (и к кэшу префиксов) и запускает рабочий поток"""
+        self.model = model
+        if self.prefix_cache is not None:
+            self.prefix_cache.model = model
+        self.start()
+
+    @property
+    def alive(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def load(self) -> int:
+        """Запросы в очереди и в генерации - мера загрузки для выбора реплики (см. replica_pool.py)"""
+        with self._lock:
+            busy = self._busy
+        return self._queue.qsize() + int(busy)
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+            self._worker = None
+
+    def submit(self, prompt: str, priority: int = PRIORITY_NORMAL, timeout: Optional[float] = None,
+               cancel_event: Optional[threading.Event] = None,
+               on_token: Optional[Callable[[str], None]] = None, **kwargs) -> InferenceRequest:
+        """Ставит запрос в очередь; при переполнении сразу бросает QueueFullError"""
+        if self.model is None:
+            raise ModelNotReadyError("Модель ещё загружается, повторите запрос позже")
+        timeout = self.default_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout if timeout else None
+        request = InferenceRequest(prompt, kwargs, priority, deadline, cancel_event, on_token)
+        try:
+            self._queue.put_nowait((priority, next(self._seq), request))
+        except queue.Full:
+            self._count("rejected", schema=request.schema)
+            raise QueueFullError("Очередь генерации переполнена, повторите запрос позже")
+        self._count("submitted")
+        return request
+
+    def wait(self, request: InferenceRequest) -> dict:
+        """Ожидает результат, прекращая ожидание при отмене или истечении дедлайна"""
+        while True:
+            try:
+                return request.future.result(timeout=WAIT_POLL_INTERVAL)
+            except FutureTimeoutError:
+                if request.cancelled():
+                    raise RequestCancelledError("Запрос отменён клиентом")
+                if request.expired():
+                    raise DeadlineExceededError("Истекло время ожидания генерации")
+
+    def stream(self, request: InferenceRequest, tokens: "queue.Queue") -> Iterator[dict]:
+        """Отдаёт токены по мере генерации в формате потоковых чанков llama.cpp"""
+        request.future.add_done_callback(lambda _: tokens.put(None))
+        try:
+            while True:
+                try:
+                    text = tokens.get(timeout=WAIT_POLL_INTERVAL)
+                except queue.Empty:
+                    if request.cancelled():
+                        raise RequestCancelledError("Запрос отменён клиентом")
+                    if request.expired():
+                        raise DeadlineExceededError("Истекло время ожидания генерации")
+                    continue
+                if text is None:
+                    break
+                yield {"choices": [{"text": text, "index": 0, "finish_reason": None}]}
+            result = request.future.result()
+            yield {"choices": [{"text": "", "index": 0,
+                                "finish_reason": result["choices"][0]["finish_reason"]}]}
+        finally:
+            if not request.future.done():
+                request.abandon()
+
+    def __call__(self, prompt: str, stream: bool = False, **kwargs):
+        options = current_request_options()
+        tokens: queue.Queue = queue.Queue()
+        request = self.submit(
+            prompt,
+            priority=options.get("priority", PRIORITY_NORMAL),
+            timeout=options.get("timeout"),
+            cancel_event=options.get("cancel_event"),
+            on_token=tokens.put if stream else None,
+            **kwargs
+        )
+        if stream:
+            return self.stream(request, tokens)
+        return self.wait(request)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            busy = self._busy
+        finished = stats["completed"] + stats["failed"] + stats["cancelled"] + stats["timed_out"]
+        metrics = {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_size": self.max_queue_size,
+            "busy": busy,
+            "worker_alive": self.alive,
+            **stats,
+            "avg_wait_seconds": stats["wait_seconds_total"] / finished if finished else 0.0,
+            "avg_run_seconds": stats["run_seconds_total"] / stats["completed"] if stats["completed"] else 0.0,
+            "avg_tokens_per_second": (stats["completion_tokens_total"] / stats["generation_seconds_total"]
+                                      if stats["generation_seconds_total"] else 0.0),
+        }
+        if self.prefix_cache is not None:
+            metrics["prefix_cache"] = self.prefix_cache.metrics()
+        return metrics
+
+    def _count(self, key: str, value: float = 1, schema: Optional[str] = None):
+        """schema задаётся для исходов запроса - они дублируются в bpmn_llm_requests_total"""
+        with self._lock:
+            self._stats[key] += value
+        if schema is not None:
+            LLM_REQUESTS.inc(schema=schema, outcome=key)
+
+    def _run(self):
+        if self.prefix_cache is not None:
+            # KV-состояния префиксов готовит тот же поток, что владеет моделью
+            self.prefix_cache.warm_up()
+        while not self._stopping.is_set():
+            try:
+                _, _, request = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            waited = time.monotonic() - request.enqueued_at
+            self._count("wait_seconds_total", waited)
+            LLM_QUEUE_WAIT.observe(waited, schema=request.schema)
+            if request.timings is not None:
+                request.timings.add("llm_queue_wait", waited)
+            if request.cancelled():
+                self._count("cancelled", schema=request.schema)
+                request.future.set_exception(RequestCancelledError("Запрос отменён до начала генерации"))
+                continue
+            if request.expired():
+                self._count("timed_out", schema=request.schema)
+                request.future.set_exception(DeadlineExceededError("Запрос устарел в очереди"))
+                continue
+            if not request.future.set_running_or_notify_cancel():
+                continue
+
+            started = time.monotonic()
+            with self._lock:
+                self._busy = True
+            try:
+                result = self._generate(request)
+            except RequestCancelledError as e:
+                self._count("cancelled", schema=request.schema)
+                request.future.set_exception(e)
+            except DeadlineExceededError as e:
+                self._count("timed_out", schema=request.schema)
+                request.future.set_exception(e)
+            except Exception as e:
+                logger.exception("Ошибка генерации в планировщике")
+                self._count("failed", schema=request.schema)
+                request.future.set_exception(e)
+            else:
+                self._count("completed", schema=request.schema)
+                self._count("run_seconds_total", time.monotonic() - started)
+                request.future.set_result(result)
+            finally:
+                with self._lock:
+                    self._busy = False
+
+    def _model_kwargs(self, kwargs: dict) -> dict:
+        """
+        Заменяет имя схемы ответа на скомпилированную грамматику llama.cpp; если грамматику
+        построить не удалось - на прежнюю стоп-последовательность
+        """
+        if "response_schema" not in kwargs:
+            return kwargs
+        kwargs = dict(kwargs)
+        grammar = build_grammar(kwargs.pop("response_schema"))
+        if grammar is not None:
+            kwargs["grammar"] = grammar
+        else:
+            kwargs.setdefault("stop", FALLBACK_STOP)
+        return kwargs
+
+    def _generate(self, request: InferenceRequest) -> dict:
+        """
+        Генерация в потоковом режиме llama.cpp: между токенами проверяем отмену
+        и дедлайн, а в конце собираем ответ в обычном формате completion.
+        """
+        parts = []
+        finish_reason = None
+        started = time.monotonic()
+        first_token_at = None
+        if self.prefix_cache is not None:
+            self.prefix_cache.prepare(request.prompt)
+        stream = self.model(prompt=request.prompt, stream=True, **self._model_kwargs(request.kwargs))
+        try:
+            for chunk in stream:
+                choice = chunk["choices"][0]
+                text = choice.get("text", "")
+                parts.append(text)
+                if text and first_token_at is None:
+                    first_token_at = time.monotonic()
+                if text and request.on_token is not None:
+                    request.on_token(text)
+                finish_reason = choice.get("finish_reason") or finish_reason
+                if request.cancelled():
+                    raise RequestCancelledError("Запрос отменён во время генерации")
+                if request.expired():
+                    raise DeadlineExceededError("Истекло время генерации")
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        self._record_generation(request, parts, started, first_token_at)
+        return {"choices": [{"text": "".join(parts), "index": 0, "finish_reason": finish_reason}]}
+
+    def _record_generation(self, request: InferenceRequest, parts: list, started: float,
+                           first_token_at: Optional[float]):
+        """
+        Время обработки промпта (включая восстановление префикса из кэша) - до первого токена,
+        время генерации - после него. llama.cpp отдаёт чанк на каждый токен, поэтому число
+        непустых чанков - число сгенерированных токенов.
+        """
+        finished = time.monotonic()
+        first_token_at = first_token_at or finished
+        prompt_eval, generation = first_token_at - started, finished - first_token_at
+        completion_tokens = sum(1 for text in parts if text)
+        schema = request.schema
+        LLM_PROMPT_EVAL.observe(prompt_eval, schema=schema)
+        LLM_GENERATION.observe(generation, schema=schema)
+        LLM_COMPLETION_TOKENS.inc(completion_tokens, schema=schema)
+        if completion_tokens > 1 and generation > 0:
+            # Первый токен появляется вместе с окончанием обработки промпта
+            LLM_TOKENS_PER_SECOND.observe((completion_tokens - 1) / generation, schema=schema)
+        self._count("completion_tokens_total", completion_tokens)
+        self._count("generation_seconds_total", generation)
+        tokenize = getattr(self.model, "tokenize", None)
+        if tokenize is not None:
+            prompt_tokens = len(tokenize(request.prompt.encode("utf-8"), special=True))
+            LLM_PROMPT_TOKENS.inc(prompt_tokens, schema=schema)
+            self._count("prompt_tokens_total", prompt_tokens)
+        if request.timings is not None:
+            request.timings.add("llm_prompt_eval", prompt_eval)
+            request.timings.add("llm_generation", generation)
@@ -0,0 +1,264 @@
+# job_manager.py
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+from inference_scheduler import request_options
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = {JOB_DONE, JOB_ERROR, JOB_CANCELLED}
+
+# Как часто владелец задачи проверяет отмену, запрошенную другим процессом (при общей базе задач)
+CANCEL_POLL_INTERVAL = 1.0
+
+
+class JobLimitError(Exception):
+    pass
+
+
+_current_job: ContextVar[Optional["Job"]] = ContextVar("current_job", default=None)
+
+
+def report_progress(stage: str):
+    """Отмечает текущую стадию пайплайна, если код выполняется внутри задачи"""
+    job = _current_job.get()
+    if job is not None:
+        job.progress = stage
+        job.updated_at = time.time()
+        if job.on_change is not None:
+            job.on_change(job)
+
+
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = JOB_QUEUED
+        self.progress = JOB_QUEUED
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.error_type: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.finished_at: Optional[float] = None
+        self.cancel_event = threading.Event()
+        # Сохранение состояния в общую базу задач (см. JobManager)
+        self.on_change: Optional[Callable[["Job"], None]] = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        """Задача другого процесса, прочитанная из общей базы (только для чтения)"""
+        job = cls(row["kind"])
+        job.id = row["id"]
+        job.status = row["status"]
+        job.progress = row["progress"]
+        job.result = json.loads(row["result"]) if row["result"] is not None else None
+        job.error = row["error"]
+        job.error_type = row["error_type"]
+        job.created_at = row["created_at"]
+        job.updated_at = row["updated_at"]
+        job.finished_at = row["finished_at"]
+        return job
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == JOB_DONE:
+            data["result"] = self.result
+        if self.error is not None:
+            data["error"] = self.error
+            data["error_type"] = self.error_type
+        return data
+
+
+class JobManager:
+    """
+    Фоновое выполнение долгих стадий пайплайна.
+    Клиент сразу получает id задачи, а результат забирает опросом.
+    Завершённые задачи хранятся ограниченное время (ttl) и в ограниченном количестве (max_jobs).
+
+    Если веб-процессов несколько, опрос может прийти не в тот процесс, что выполняет задачу.
+    С db_path состояние задач дублируется в общую базу SQLite: любой процесс отдаёт статус
+    и результат, а отмену, записанную в базу, владелец задачи замечает в течение секунды.
+    """
+
+    def __init__(self, max_workers: int = 4, ttl: float = 3600.0, max_jobs: int = 1000,
+                 db_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._stopped = threading.Event()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10.0)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+                " progress TEXT NOT NULL, result TEXT, error TEXT, error_type TEXT, created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL, finished_at REAL, cancel_requested INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._db.commit()
+            threading.Thread(target=self._poll_cancellations, name="job-cancel-poll", daemon=True).start()
+
+    def submit(self, kind: str, func: Callable, *args, **kwargs) -> Job:
+        job = Job(kind)
+        with self._lock:
+            self._evict()
+            if len(self._jobs) >= self.max_jobs:
+                raise JobLimitError("Слишком много задач в работе, повторите запрос позже")
+            self._jobs[job.id] = job
+        if self._db is not None:
+            job.on_change = self._save
+            self._save(job)
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._evict()
+            job = self._jobs.get(job_id)
+        if job is None and self._db is not None:
+            with self._db_lock:
+                row = self._db.execute("SELECT * FROM jobs WHERE id = ? AND (finished_at IS NULL OR finished_at >= ?)",
+                                       (job_id, time.time() - self.ttl)).fetchone()
+            job = Job.from_row(row) if row is not None else None
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            if job.status in FINISHED_STATUSES:
+                return False
+            job.cancel_event.set()
+            return True
+        if self._db is None:
+            return False
+        # Задача другого процесса: отмену заберёт её владелец
+        with self._db_lock, self._db:
+            cursor = self._db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND finished_at IS NULL",
+                                      (job_id,))
+        return cursor.rowcount > 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def shutdown(self):
+        self._stopped.set()
+        for job in list(self._jobs.values()):
+            job.cancel_event.set()
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job: Job, func: Callable, args: tuple, kwargs: dict):
+        if job.cancel_event.is_set():
+            self._finish(job, JOB_CANCELLED)
+            return
+        job.status = JOB_RUNNING
+        job.progress = JOB_RUNNING
+        job.updated_at = time.time()
+        if job.on_change is not None:
+            job.on_change(job)
+        token = _current_job.set(job)
+        try:
+            with request_options(cancel_event=job.cancel_event):
+                job.result = func(*args, **kwargs)
+        except Exception as e:
+            if job.cancel_event.is_set():
+                self._finish(job, JOB_CANCELLED)
+            else:
+                logger.exception("Задача %s (%s) завершилась с ошибкой", job.id, job.kind)
+                job.error = str(e)
+                job.error_type = type(e).__name__
+                self._finish(job, JOB_ERROR)
+        else:
+            self._finish(job, JOB_DONE)
+        finally:
+            _current_job.reset(token)
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.progress = status
+        job.finished_at = job.updated_at = time.time()
+        if job.on_change is not None:
+            job.on_change(job)
+
+    def _save(self, job: Job):
+        result = json.dumps(job.result, ensure_ascii=False) if job.status == JOB_DONE else None
+        try:
+            with self._db_lock, self._db:
+                self._db.execute(
+                    "INSERT INTO jobs (id, kind, status, progress, result, error, error_type, created_at, updated_at,"
+                    " finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET"
+                    " status = excluded.status, progress = excluded.progress, result = excluded.result,"
+                    " error = excluded.error, error_type = excluded.error_type, updated_at = excluded.updated_at,"
+                    " finished_at = excluded.finished_at",
+                    (job.id, job.kind, job.status, job.progress, result, job.error, job.error_type,
+                     job.created_at, job.updated_at, job.finished_at)
+                )
+                if job.finished_at is not None:
+                    # Заодно удаляем устаревшие задачи всех процессов
+                    self._db.execute("DELETE FROM jobs WHERE finished_at < ?", (job.finished_at - self.ttl,))
+        except (sqlite3.Error, TypeError, ValueError):
+            # Задача продолжается; её состояние видно только в этом процессе
+            logger.exception("Не удалось сохранить состояние задачи %s", job.id)
+
+    def _poll_cancellations(self):
+        while not self._stopped.wait(CANCEL_POLL_INTERVAL):
+            with self._lock:
+                running = {job.id: job for job in self._jobs.values() if job.status not in FINISHED_STATUSES}
+            if not running:
+                continue
+            try:
+                # Запросы отмены незавершённых задач всех процессов; свои выбираются здесь, а не в IN (...):
+                # число параметров запроса SQLite ограничено
+                with self._db_lock:
+                    rows = self._db.execute(
+                        "SELECT id FROM jobs WHERE cancel_requested = 1 AND finished_at IS NULL"
+                    ).fetchall()
+            except sqlite3.Error:
+                logger.exception("Не удалось проверить отмену задач")
+                continue
+            for row in rows:
+                if row["id"] in running:
+                    running[row["id"]].cancel_event.set()
+
+    def _evict(self):
+        """Удаляет устаревшие задачи и, при переполнении, самые старые завершённые"""
+        now = time.time()
+        for job_id in [j.id for j in self._jobs.values()
+                       if j.finished_at is not None and now - j.finished_at > self.ttl]:
+            del self._jobs[job_id]
+        if len(self._jobs) >= self.max_jobs:
+            for job_id in [j.id for j in self._jobs.values() if j.status in FINISHED_STATUSES]:
+                del self._jobs[job_id]
+                if len(self._jobs) < self.max_jobs:
+                    break
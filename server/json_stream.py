@@ -0,0 +1,131 @@
+# json_stream.py
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalJSONParser:
+    """
+    Потоковый разбор JSON-объекта, который LLM печатает по кусочкам.
+
+    Текст до первой "{" (например, "```json") пропускается. Как только закрывается
+    очередной элемент массива верхнего уровня ({"nodes": [...], "flows": [...]}),
+    feed() возвращает пару (ключ массива, элемент).
+    """
+
+    def __init__(self):
+        self._data = ""
+        self._pos = 0
+        self._stack: List[Dict[str, Any]] = []
+        self._started = False
+        self._finished = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._item_start = None
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        items = []
+        if self._finished:
+            return items
+        self._data += text
+        data = self._data
+
+        while self._pos < len(data) and not self._finished:
+            ch = data[self._pos]
+            pos = self._pos
+            self._pos += 1
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._stack.append({"type": "{", "key": None, "expect_key": True})
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._on_string(data[self._string_start:pos + 1], items)
+                continue
+
+            if ch == '"':
+                if self._at_top_array():
+                    self._item_start = pos
+                self._in_string = True
+                self._string_start = pos
+            elif ch in "{[":
+                if self._at_top_array():
+                    self._item_start = pos
+                self._stack.append({"type": ch, "key": None, "expect_key": ch == "{"})
+            elif ch in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    self._finished = True
+                elif self._at_top_array() and self._item_start is not None:
+                    self._emit(data[self._item_start:pos + 1], items)
+            elif ch == ":":
+                self._stack[-1]["expect_key"] = False
+            elif ch == ",":
+                if self._stack[-1]["type"] == "{":
+                    self._stack[-1]["expect_key"] = True
+        return items
+
+    def _at_top_array(self) -> bool:
+        return len(self._stack) == 2 and self._stack[-1]["type"] == "["
+
+    def _on_string(self, literal: str, items: List[Tuple[str, Any]]):
+        frame = self._stack[-1]
+        if frame["type"] == "{" and frame["expect_key"]:
+            try:
+                frame["key"] = json.loads(literal)
+            except json.JSONDecodeError:
+                frame["key"] = literal.strip('"')
+        elif self._at_top_array():
+            self._emit(literal, items)
+
+    def _emit(self, literal: str, items: List[Tuple[str, Any]]):
+        self._item_start = None
+        try:
+            items.append((self._stack[0]["key"], json.loads(literal)))
+        except json.JSONDecodeError:
+            logger.debug("Пропущен некорректный элемент потока: %s", literal)
+
+
+class JSONEventStream:
+    """
+    Обёртка над потоковым ответом LLM: отдаёт события ("token", текст) для каждого
+    чанка и (имя события, элемент) для закрывшихся элементов массивов из item_events.
+    Полный текст ответа доступен в свойстве text после исчерпания итератора.
+    """
+
+    def __init__(self, chunks: Iterable[dict], item_events: Dict[str, str]):
+        self.chunks = chunks
+        self.item_events = item_events
+        self.parser = IncrementalJSONParser()
+        self._parts: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        for chunk in self.chunks:
+            choice = chunk["choices"][0]
+            text = choice.get("text") or choice.get("delta", {}).get("content") or ""
+            if not text:
+                continue
+            self._parts.append(text)
+            yield "token", text
+            for key, item in self.parser.feed(text):
+                if key in self.item_events:
+                    yield self.item_events[key], item
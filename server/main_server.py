@@ -1,24 +1,42 @@
 import os
-import tempfile
+import json
 import time
+import asyncio
+import threading
 import logging
-import requests
+from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import FastAPI, HTTPException, Body, UploadFile, File
+from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Form, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.datastructures import MutableHeaders
 
 from dotenv import load_dotenv
 
 from event_chain_agent import EventChainAgent, JSONParseError
 from bpmn_agent import BPMNAgent
-from critic_agent import CriticAgent
+from diagram_store import DiagramStore
+from bpmn_import import DiagramImporter
+from critic_agent import CriticAgent, ANALYSIS_MODES, FIX_MODES
+from inference_scheduler import (
+    InferenceError, QueueFullError, DeadlineExceededError, RequestCancelledError, ModelNotReadyError,
+    request_options
+)
+from inference_client import InferenceClient, RemoteModel
+from model_runtime import ModelRuntime, model_id
+from response_cache import ResponseCache
+from pipeline import Pipeline
+from batch import BatchRunner, Checkpoint, parse_jsonl
+from job_manager import JobManager, JobLimitError
+from transcription_client import AssemblyAIClient
+import metrics
 from datetime import datetime
-# Для Llama
-from llama_cpp import Llama
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
+# DEBUG выводит ответы модели целиком - только для отладки
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
 # Загрузим переменные .env (для AssemblyAI API key)
 load_dotenv()
@@ -29,28 +47,176 @@ if not ASSEMBLYAI_API_KEY:
     raise RuntimeError("Set ASSEMBLYAI_API_KEY in .env")
 
 # Константы
-UPLOAD_FOLDER = tempfile.gettempdir()
 TRANSCRIPT_FILE = "transcripts.txt"
 ALLOWED_EXTENSIONS = {"wav", "mp3", "ogg"}
+UPLOAD_CHUNK_SIZE = 64 * 1024
+ASSEMBLYAI_BASE_URL = os.getenv("ASSEMBLYAI_BASE_URL", "https://api.assemblyai.com/v2")
+# Публичный адрес /transcribe/webhook; пусто - готовность определяется только опросом.
+# Ожидание транскрипции ускоряет только уведомление, пришедшее в тот же веб-процесс: при --workers=N
+# остальные уведомления игнорируются, и готовность замечает опрос (пауза не больше 10 с)
+ASSEMBLYAI_WEBHOOK_URL = os.getenv("ASSEMBLYAI_WEBHOOK_URL") or None
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "32"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "300"))
+DISCONNECT_POLL_INTERVAL = 0.5
+# Каталог для сохранения KV-состояний префиксов промптов между перезапусками (пусто - только в памяти)
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR") or None
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+MAX_JOBS = int(os.getenv("MAX_JOBS", "1000"))
+# Общая база задач (SQLite) для нескольких веб-процессов; пусто - задачи видны только своему процессу
+JOB_DB = os.getenv("JOB_DB") or None
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+# Файл SQLite для кэша ответов между перезапусками (пусто - только в памяти)
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB") or None
+# Режим анализа по умолчанию: fast - только алгоритм, auto - LLM при неоднозначном результате, full - всегда LLM
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "auto")
+# Режим исправлений по умолчанию: patch - операции правки, full - перегенерация всей структуры
+FIX_MODE = os.getenv("FIX_MODE", "patch")
+# Иерархическая генерация (план из этапов + этапы по отдельности): сколько этапов генерировать
+# одновременно и с какой длины описания включать её, если запрос не указал "hierarchical" явно
+HIERARCHY_PHASE_WORKERS = int(os.getenv("HIERARCHY_PHASE_WORKERS", "4"))
+HIERARCHY_MIN_CHARS = int(os.getenv("HIERARCHY_MIN_CHARS", "3000"))
+# Пакетная обработка: сколько процессов обрабатывать одновременно (общий предел для всех запросов /batch
+# процесса; при нескольких веб-процессах - на каждый) и где хранить контрольные точки
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_CHECKPOINT_DIR = os.getenv("BATCH_CHECKPOINT_DIR", "batch_checkpoints/")
+# Кэш разобранных BPMN-файлов (по хэшу содержимого) и предельный размер загружаемого файла
+BPMN_IMPORT_CACHE_SIZE = int(os.getenv("BPMN_IMPORT_CACHE_SIZE", "128"))
+MAX_BPMN_UPLOAD = int(os.getenv("MAX_BPMN_UPLOAD", str(10 * 1024 * 1024)))
+# Хранилище диаграмм (SQLite) и политика хранения: версий на имя, возраст в днях и общее число диаграмм
+# (0 - без ограничения). DIAGRAMS_DIR - каталог прежних файлов, доступных только на чтение
+DIAGRAM_DB = os.getenv("DIAGRAM_DB", "diagrams.sqlite3")
+DIAGRAM_MAX_VERSIONS = int(os.getenv("DIAGRAM_MAX_VERSIONS", "20"))
+DIAGRAM_MAX_AGE_DAYS = float(os.getenv("DIAGRAM_MAX_AGE_DAYS", "0"))
+DIAGRAM_MAX_COUNT = int(os.getenv("DIAGRAM_MAX_COUNT", "0"))
+DIAGRAMS_DIR = "exported_diagrams/"
+# Сохранять ли сгенерированные диаграммы на диск (в фоне); запрос может переопределить полем "persist"
+PERSIST_DIAGRAMS = os.getenv("PERSIST_DIAGRAMS", "1") != "0"
+DIAGRAM_WRITE_TIMEOUT = 5.0
+# Диаграмма пишется в хранилище в фоне процессом, который её сгенерировал. При нескольких веб-процессах
+# чтение сразу после генерации может попасть в другой процесс - он повторяет поиск столько секунд
+# (0 - не повторять: при одном процессе незавершённая запись и так дожидается)
+DIAGRAM_READ_RETRY = float(os.getenv("DIAGRAM_READ_RETRY", "0"))
+# Адрес отдельного сервера модели (model_server.py): "unix:/путь/к/сокету" или "http://host:port".
+# Пусто - модель загружается в этом процессе (параметры модели - в model_runtime.py)
+MODEL_SERVER_URL = os.getenv("MODEL_SERVER_URL") or None
+SHUTDOWN_TIMEOUT = 5.0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Порт открывается сразу: модель грузится в фоне, а /health/ready сообщает о готовности
+    model_runtime.start()
+    yield
+    await transcriber.aclose()
+    bpmn_agent.shutdown()
+    diagram_store.close()
+    jobs.shutdown()
+    model_runtime.stop(SHUTDOWN_TIMEOUT)
 
 # Инициализируем FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Инициализация Llama и агентов
-MODEL_PATH = r"model\Qwen2.5-14B-Instruct-GGUF\Qwen2.5-14B-Instruct-Q4_K_M.gguf"
-model = Llama.from_pretrained(
-    repo_id="lmstudio-community/Qwen2.5-14B-Instruct-1M-GGUF",
-    filename="Qwen2.5-14B-Instruct-1M-Q4_K_M.gguf",
-    n_gpu_layers=-1, split_mode=1, main_gpu=0,
-    max_tokens=8000, n_ctx=32768, n_batch=1024,
-    use_mlock=True, offload_kqv=True, flash_attn=True,
-    verbose=False
-)
+# Модель и агенты. Агенты вызывают llm одинаково: планировщик в этом процессе
+# или клиент общего сервера модели, если веб-процессов несколько (uvicorn --workers)
+if MODEL_SERVER_URL:
+    llm = InferenceClient(MODEL_SERVER_URL)
+    model_runtime = RemoteModel(llm)
+else:
+    model_runtime = ModelRuntime(max_queue_size=INFERENCE_QUEUE_SIZE, default_timeout=INFERENCE_TIMEOUT,
+                                 prompt_cache_dir=PROMPT_CACHE_DIR)
+    model_runtime.register_metrics()
+    llm = model_runtime.scheduler
+
+event_agent  = EventChainAgent(llm, phase_workers=HIERARCHY_PHASE_WORKERS)
+diagram_store = DiagramStore(DIAGRAM_DB, max_versions=DIAGRAM_MAX_VERSIONS,
+                             max_age=DIAGRAM_MAX_AGE_DAYS * 86400, max_diagrams=DIAGRAM_MAX_COUNT)
+bpmn_agent   = BPMNAgent(llm, store=diagram_store, output_dir=DIAGRAMS_DIR, persist=PERSIST_DIAGRAMS)
+critic_agent = CriticAgent(llm)
+bpmn_importer = DiagramImporter(max_entries=BPMN_IMPORT_CACHE_SIZE)
+
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, db_path=RESPONSE_CACHE_DB)
+pipeline = Pipeline(event_agent, bpmn_agent, critic_agent, response_cache=response_cache, model_file=model_id())
+
+batch_runner = BatchRunner(pipeline, bpmn_agent, concurrency=BATCH_CONCURRENCY)
+
+jobs = JobManager(max_workers=JOB_WORKERS, ttl=JOB_TTL, max_jobs=MAX_JOBS, db_path=JOB_DB)
+
+transcriber = AssemblyAIClient(ASSEMBLYAI_API_KEY, base_url=ASSEMBLYAI_BASE_URL,
+                               max_concurrency=TRANSCRIBE_CONCURRENCY, webhook_url=ASSEMBLYAI_WEBHOOK_URL)
+
+# --------------------
+# Метрики (GET /metrics) и заголовок Server-Timing с длительностями стадий запроса
+# --------------------
+HTTP_REQUEST_SECONDS = metrics.histogram("bpmn_http_request_seconds", "Время ответа HTTP (до конца тела)",
+                                         ["method", "route", "status"])
+# Состояние компонентов читается в момент опроса /metrics (модели - см. model_runtime.py)
+metrics.gauge("bpmn_response_cache_entries", "Ответы в памяти кэша",
+              function=lambda: response_cache.metrics()["memory_entries"])
+metrics.counter("bpmn_import_cache_lookups_total", "Обращения к кэшу разобранных BPMN-файлов", ["result"],
+                function=lambda: {"hit": bpmn_importer.metrics()["hits"], "miss": bpmn_importer.metrics()["misses"]})
+metrics.gauge("bpmn_diagram_store_diagrams", "Диаграммы в хранилище",
+              function=lambda: diagram_store.metrics()["diagrams"])
+metrics.gauge("bpmn_diagram_store_bytes", "Сжатый объём версий диаграмм в хранилище",
+              function=lambda: diagram_store.metrics()["stored_bytes"])
 
-event_agent  = EventChainAgent(model)
-bpmn_agent   = BPMNAgent(model)
-critic_agent = CriticAgent(model)
+class ServerTimingMiddleware:
+    """
+    Стадии (очередь и генерация модели, разбор ответа, сборка и экспорт BPMN, транскрипция)
+    записываются в замеры запроса из любых потоков; клиент получает их в Server-Timing.
+    У потоковых ответов заголовок уходит до генерации и содержит только подготовительные стадии.
+    Чистый ASGI, а не @app.middleware("http"): тот пропускает каждый чанк потокового ответа
+    через промежуточную очередь, что заметно замедляло SSE (см. bench_service.py).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = metrics.start_request()
+        status = 500
+
+        async def send_with_timings(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            # Шаблон маршрута, а не путь - число рядов метрики не растёт с числом диаграмм и задач
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - timings.started, method=scope["method"],
+                                         route=route, status=status)
+
+app.add_middleware(ServerTimingMiddleware)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Метрики хранятся в памяти процесса: при --workers=N каждый запрос /metrics отвечает показателями
+# одного (случайного) веб-процесса. Для точных счётчиков опрашивайте каждый процесс отдельно или
+# запускайте один веб-процесс на порт. Метрики модели при MODEL_SERVER_URL - в /metrics/model
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/metrics/model")
+def model_server_metrics():
+    """Метрики сервера модели (очередь, генерация, KV-кэш): сам он слушает только Unix-сокет"""
+    if not MODEL_SERVER_URL:
+        raise HTTPException(404, "Модель работает в этом процессе, её метрики - в /metrics")
+    try:
+        response = llm.get("/metrics")
+    except Exception as e:
+        raise HTTPException(503, f"Сервер модели недоступен: {e}")
+    return Response(response.content, status_code=response.status_code, media_type=PROMETHEUS_CONTENT_TYPE)
 
 # --------------------
 # НОВЫЕ ФУНКЦИИ ДЛЯ ТРАНСКРИПЦИИ
@@ -58,74 +224,96 @@ critic_agent = CriticAgent(model)
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def upload_file_to_assemblyai(file_path: str) -> str:
-    """Загружает аудио на AssemblyAI и возвращает upload_url."""
-    upload_url = "https://api.assemblyai.com/v2/upload"
-    with open(file_path, 'rb') as ff:
-        res = requests.post(
-            upload_url,
-            headers={"authorization": ASSEMBLYAI_API_KEY},
-            data=ff.read(),
-            timeout=30
-        )
-    res.raise_for_status()
-    return res.json()["upload_url"]
-
-def create_transcript(audio_url: str) -> str:
-    """Создаёт задачу транскрипции и возвращает её ID."""
-    transcript_url = "https://api.assemblyai.com/v2/transcript"
-    data = {
-        "audio_url": audio_url,
-        "language_code": "ru",
-        "speech_model": "best"
-    }
-    res = requests.post(transcript_url, json=data,
-                        headers={"authorization": ASSEMBLYAI_API_KEY},
-                        timeout=30)
-    res.raise_for_status()
-    return res.json()["id"]
-
-def poll_transcript(transcript_id: str) -> str:
-    """Ожидает готовности транскрипции и возвращает текст."""
-    polling_url = f"https://api.assemblyai.com/v2/transcript/{transcript_id}"
-    start = time.time()
+async def iter_upload(audio: UploadFile):
+    """Читает загруженный файл кусками, не держа его в памяти целиком"""
     while True:
-        if time.time() - start > 300:
-            raise TimeoutError("Таймаут транскрипции")
-        res = requests.get(polling_url,
-                           headers={"authorization": ASSEMBLYAI_API_KEY})
-        res.raise_for_status()
-        data = res.json()
-        if data["status"] == "completed":
-            return data["text"]
-        if data["status"] == "error":
-            raise Exception(f"AssemblyAI error: {data.get('error')}")
-        time.sleep(2)
+        chunk = await audio.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def append_transcript(text: str):
+    with open(TRANSCRIPT_FILE, "a", encoding="utf-8") as tf:
+        tf.write(f"{datetime.now().isoformat()}\t{text}\n")
 
 @app.post("/transcribe")
 async def transcribe_audio(audio: UploadFile = File(...)):
     # Проверка формата
     if not allowed_file(audio.filename):
         raise HTTPException(status_code=400, detail="Неподдерживаемый формат")
-    # Сохраним во временный файл
-    temp_path = os.path.join(UPLOAD_FOLDER, audio.filename)
     try:
-        with open(temp_path, "wb") as f:
-            f.write(await audio.read())
-        # Загрузка, создание и ожидание транскрипции
-        upload_url = upload_file_to_assemblyai(temp_path)
-        transcript_id = create_transcript(upload_url)
-        text = poll_transcript(transcript_id)
+        # Загрузка, создание и ожидание транскрипции без блокировки event loop
+        text = await transcriber.transcribe(iter_upload(audio))
         # Опционально: сохраняем в лог
-        with open(TRANSCRIPT_FILE, "a", encoding="utf-8") as tf:
-            tf.write(f"{datetime.now().isoformat()}\t{text}\n")
+        await run_in_threadpool(append_transcript, text)
         return {"success": True, "text": text}
     except Exception as e:
         logger.exception("transcribe failed")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+
+@app.post("/transcribe/webhook")
+async def transcribe_webhook(payload: dict = Body(...)):
+    """Уведомление AssemblyAI о смене статуса транскрипции (если задан ASSEMBLYAI_WEBHOOK_URL)"""
+    transcript_id = payload.get("transcript_id")
+    if transcript_id:
+        transcriber.notify(transcript_id)
+    return {"ok": True}
+
+# --------------------
+# Вызовы LLM через планировщик
+# --------------------
+async def run_llm_stage(request: Request, func, *args):
+    """
+    Выполняет стадию пайплайна в пуле потоков, не блокируя event loop.
+    Если клиент отключился, генерация отменяется в планировщике.
+    """
+    cancel_event = threading.Event()
+
+    def call():
+        with request_options(cancel_event=cancel_event):
+            return func(*args)
+
+    task = asyncio.ensure_future(run_in_threadpool(call))
+    while not task.done():
+        await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if not task.done() and await request.is_disconnected():
+            logger.info("Клиент отключился, отменяем генерацию")
+            cancel_event.set()
+    return task.result()
+
+def inference_http_error(e: InferenceError) -> HTTPException:
+    if isinstance(e, (QueueFullError, ModelNotReadyError)):
+        return HTTPException(503, str(e))
+    if isinstance(e, DeadlineExceededError):
+        return HTTPException(504, str(e))
+    if isinstance(e, RequestCancelledError):
+        return HTTPException(499, str(e))
+    return HTTPException(500, str(e))
+
+# --------------------
+# Проверки здоровья: live - процесс работоспособен, ready - модель загружена и прогрета
+# --------------------
+@app.get("/health/live")
+def liveness():
+    ok, content = model_runtime.liveness()
+    return JSONResponse(status_code=200 if ok else 503, content=content)
+
+@app.get("/health/ready")
+def readiness():
+    ready, content = model_runtime.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+@app.get("/scheduler/metrics")
+def scheduler_metrics():
+    try:
+        return llm.metrics()
+    except Exception as e:
+        raise HTTPException(503, f"Метрики планировщика недоступны: {e}")
+
+@app.get("/cache/metrics")
+def cache_metrics():
+    return {**response_cache.metrics(), "single_flight": pipeline.single_flight.metrics(),
+            "bpmn_import": bpmn_importer.metrics()}
 
 # --------------------
 # Существующие маршруты вашего FastAPI
@@ -134,14 +322,24 @@ async def transcribe_audio(audio: UploadFile = File(...)):
 def home():
     return open("static/index.html", encoding="utf-8").read()
 
+def use_hierarchy(process_description: str, hierarchical: Optional[bool]) -> bool:
+    if hierarchical is None:
+        return len(process_description) >= HIERARCHY_MIN_CHARS
+    return hierarchical
+
 @app.post("/generate-event-chain")
-def generate_event_chain(process_description: str = Body(..., embed=True)):
+async def generate_event_chain(request: Request, process_description: str = Body(..., embed=True),
+                               no_cache: bool = Body(False, embed=True),
+                               hierarchical: Optional[bool] = Body(None, embed=True)):
     try:
         if not process_description.strip():
             raise ValueError("Описание процесса не может быть пустым")
-        return event_agent.generate_chain(process_description)
+        return await run_llm_stage(request, pipeline.generate_chain, process_description, no_cache,
+                                   use_hierarchy(process_description, hierarchical))
     except JSONParseError as e:
         raise HTTPException(400, str(e))
+    except InferenceError as e:
+        raise inference_http_error(e)
     except Exception:
         raise HTTPException(500, "Internal server error")
 
@@ -150,7 +348,9 @@ def generate_bpmn(request_data: dict = Body(...)):
     try:
         xml, name = bpmn_agent.generate_raw_bpmn(
             request_data["event_chain"],
-            request_data.get("filename")
+            request_data.get("filename"),
+            request_data.get("persist"),
+            request_data.get("description")
         )
         return {"bpmn_xml": xml, "filename": name}
     except Exception as e:
@@ -158,34 +358,245 @@ def generate_bpmn(request_data: dict = Body(...)):
 
 @app.get("/diagram/{file_name}")
 def get_diagram(file_name: str):
-    path = os.path.join("exported_diagrams", file_name)
-    if not os.path.exists(path):
+    return Response(stored_diagram(file_name), media_type="application/xml")
+
+def stored_diagram(file_name: str) -> bytes:
+    bpmn_xml = bpmn_agent.load_diagram(file_name, timeout=DIAGRAM_WRITE_TIMEOUT, retry=DIAGRAM_READ_RETRY)
+    if bpmn_xml is None:
         raise HTTPException(404, "File not found")
-    return FileResponse(path, media_type="application/xml")
+    return bpmn_xml.encode("utf-8")
+
+# --------------------
+# Хранилище диаграмм: список, версии, цепочки событий, очистка
+# --------------------
+@app.get("/diagrams")
+def list_diagrams(limit: int = 50, cursor: Optional[str] = None, prefix: Optional[str] = None,
+                  description: Optional[str] = None, content_hash: Optional[str] = None):
+    try:
+        items, next_cursor = diagram_store.list(min(max(limit, 1), 500), cursor, prefix, description, content_hash)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+@app.get("/diagrams/{name}")
+def get_stored_diagram(name: str, version: Optional[int] = None):
+    bpmn_agent.load_diagram(name, timeout=DIAGRAM_WRITE_TIMEOUT, retry=DIAGRAM_READ_RETRY)
+    record = diagram_store.get(name, version)
+    if record is None:
+        raise HTTPException(404, "Диаграмма не найдена")
+    return record
+
+@app.get("/diagrams/{name}/versions")
+def get_diagram_versions(name: str):
+    versions = diagram_store.versions(name)
+    if versions is None:
+        raise HTTPException(404, "Диаграмма не найдена")
+    return {"name": name, "versions": versions}
+
+@app.delete("/diagrams/{name}")
+def delete_diagram(name: str):
+    if not diagram_store.delete(name):
+        raise HTTPException(404, "Диаграмма не найдена")
+    return {"name": name, "deleted": True}
+
+@app.post("/diagrams/gc")
+def collect_diagrams():
+    return {"removed": diagram_store.gc(), **diagram_store.metrics()}
+
+def analysis_mode(request_data: dict) -> str:
+    mode = request_data.get("mode", ANALYSIS_MODE)
+    if mode not in ANALYSIS_MODES:
+        raise HTTPException(422, f"Недопустимый режим анализа: {mode}")
+    return mode
+
+def fix_mode(request_data: dict) -> str:
+    mode = request_data.get("fix_mode", FIX_MODE)
+    if mode not in FIX_MODES:
+        raise HTTPException(422, f"Недопустимый режим исправлений: {mode}")
+    return mode
 
 @app.post("/analyze-diagram")
-def analyze_diagram(request_data: dict = Body(...)):
+async def analyze_diagram(request: Request, request_data: dict = Body(...)):
+    mode = analysis_mode(request_data)
     try:
-        return critic_agent.analyze_diagram(request_data.get("bpmn_json", {}))
+        return await run_llm_stage(request, pipeline.analyze, request_data.get("bpmn_json", {}),
+                                   request_data.get("no_cache", False), mode)
+    except InferenceError as e:
+        raise inference_http_error(e)
     except Exception as e:
         raise HTTPException(422, str(e))
 
 @app.post("/apply-fixes")
-def apply_fixes(request_data: dict = Body(...)):
+async def apply_fixes(request: Request, request_data: dict = Body(...)):
+    mode = fix_mode(request_data)
     try:
-        original = request_data["original"]
-        analysis = request_data["analysis"]
-        issues = [
-            *[err["message"] for err in analysis["algorithm_errors"]],
-            *analysis["llm_recommendations"].get("recommendations", []),
-            *analysis["llm_recommendations"].get("critical_issues", [])
-        ]
-        modified = critic_agent.generate_llm_fixes(original, issues)
-        bpmn_xml, filename = bpmn_agent.generate_raw_bpmn(modified, None)
-        return {"modified_data": modified, "bpmn_xml": bpmn_xml, "filename": filename}
+        return await run_llm_stage(request, pipeline.apply_fixes, request_data["original"],
+                                   request_data["analysis"], request_data.get("no_cache", False), mode)
+    except InferenceError as e:
+        raise inference_http_error(e)
     except Exception as e:
         raise HTTPException(422, str(e))
 
+# --------------------
+# Импорт существующих .bpmn (сохранённых или из других редакторов) в цепочку событий
+# --------------------
+async def read_bpmn_upload(file: UploadFile) -> bytes:
+    content = await file.read(MAX_BPMN_UPLOAD + 1)
+    if len(content) > MAX_BPMN_UPLOAD:
+        raise HTTPException(413, "Слишком большой BPMN-файл")
+    return content
+
+async def import_bpmn(load, source) -> dict:
+    try:
+        chain, content_hash = await run_in_threadpool(load, source)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return {"bpmn_json": chain, "content_hash": content_hash}
+
+@app.post("/import-bpmn")
+async def import_bpmn_upload(file: UploadFile = File(...)):
+    return await import_bpmn(bpmn_importer.load_bytes, await read_bpmn_upload(file))
+
+@app.get("/diagram/{file_name}/event-chain")
+async def stored_diagram_chain(file_name: str):
+    return await import_bpmn(bpmn_importer.load_bytes, await run_in_threadpool(stored_diagram, file_name))
+
+@app.post("/analyze-bpmn")
+async def analyze_bpmn_upload(request: Request, file: UploadFile = File(...), mode: Optional[str] = Form(None),
+                              no_cache: bool = Form(False)):
+    mode = analysis_mode({"mode": mode or ANALYSIS_MODE})
+    imported = await import_bpmn(bpmn_importer.load_bytes, await read_bpmn_upload(file))
+    return await analyze_imported(request, imported, no_cache, mode)
+
+@app.post("/diagram/{file_name}/analyze")
+async def analyze_stored_diagram(request: Request, file_name: str, request_data: dict = Body({})):
+    mode = analysis_mode(request_data)
+    imported = await import_bpmn(bpmn_importer.load_bytes, await run_in_threadpool(stored_diagram, file_name))
+    return await analyze_imported(request, imported, request_data.get("no_cache", False), mode)
+
+async def analyze_imported(request: Request, imported: dict, no_cache: bool, mode: str) -> dict:
+    try:
+        analysis = await run_llm_stage(request, pipeline.analyze, imported["bpmn_json"], no_cache, mode)
+    except InferenceError as e:
+        raise inference_http_error(e)
+    return {**imported, "analysis": analysis}
+
+# --------------------
+# Потоковые (SSE) варианты: токены и готовые элементы отдаются по мере генерации
+# --------------------
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    def body():
+        try:
+            for event, data in events:
+                yield sse_event(event, data)
+        except InferenceError as e:
+            yield sse_event("error", {"detail": str(e), "status": inference_http_error(e).status_code})
+        except Exception as e:
+            logger.exception("stream failed")
+            yield sse_event("error", {"detail": str(e), "status": 500})
+
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/stream/generate-event-chain")
+def stream_generate_event_chain(process_description: str = Body(..., embed=True),
+                                no_cache: bool = Body(False, embed=True),
+                                hierarchical: Optional[bool] = Body(None, embed=True)):
+    if not process_description.strip():
+        raise HTTPException(400, "Описание процесса не может быть пустым")
+    return sse_response(pipeline.stream_chain(process_description, no_cache,
+                                              use_hierarchy(process_description, hierarchical)))
+
+@app.post("/stream/analyze-diagram")
+def stream_analyze_diagram(request_data: dict = Body(...)):
+    return sse_response(pipeline.stream_analysis(request_data.get("bpmn_json", {}),
+                                                 request_data.get("no_cache", False),
+                                                 analysis_mode(request_data)))
+
+@app.post("/stream/apply-fixes")
+def stream_apply_fixes_endpoint(request_data: dict = Body(...)):
+    if "original" not in request_data or "analysis" not in request_data:
+        raise HTTPException(422, "Требуются поля original и analysis")
+    return sse_response(pipeline.stream_apply_fixes(request_data["original"], request_data["analysis"],
+                                                    request_data.get("no_cache", False),
+                                                    fix_mode(request_data)))
+
+# --------------------
+# Асинхронные задачи: id возвращается сразу, результат забирается опросом
+# --------------------
+def submit_job(kind: str, func, *args) -> JSONResponse:
+    try:
+        job = jobs.submit(kind, func, *args)
+    except JobLimitError as e:
+        raise HTTPException(503, str(e))
+    return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+@app.post("/jobs/generate-event-chain")
+def submit_generate_event_chain(process_description: str = Body(..., embed=True),
+                                no_cache: bool = Body(False, embed=True),
+                                hierarchical: Optional[bool] = Body(None, embed=True)):
+    if not process_description.strip():
+        raise HTTPException(400, "Описание процесса не может быть пустым")
+    return submit_job("generate-event-chain", pipeline.generate_chain, process_description, no_cache,
+                      use_hierarchy(process_description, hierarchical))
+
+@app.post("/jobs/analyze-diagram")
+def submit_analyze_diagram(request_data: dict = Body(...)):
+    return submit_job("analyze-diagram", pipeline.analyze, request_data.get("bpmn_json", {}),
+                      request_data.get("no_cache", False), analysis_mode(request_data))
+
+@app.post("/jobs/apply-fixes")
+def submit_apply_fixes(request_data: dict = Body(...)):
+    if "original" not in request_data or "analysis" not in request_data:
+        raise HTTPException(422, "Требуются поля original и analysis")
+    return submit_job("apply-fixes", pipeline.apply_fixes, request_data["original"], request_data["analysis"],
+                      request_data.get("no_cache", False), fix_mode(request_data))
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Задача не найдена или устарела")
+    return job.to_dict()
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    if jobs.get(job_id) is None:
+        raise HTTPException(404, "Задача не найдена или устарела")
+    return {"job_id": job_id, "cancelled": jobs.cancel(job_id)}
+
+# --------------------
+# Пакетная обработка: JSONL описаний на входе, JSONL результатов по мере готовности на выходе
+# --------------------
+@app.post("/batch")
+async def run_batch(request: Request, analyze: bool = False, mode: Optional[str] = None,
+                    no_cache: bool = False, persist: Optional[bool] = None, checkpoint: Optional[str] = None):
+    """
+    Тело запроса - JSONL (см. batch.py). checkpoint - имя контрольной точки: повторный запрос
+    с тем же именем после сбоя не генерирует заново уже готовые процессы.
+    """
+    mode = analysis_mode({"mode": mode or ANALYSIS_MODE})
+    journal = None
+    if checkpoint:
+        if os.path.basename(checkpoint) != checkpoint or checkpoint.startswith("."):
+            raise HTTPException(422, "Недопустимое имя контрольной точки")
+        journal = Checkpoint(os.path.join(BATCH_CHECKPOINT_DIR, checkpoint + ".jsonl"))
+    items = list(parse_jsonl((await request.body()).decode("utf-8").splitlines()))
+
+    def body():
+        try:
+            for record in batch_runner.run(items, analyze=analyze, mode=mode, no_cache=no_cache,
+                                           persist=persist, checkpoint=journal):
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        finally:
+            if journal is not None:
+                journal.close()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 # --------------------
 # Запуск
 # --------------------
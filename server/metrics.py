@@ -0,0 +1,238 @@
+# metrics.py
+"""
+Замеры стадий обработки и их публикация в текстовом формате Prometheus (GET /metrics).
+
+Метрики - счётчики, измерители и гистограммы с метками; без внешних зависимостей
+и потокобезопасные (стадии выполняются в пуле потоков и в рабочем потоке модели).
+Кроме того, длительности стадий текущего HTTP-запроса собираются в RequestTimings
+и отдаются клиенту заголовком Server-Timing.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм (последняя корзина +Inf добавляется при выводе)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    """
+    Общая часть метрик: имя, описание, имена меток и значения по набору меток.
+    Если задана function, значения берутся из неё при каждом выводе (состояние других
+    компонентов - глубина очереди, размер кэша); она возвращает число или {значения меток: число}.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.function = function
+        self._values: Dict[Labels, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Labels:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labels}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self) -> List[Tuple[str, Labels, Tuple[Tuple[str, str], ...], float]]:
+        """(суффикс имени, значения меток, дополнительные метки, значение)"""
+        if self.function is not None:
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        values = {key if isinstance(key, tuple) else (key,): value for key, value in values.items()}
+        return [("", key, (), float(value)) for key, value in sorted(values.items())]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self._samples():
+            pairs = [*zip(self.labels, key), *extra]
+            label_text = ",".join(f'{name}="{_escape(text)}"' for name, text in pairs)
+            lines.append(f"{self.name}{suffix}{{{label_text}}} {_format(value)}" if label_text
+                         else f"{self.name}{suffix} {_format(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Счётчики по корзинам (без накопления), затем сумма и число наблюдений
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        samples = []
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                samples.append(("_bucket", key, (("le", _format(bound)),), cumulative))
+            samples.append(("_bucket", key, (("le", "+Inf"),), state[-1]))
+            samples.append(("_sum", key, (), state[-2]))
+            samples.append(("_count", key, (), state[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus 0.0.4"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labels: Sequence[str] = (), function=None) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labels, function))
+
+
+def gauge(name: str, documentation: str, labels: Sequence[str] = (), function=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labels, function))
+
+
+def histogram(name: str, documentation: str, labels: Sequence[str] = (),
+              buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+# Метрики стадий, общие для всех модулей
+STAGE_SECONDS = histogram("bpmn_stage_seconds", "Длительность стадии обработки", ["stage"])
+PARSE_FAILURES = counter("bpmn_parse_failures_total", "Ответы модели, не прошедшие разбор и проверку JSON",
+                         ["agent"])
+CACHE_LOOKUPS = counter("bpmn_response_cache_lookups_total", "Обращения к кэшу ответов LLM-стадий",
+                        ["stage", "result"])
+LLM_REQUESTS = counter("bpmn_llm_requests_total", "Запросы к модели по схеме ответа и исходу",
+                       ["schema", "outcome"])
+LLM_QUEUE_WAIT = histogram("bpmn_llm_queue_wait_seconds", "Ожидание запроса в очереди планировщика", ["schema"])
+LLM_PROMPT_EVAL = histogram("bpmn_llm_prompt_eval_seconds",
+                            "Обработка промпта: от начала генерации до первого токена", ["schema"])
+LLM_GENERATION = histogram("bpmn_llm_generation_seconds", "Генерация после первого токена", ["schema"])
+LLM_TOKENS_PER_SECOND = histogram("bpmn_llm_tokens_per_second", "Скорость генерации, токенов в секунду",
+                                  ["schema"], buckets=TOKENS_PER_SECOND_BUCKETS)
+LLM_PROMPT_TOKENS = counter("bpmn_llm_prompt_tokens_total", "Токены промптов", ["schema"])
+LLM_COMPLETION_TOKENS = counter("bpmn_llm_completion_tokens_total", "Сгенерированные токены", ["schema"])
+
+
+class RequestTimings:
+    """Суммарные длительности стадий одного HTTP-запроса (стадии могут идти в разных потоках)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    def stages(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stages)
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing: стадии и общее время в миллисекундах"""
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages().items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def start_request() -> RequestTimings:
+    """Начинает сбор длительностей для текущего запроса (вызывается middleware)"""
+    timings = RequestTimings()
+    _request_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _request_timings.get()
+
+
+def record_stage(stage: str, seconds: float, timings: Optional[RequestTimings] = None):
+    """Записывает длительность в гистограмму и в замеры запроса (по умолчанию - текущего)"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = timings or _request_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    """Замер блока with (или, как декоратор, вызова функции); учитывается и при исключении"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,88 @@
+# model_loader.py
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_PENDING = "pending"
+STATE_LOADING = "loading"
+STATE_WARMING_UP = "warming_up"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+class ModelLoader:
+    """
+    Загрузка модели в фоновом потоке: HTTP-сервер поднимается сразу и отвечает на проверки
+    здоровья, пока GGUF скачивается, отображается в память и инициализируется.
+
+    load() -> модель; on_loaded(модель) подключает её к планировщику; warm_up() - короткая
+    генерация, после которой модель "горячая" (веса в памяти, KV-кэш префиксов готов).
+    Готовность (ready) наступает только после прогрева. name различает реплики модели в журнале.
+    """
+
+    def __init__(self, load: Callable[[], Any], on_loaded: Callable[[Any], None],
+                 warm_up: Optional[Callable[[], None]] = None, name: Optional[str] = None):
+        self.name = name
+        self._load = load
+        self._on_loaded = on_loaded
+        self._warm_up = warm_up
+        self._state = STATE_PENDING
+        self._error: Optional[str] = None
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запускает загрузку; повторные вызовы ничего не делают"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Ожидает окончания загрузки и прогрева; True - модель готова"""
+        self._done.wait(timeout)
+        return self.ready
+
+    @property
+    def ready(self) -> bool:
+        return self._state == STATE_READY
+
+    @property
+    def failed(self) -> bool:
+        return self._state == STATE_FAILED
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"state": self._state, "error": self._error, **self._timings}
+
+    def _set_state(self, state: str):
+        with self._lock:
+            self._state = state
+        logger.info("Модель%s: %s", f" [{self.name}]" if self.name else "", state)
+
+    def _run(self):
+        try:
+            self._set_state(STATE_LOADING)
+            started = time.monotonic()
+            model = self._load()
+            self._timings["load_seconds"] = round(time.monotonic() - started, 3)
+            self._on_loaded(model)
+            if self._warm_up is not None:
+                self._set_state(STATE_WARMING_UP)
+                started = time.monotonic()
+                self._warm_up()
+                self._timings["warm_up_seconds"] = round(time.monotonic() - started, 3)
+            self._set_state(STATE_READY)
+        except Exception as e:
+            logger.exception("Не удалось загрузить модель")
+            with self._lock:
+                self._error = str(e)
+            self._set_state(STATE_FAILED)
+        finally:
+            self._done.set()
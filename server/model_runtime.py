@@ -0,0 +1,255 @@
+# model_runtime.py
+import glob
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+from critic_agent import CriticAgent
+from event_chain_agent import EventChainAgent
+from inference_scheduler import PRIORITY_HIGH, InferenceScheduler, request_options
+from model_loader import STATE_READY, ModelLoader
+from prompt_cache import PrefixCache
+from replica_pool import ReplicaPool
+
+logger = logging.getLogger(__name__)
+
+# Модель: локальный GGUF, если файл есть, иначе загрузка с Hugging Face.
+# Загружается в фоне после старта сервера; готовность - после короткой пробной генерации
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join("model", "Qwen2.5-14B-Instruct-GGUF",
+                                                  "Qwen2.5-14B-Instruct-Q4_K_M.gguf"))
+MODEL_REPO = "lmstudio-community/Qwen2.5-14B-Instruct-1M-GGUF"
+MODEL_FILE = "Qwen2.5-14B-Instruct-1M-Q4_K_M.gguf"
+# На узлах без GPU - MODEL_N_GPU_LAYERS=0
+MODEL_PARAMS = dict(
+    n_gpu_layers=int(os.getenv("MODEL_N_GPU_LAYERS", "-1")), split_mode=1, main_gpu=0,
+    max_tokens=8000, n_ctx=32768, n_batch=1024,
+    use_mlock=True, offload_kqv=True, flash_attn=True,
+    verbose=False
+)
+MODEL_WARMUP_PROMPT = "Ответьте одним словом: готово.\n"
+MODEL_WARMUP_TOKENS = 4
+# Реплики модели (см. replica_specs): пусто - одна реплика без привязки к ядрам; N - N реплик
+# на равных долях доступных ядер; "numa" - реплика на каждый NUMA-узел; JSON-список - явно,
+# например [{"cpus": "0-15", "n_threads": 16}, {"cpus": "16-31", "n_threads": 16, "n_ctx": 16384}]
+MODEL_REPLICAS = os.getenv("MODEL_REPLICAS", "")
+
+NUMA_NODES_GLOB = "/sys/devices/system/node/node[0-9]*"
+
+
+def model_id() -> str:
+    """Имя модели для ключа кэша ответов: ответы разных моделей не смешиваются"""
+    if os.path.exists(MODEL_PATH):
+        return os.path.basename(MODEL_PATH)
+    return f"{MODEL_REPO}/{MODEL_FILE}"
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """Список ядер в формате Linux ("0-3,8,10-11") -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = []
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def available_cpus() -> List[int]:
+    """Ядра, на которых процессу разрешено работать (с учётом taskset и cgroup cpuset)"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes() -> List[List[int]]:
+    """Ядра каждого NUMA-узла по данным sysfs; пустой список - сведений о NUMA нет"""
+    nodes = []
+    paths = sorted(glob.glob(NUMA_NODES_GLOB), key=lambda path: int(re.sub(r"\D", "", os.path.basename(path))))
+    for path in paths:
+        try:
+            with open(os.path.join(path, "cpulist")) as f:
+                nodes.append(parse_cpu_list(f.read().strip()))
+        except OSError:
+            continue
+    return nodes
+
+
+def replica_specs(value: str) -> List[Dict[str, Any]]:
+    """
+    MODEL_REPLICAS -> параметры реплик. Параметр реплики - поле "cpus" (ядра для привязки)
+    и любые параметры Llama поверх MODEL_PARAMS; у привязанных реплик n_threads и
+    n_threads_batch по умолчанию равны числу их ядер.
+    """
+    value = value.strip()
+    if not value:
+        return [{}]
+    if value.startswith("["):
+        specs = json.loads(value)
+    else:
+        allowed = available_cpus()
+        if value == "numa":
+            groups = [[cpu for cpu in node if cpu in allowed] for node in numa_nodes()]
+            groups = [group for group in groups if group] or [allowed]
+        else:
+            count = int(value)
+            if not 1 <= count <= len(allowed):
+                raise ValueError(f"MODEL_REPLICAS={count}: доступно ядер - {len(allowed)}")
+            size = len(allowed) // count
+            groups = [allowed[i * size:(i + 1) * size] for i in range(count)]
+        specs = [{"cpus": group} for group in groups]
+    for spec in specs:
+        if isinstance(spec.get("cpus"), str):
+            spec["cpus"] = parse_cpu_list(spec["cpus"])
+        if spec.get("cpus"):
+            spec.setdefault("n_threads", len(spec["cpus"]))
+            spec.setdefault("n_threads_batch", spec["n_threads"])
+    return specs
+
+
+def pin_current_thread(cpus: List[int]):
+    """
+    Привязывает текущий поток к ядрам. Потоки, созданные после этого (рабочий поток
+    планировщика, потоки вычислений llama.cpp), наследуют привязку, а память контекста
+    выделяется на NUMA-узле этих ядер (первое обращение).
+    """
+    try:
+        os.sched_setaffinity(0, cpus)
+    except (AttributeError, OSError) as e:
+        logger.warning("Не удалось привязать реплику к ядрам %s: %s", cpus, e)
+
+
+def load_model(params: Optional[Dict[str, Any]] = None):
+    # Импорт здесь: веб-процессам, работающим через сервер модели, llama_cpp не нужен
+    from llama_cpp import Llama
+
+    params = {**MODEL_PARAMS, **(params or {})}
+    if os.path.exists(MODEL_PATH):
+        logger.info("Загрузка модели из %s", MODEL_PATH)
+        return Llama(model_path=MODEL_PATH, **params)
+    logger.info("Локальная модель не найдена, загрузка %s/%s", MODEL_REPO, MODEL_FILE)
+    return Llama.from_pretrained(repo_id=MODEL_REPO, filename=MODEL_FILE, **params)
+
+
+class ModelReplica:
+    """
+    Одна копия модели: свой контекст llama.cpp, KV-кэш префиксов агентов, планировщик
+    и фоновая загрузка. Загрузка идёт в потоке, привязанном к ядрам реплики (если заданы).
+    """
+
+    def __init__(self, name: str, spec: Dict[str, Any], max_queue_size: int, default_timeout: float,
+                 prompt_cache_dir: Optional[str]):
+        self.name = name
+        self.cpus: Optional[List[int]] = spec.get("cpus") or None
+        self.params = {key: value for key, value in spec.items() if key not in ("name", "cpus")}
+        # KV-кэш неизменных инструкций агентов
+        self.prefix_cache = PrefixCache(cache_dir=prompt_cache_dir)
+        self.prefix_cache.register("event_chain", EventChainAgent.PROMPT_PREFIX)
+        self.prefix_cache.register("event_outline", EventChainAgent.OUTLINE_PROMPT_PREFIX)
+        self.prefix_cache.register("critic_analysis", CriticAgent.ANALYSIS_PROMPT_PREFIX)
+        self.prefix_cache.register("critic_fixes", CriticAgent.FIXES_PROMPT_PREFIX)
+        self.prefix_cache.register("critic_patch", CriticAgent.PATCH_PROMPT_PREFIX)
+        # Модель планировщик получает после загрузки
+        self.scheduler = InferenceScheduler(max_queue_size=max_queue_size, default_timeout=default_timeout,
+                                            prefix_cache=self.prefix_cache)
+        self.loader = ModelLoader(self._load, self.scheduler.attach, self._warm_up, name=name)
+
+    def _load(self):
+        if self.cpus:
+            pin_current_thread(self.cpus)
+        return load_model(self.params)
+
+    def _warm_up(self):
+        # Идёт после подготовки KV-кэша префиксов в рабочем потоке планировщика
+        with request_options(priority=PRIORITY_HIGH):
+            self.scheduler(prompt=MODEL_WARMUP_PROMPT, max_tokens=MODEL_WARMUP_TOKENS)
+
+    @property
+    def available(self) -> bool:
+        """Прогрета и может принимать запросы"""
+        return self.loader.ready and self.scheduler.alive
+
+    @property
+    def broken(self) -> bool:
+        """Сбой загрузки или остановившийся рабочий поток не исправятся сами"""
+        return self.loader.failed or (self.loader.ready and not self.scheduler.alive)
+
+    def status(self) -> dict:
+        return {"name": self.name, "cpus": self.cpus, **self.loader.status()}
+
+
+class ModelRuntime:
+    """
+    Модель в этом процессе: реплики (ModelReplica) за диспетчером ReplicaPool, через который
+    идут все запросы агентов. Используется сервером с одним процессом (main_server.py без
+    MODEL_SERVER_URL) и отдельным сервером модели (model_server.py). Клиентская замена - RemoteModel.
+    """
+
+    def __init__(self, max_queue_size: int = 32, default_timeout: float = 300.0,
+                 prompt_cache_dir: Optional[str] = None, replicas: Optional[List[Dict[str, Any]]] = None):
+        """max_queue_size - очередь каждой реплики; replicas - по умолчанию из MODEL_REPLICAS"""
+        specs = replica_specs(MODEL_REPLICAS) if replicas is None else replicas
+        self.replicas = [ModelReplica(str(spec.get("name", i)), spec, max_queue_size, default_timeout,
+                                      prompt_cache_dir) for i, spec in enumerate(specs)]
+        self.scheduler = ReplicaPool(self.replicas)
+
+    def start(self):
+        for replica in self.replicas:
+            replica.loader.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        for replica in self.replicas:
+            replica.scheduler.stop(timeout)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Ожидает окончания загрузки всех реплик; True - хотя бы одна готова"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for replica in self.replicas:
+            replica.loader.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return self.ready
+
+    @property
+    def ready(self) -> bool:
+        return any(replica.available for replica in self.replicas)
+
+    def status(self) -> dict:
+        replicas = [replica.status() for replica in self.replicas]
+        states = {item["state"] for item in replicas}
+        if len(states) == 1:
+            state = states.pop()
+        else:
+            # Часть реплик обслуживает запросы, остальные загружаются или не загрузились
+            state = "degraded" if STATE_READY in states else "loading"
+        errors = [item["error"] for item in replicas if item["error"]]
+        return {"state": state, "error": errors[0] if errors else None, "replicas": replicas}
+
+    def liveness(self) -> Tuple[bool, dict]:
+        # Перезапуск нужен, только если не осталось ни одной исправной реплики
+        if all(replica.broken for replica in self.replicas):
+            return False, {"status": "error", "model": self.status()}
+        return True, {"status": "ok"}
+
+    def readiness(self) -> Tuple[bool, dict]:
+        ready = self.ready
+        return ready, {"ready": ready, "model": self.status()}
+
+    def register_metrics(self):
+        """Состояние реплик и их планировщиков для /metrics (читается в момент опроса)"""
+        metrics.gauge("bpmn_model_ready", "Хотя бы одна реплика модели загружена и прогрета",
+                      function=lambda: int(self.ready))
+        metrics.gauge("bpmn_model_replica_ready", "Реплика модели загружена, прогрета и принимает запросы",
+                      ["replica"], function=lambda: {r.name: int(r.available) for r in self.replicas})
+        metrics.gauge("bpmn_inference_queue_depth", "Запросы, ожидающие модель", ["replica"],
+                      function=lambda: {r.name: r.scheduler.metrics()["queue_depth"] for r in self.replicas})
+        metrics.gauge("bpmn_inference_busy", "Реплика занята генерацией", ["replica"],
+                      function=lambda: {r.name: int(r.scheduler.metrics()["busy"]) for r in self.replicas})
+        metrics.counter("bpmn_inference_submitted_total", "Запросы, направленные реплике", ["replica"],
+                        function=lambda: {r.name: r.scheduler.metrics()["submitted"] for r in self.replicas})
+        metrics.counter("bpmn_prefix_cache_events_total", "События KV-кэша префиксов промптов",
+                        ["replica", "event"],
+                        function=lambda: {(r.name, event): value for r in self.replicas
+                                          for event, value in r.prefix_cache.metrics().items()
+                                          if event != "prefixes"})
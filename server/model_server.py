@@ -0,0 +1,133 @@
+# model_server.py
+"""
+Отдельный процесс с моделью: одна копия GGUF в памяти на все веб-процессы main_server.py.
+Веб-процессы обращаются к нему через InferenceClient (inference_client.py), если задан
+MODEL_SERVER_URL; очередь с приоритетами, KV-кэш префиксов и метрики модели - здесь.
+
+    uvicorn model_server:app --uds /tmp/bpmn-model.sock
+    MODEL_SERVER_URL=unix:/tmp/bpmn-model.sock uvicorn main_server:app --workers 4
+
+POST /v1/completions {"prompt", "kwargs", "priority", "timeout"} -> NDJSON: чанки
+{"choices": [...]} по мере генерации, затем {"timings": {...}}; ошибка генерации - строка
+{"error": "<класс>", "detail"}. Переполнение очереди и неготовность модели - сразу 503.
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+
+from fastapi import Body, FastAPI
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+import metrics
+from inference_scheduler import (
+    PRIORITY_NORMAL, DeadlineExceededError, InferenceError, ModelNotReadyError, QueueFullError
+)
+from model_runtime import ModelRuntime
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "32"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "300"))
+# Каталог для сохранения KV-состояний префиксов промптов между перезапусками (пусто - только в памяти)
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR") or None
+SHUTDOWN_TIMEOUT = 5.0
+# Пустая строка в ответе, пока запрос ждёт очереди: клиент проверяет отмену, а соединение не простаивает
+KEEPALIVE_INTERVAL = 1.0
+
+runtime = ModelRuntime(max_queue_size=INFERENCE_QUEUE_SIZE, default_timeout=INFERENCE_TIMEOUT,
+                       prompt_cache_dir=PROMPT_CACHE_DIR)
+runtime.register_metrics()
+scheduler = runtime.scheduler
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    runtime.start()
+    yield
+    runtime.stop(SHUTDOWN_TIMEOUT)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def error_line(e: Exception) -> str:
+    return json.dumps({"error": type(e).__name__, "detail": str(e)}, ensure_ascii=False) + "\n"
+
+
+@app.post("/v1/completions")
+async def completions(payload: dict = Body(...)):
+    timings = metrics.start_request()
+    loop = asyncio.get_running_loop()
+    tokens: asyncio.Queue = asyncio.Queue()
+    try:
+        request = scheduler.submit(
+            payload["prompt"],
+            priority=payload.get("priority", PRIORITY_NORMAL),
+            timeout=payload.get("timeout"),
+            on_token=lambda text: loop.call_soon_threadsafe(tokens.put_nowait, text),
+            **payload.get("kwargs", {})
+        )
+    except (QueueFullError, ModelNotReadyError) as e:
+        return JSONResponse(status_code=503, content={"error": type(e).__name__, "detail": str(e)})
+    request.future.add_done_callback(lambda _: loop.call_soon_threadsafe(tokens.put_nowait, None))
+
+    async def body():
+        # Токены передаются из рабочего потока модели в event loop без пула потоков
+        getter = None
+        try:
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(tokens.get())
+                done, _ = await asyncio.wait({getter}, timeout=KEEPALIVE_INTERVAL)
+                if not done:
+                    if request.expired():
+                        raise DeadlineExceededError("Истекло время ожидания генерации")
+                    yield "\n"
+                    continue
+                text, getter = getter.result(), None
+                if text is None:
+                    break
+                yield json.dumps({"choices": [{"text": text, "index": 0, "finish_reason": None}]},
+                                 ensure_ascii=False) + "\n"
+            result = request.future.result()
+            yield json.dumps({"choices": [{"text": "", "index": 0,
+                                           "finish_reason": result["choices"][0]["finish_reason"]}]}) + "\n"
+            yield json.dumps({"timings": timings.stages()}) + "\n"
+        except InferenceError as e:
+            yield error_line(e)
+        except Exception as e:
+            logger.exception("Ошибка генерации")
+            yield error_line(e)
+        finally:
+            if getter is not None:
+                getter.cancel()
+            # Клиент закрыл соединение (отмена, отключение) - генерация прекращается
+            if not request.future.done():
+                request.abandon()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@app.get("/health/live")
+def liveness():
+    ok, content = runtime.liveness()
+    return JSONResponse(status_code=200 if ok else 503, content=content)
+
+
+@app.get("/health/ready")
+def readiness():
+    ready, content = runtime.readiness()
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
+@app.get("/scheduler/metrics")
+def scheduler_metrics():
+    return scheduler.metrics()
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
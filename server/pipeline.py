@@ -0,0 +1,243 @@
+# pipeline.py
+import logging
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+from critic_agent import FIX_PATCH, MODE_AUTO, MODE_FULL
+from inference_scheduler import RequestCancelledError
+from job_manager import report_progress
+from metrics import CACHE_LOOKUPS
+from response_cache import ResponseCache, make_cache_key
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def collect_issues(analysis: dict, algorithm_errors: Optional[list] = None) -> list:
+    """
+    Проблемы для LLM-исправления. algorithm_errors заменяет ошибки из анализа -
+    например, оставшиеся после автоисправления.
+    """
+    if algorithm_errors is None:
+        algorithm_errors = analysis.get("algorithm_errors", [])
+    llm_recommendations = analysis.get("llm_recommendations") or {}
+    return [
+        *[err["message"] for err in algorithm_errors],
+        *llm_recommendations.get("recommendations", []),
+        *llm_recommendations.get("critical_issues", [])
+    ]
+
+
+class Pipeline:
+    """
+    Стадии обработки (цепочка событий -> BPMN -> анализ -> исправления) поверх агентов.
+    Используется синхронными, потоковыми и фоновыми маршрутами одинаково;
+    ответы LLM-стадий кэшируются по содержимому запроса, а одинаковые одновременные
+    запросы (двойной клик, повторная отправка) присоединяются к уже идущей генерации.
+    """
+
+    def __init__(self, event_agent: Any, bpmn_agent: Any, critic_agent: Any,
+                 response_cache: Optional[ResponseCache] = None, model_file: str = ""):
+        self.event_agent = event_agent
+        self.bpmn_agent = bpmn_agent
+        self.critic_agent = critic_agent
+        self.response_cache = response_cache
+        self.model_file = model_file
+        self.single_flight = SingleFlight(retry_on=(RequestCancelledError,))
+
+    # Синхронные стадии
+    def generate_chain(self, process_description: str, no_cache: bool = False, hierarchical: bool = False) -> dict:
+        if hierarchical:
+            outline = self._outline(process_description, no_cache)
+            report_progress("phases")
+            return self.event_agent.expand_outline(
+                outline, lambda description: self.generate_chain(description, no_cache)
+            )
+        return self._cached(
+            "event_chain", self.event_agent, process_description,
+            lambda: self.event_agent.generate_chain(process_description),
+            no_cache=no_cache
+        )
+
+    def _outline(self, process_description: str, no_cache: bool) -> dict:
+        # План и этапы кэшируются по отдельности: этап с тем же описанием берётся из кэша
+        # и при другом плане, а повтор запроса не вызывает модель вовсе
+        report_progress("outline")
+        return self._cached(
+            "event_outline", self.event_agent, process_description,
+            lambda: self.event_agent.generate_outline(process_description),
+            no_cache=no_cache
+        )
+
+    def analyze(self, bpmn_json: dict, no_cache: bool = False, mode: str = MODE_AUTO) -> dict:
+        # Алгоритмический уровень занимает микросекунды и не кэшируется;
+        # в кэш попадает только полный анализ с LLM, одинаковый для режимов auto и full
+        fast = self.critic_agent.fast_analysis(bpmn_json, mode)
+        if fast is not None:
+            return fast
+        return self._cached(
+            "critic_analysis", self.critic_agent, bpmn_json,
+            lambda: self.critic_agent.analyze_diagram(bpmn_json, MODE_FULL),
+            cacheable=lambda result: bool(result.get("llm_recommendations")),
+            no_cache=no_cache
+        )
+
+    def apply_fixes(self, original: dict, analysis: dict, no_cache: bool = False,
+                    fix_mode: str = FIX_PATCH) -> dict:
+        # Ошибки структуры исправляются правилами за миллисекунды; LLM получает только остаток
+        report_progress("auto_repair")
+        repaired = self.critic_agent.auto_repair(original)
+        issues = collect_issues(analysis, repaired["algorithm_errors"])
+        result = repaired
+        if issues:
+            report_progress("llm_fixes")
+            base = repaired["modified_data"]
+            payload = {"original": base, "issues": issues}
+            fix_mode = self.critic_agent.fix_mode_for(base, fix_mode)
+            if fix_mode == FIX_PATCH:
+                operations = self._cached(
+                    "critic_patch", self.critic_agent, payload,
+                    lambda: self.critic_agent.generate_llm_patch(base, issues),
+                    # Пустой список - ошибка LLM или нечего править; не кэшируем
+                    cacheable=bool,
+                    no_cache=no_cache
+                )
+                result = self._merge_fixes(repaired, self.critic_agent.apply_patch(base, operations))
+            else:
+                modified = self._cached(
+                    "critic_fixes", self.critic_agent, payload,
+                    lambda: self.critic_agent.generate_llm_fixes(base, issues),
+                    # При ошибке LLM агент возвращает исходную структуру - такой ответ не кэшируем
+                    cacheable=lambda result: result is not base,
+                    no_cache=no_cache
+                )
+                # Пустой набор операций - только повторная проверка структуры
+                result = self._merge_fixes(repaired, self.critic_agent.apply_patch(modified, []))
+        report_progress("bpmn_export")
+        bpmn_xml, filename = self.bpmn_agent.generate_raw_bpmn(result["modified_data"], None)
+        return {**result, "bpmn_xml": bpmn_xml, "filename": filename}
+
+    @staticmethod
+    def _merge_fixes(repaired: dict, fixed: dict) -> dict:
+        return {
+            "modified_data": fixed["modified_data"],
+            "operations": repaired["operations"] + fixed["operations"],
+            "rejected_operations": repaired["rejected_operations"] + fixed["rejected_operations"],
+            "algorithm_errors": fixed["algorithm_errors"]
+        }
+
+    # Потоковые стадии: события (имя, данные), последнее - ("result", ...)
+    def stream_chain(self, process_description: str, no_cache: bool = False,
+                     hierarchical: bool = False) -> Iterator[Tuple[str, Any]]:
+        if hierarchical:
+            return self._stream_hierarchical(process_description, no_cache)
+        return self._stream_cached(
+            "event_chain", self.event_agent, process_description,
+            lambda: self.event_agent.stream_chain(process_description),
+            no_cache=no_cache
+        )
+
+    def _stream_hierarchical(self, process_description: str, no_cache: bool) -> Iterator[Tuple[str, Any]]:
+        outline = self._outline(process_description, no_cache)
+        yield "outline", outline
+        yield from self.event_agent.stream_outline(
+            outline, lambda description: self.generate_chain(description, no_cache)
+        )
+
+    def stream_analysis(self, bpmn_json: dict, no_cache: bool = False,
+                        mode: str = MODE_AUTO) -> Iterator[Tuple[str, Any]]:
+        fast = self.critic_agent.fast_analysis(bpmn_json, mode)
+        if fast is not None:
+            return iter([("algorithm_errors", fast["algorithm_errors"]), ("result", fast)])
+        return self._stream_cached(
+            "critic_analysis", self.critic_agent, bpmn_json,
+            lambda: self.critic_agent.stream_analysis(bpmn_json, MODE_FULL),
+            cacheable=lambda result: bool(result.get("llm_recommendations")),
+            no_cache=no_cache
+        )
+
+    def stream_apply_fixes(self, original: dict, analysis: dict, no_cache: bool = False,
+                           fix_mode: str = FIX_PATCH) -> Iterator[Tuple[str, Any]]:
+        repaired = self.critic_agent.auto_repair(original)
+        for operation in repaired["operations"]:
+            yield "operation", operation
+        issues = collect_issues(analysis, repaired["algorithm_errors"])
+        result = repaired
+        if issues:
+            base = repaired["modified_data"]
+            payload = {"original": base, "issues": issues}
+            fix_mode = self.critic_agent.fix_mode_for(base, fix_mode)
+            if fix_mode == FIX_PATCH:
+                events = self._stream_cached(
+                    "critic_patch", self.critic_agent, payload,
+                    lambda: self.critic_agent.stream_patch(base, issues),
+                    cacheable=bool, no_cache=no_cache
+                )
+            else:
+                events = self._stream_cached(
+                    "critic_fixes", self.critic_agent, payload,
+                    lambda: self.critic_agent.stream_fixes(base, issues),
+                    cacheable=lambda result: result is not base, no_cache=no_cache
+                )
+            outcome = None
+            for event, data in events:
+                if event == "result":
+                    outcome = data
+                else:
+                    yield event, data
+            if fix_mode == FIX_PATCH:
+                fixed = self.critic_agent.apply_patch(base, outcome or [])
+            else:
+                fixed = self.critic_agent.apply_patch(base if outcome is None else outcome, [])
+            result = self._merge_fixes(repaired, fixed)
+        bpmn_xml, filename = self.bpmn_agent.generate_raw_bpmn(result["modified_data"], None)
+        yield "result", {**result, "bpmn_xml": bpmn_xml, "filename": filename}
+
+    # Кэширование
+    def _cache_key(self, agent_name: str, agent: Any, payload: Any) -> str:
+        return make_cache_key(agent_name, payload, agent.PROMPT_VERSION, agent.SAMPLING, self.model_file)
+
+    def _cached(self, agent_name: str, agent: Any, payload: Any, compute: Callable[[], Any],
+                cacheable: Callable[[Any], bool] = lambda result: True, no_cache: bool = False) -> Any:
+        key = self._cache_key(agent_name, agent, payload)
+        if no_cache:
+            # Явный запрос свежей генерации не кэшируется на чтение и не схлопывается
+            if self.response_cache is not None:
+                self.response_cache.record_bypass()
+                CACHE_LOOKUPS.inc(stage=agent_name, result="bypass")
+            return self._compute_and_store(key, compute, cacheable)
+
+        if self.response_cache is not None:
+            hit, value = self.response_cache.get(key)
+            CACHE_LOOKUPS.inc(stage=agent_name, result="hit" if hit else "miss")
+            if hit:
+                logger.debug("Ответ %s взят из кэша", agent_name)
+                return value
+        return self.single_flight.do(key, lambda: self._compute_and_store(key, compute, cacheable))
+
+    def _compute_and_store(self, key: str, compute: Callable[[], Any], cacheable: Callable[[Any], bool]) -> Any:
+        value = compute()
+        if self.response_cache is not None and cacheable(value):
+            self.response_cache.set(key, value)
+        return value
+
+    def _stream_cached(self, agent_name: str, agent: Any, payload: Any,
+                       events: Callable[[], Iterator[Tuple[str, Any]]],
+                       cacheable: Callable[[Any], bool] = lambda result: True,
+                       no_cache: bool = False) -> Iterator[Tuple[str, Any]]:
+        if self.response_cache is None:
+            yield from events()
+            return
+        key = self._cache_key(agent_name, agent, payload)
+        if no_cache:
+            self.response_cache.record_bypass()
+            CACHE_LOOKUPS.inc(stage=agent_name, result="bypass")
+        else:
+            hit, value = self.response_cache.get(key)
+            CACHE_LOOKUPS.inc(stage=agent_name, result="hit" if hit else "miss")
+            if hit:
+                yield "result", value
+                return
+        for event, data in events():
+            if event == "result" and cacheable(data):
+                self.response_cache.set(key, data)
+            yield event, data
@@ -0,0 +1,288 @@
+# process_graph.py
+import logging
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_CRITICAL = "critical"
+SEVERITY_WARNING = "warning"
+# Замечания, при которых процесс остаётся исполнимым; остальные ошибки делают его некорректным
+WARNING_CODES = {"DUPLICATE_FLOW", "EXCLUSIVE_SINGLE_OUTGOING"}
+
+
+class ProcessGraph:
+    """
+    Ориентированный граф процесса по цепочке событий {"nodes": [...], "flows": [...]}:
+    узлы - элементы, рёбра - потоки source -> target. Списки смежности строятся один раз,
+    все обходы линейны по числу узлов и потоков.
+    Граф строится для одной области: развёрнутый подпроцесс в нём - обычный узел,
+    его содержимое - отдельный граф (см. scopes).
+    """
+
+    def __init__(self, data: dict):
+        self.nodes: Dict[str, dict] = {}
+        for node in data.get("nodes", []):
+            self.nodes.setdefault(node.get("id"), node)
+        self.successors: Dict[str, List[str]] = {node_id: [] for node_id in self.nodes}
+        self.predecessors: Dict[str, List[str]] = {node_id: [] for node_id in self.nodes}
+        self.duplicate_flows: List[Tuple[str, str]] = []
+        self.dangling_flows: List[dict] = []
+
+        seen: Set[Tuple[str, str]] = set()
+        for flow in data.get("flows", []):
+            source, target = flow.get("source"), flow.get("target")
+            if source not in self.nodes or target not in self.nodes:
+                self.dangling_flows.append(flow)
+                continue
+            if (source, target) in seen:
+                self.duplicate_flows.append((source, target))
+                continue
+            seen.add((source, target))
+            self.successors[source].append(target)
+            self.predecessors[target].append(source)
+
+    def ids_of_type(self, node_type: str) -> List[str]:
+        return [node_id for node_id, node in self.nodes.items() if node.get("type") == node_type]
+
+    def gateways(self, gateway_type: str) -> List[str]:
+        return [node_id for node_id, node in self.nodes.items()
+                if node.get("type") == "gateway" and node.get("gateway_type") == gateway_type]
+
+    def name(self, node_id: str) -> str:
+        return self.nodes[node_id].get("name") or node_id
+
+    def reachable(self, sources: Iterable[str], reverse: bool = False) -> Set[str]:
+        """Узлы, достижимые из sources (при reverse=True - из которых достижим хотя бы один из sources)"""
+        adjacency = self.predecessors if reverse else self.successors
+        visited = set(sources)
+        queue = deque(visited)
+        while queue:
+            for neighbour in adjacency[queue.popleft()]:
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    queue.append(neighbour)
+        return visited
+
+    def strongly_connected_components(self) -> List[List[str]]:
+        """Компоненты сильной связности (итеративный алгоритм Тарьяна)"""
+        index: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        on_stack: Set[str] = set()
+        stack: List[str] = []
+        components: List[List[str]] = []
+        counter = 0
+
+        for root in self.nodes:
+            if root in index:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.successors[root]))]
+            while work:
+                node, successors = work[-1]
+                for successor in successors:
+                    if successor not in index:
+                        index[successor] = low[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        on_stack.add(successor)
+                        work.append((successor, iter(self.successors[successor])))
+                        break
+                    if successor in on_stack:
+                        low[node] = min(low[node], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+        return components
+
+
+def is_container(node: dict) -> bool:
+    """Развёрнутый подпроцесс - узел type="subprocess" со своими nodes и flows"""
+    return node.get("type") == "subprocess" and bool(node.get("nodes"))
+
+
+def scopes(data: dict, parent: Optional[str] = None) -> Iterator[Tuple[Optional[str], dict]]:
+    """
+    Области цепочки: сам процесс (parent=None) и содержимое каждого развёрнутого подпроцесса
+    на любой глубине (parent - ID подпроцесса, область - сам узел подпроцесса).
+    Потоки не пересекают границу подпроцесса, поэтому каждая область - самостоятельный процесс.
+    """
+    yield parent, data
+    for node in data.get("nodes", []):
+        if is_container(node):
+            yield from scopes(node, node.get("id"))
+
+
+def nesting_depth(data: dict) -> int:
+    """Глубина вложенности подпроцессов: 0 - плоская цепочка"""
+    return max((1 + nesting_depth(node) for node in data.get("nodes", []) if is_container(node)), default=0)
+
+
+def _error(code: str, message: str, elements: List[str]) -> dict:
+    severity = SEVERITY_WARNING if code in WARNING_CODES else SEVERITY_CRITICAL
+    return {"code": code, "message": message, "elements": elements, "severity": severity}
+
+
+def find_structural_errors(data: dict) -> List[dict]:
+    """
+    Детерминированная проверка корректности процесса за O(V+E):
+    наличие начала и конца, висячие элементы, типы шлюзов, ссылки и дубли потоков,
+    достижимость от старта, пути к концу, тупики, парность параллельных шлюзов,
+    исключающие шлюзы без ветвления и циклы без выхода.
+    Содержимое развёрнутых подпроцессов проверяется так же, как отдельный процесс; ошибки
+    внутри подпроцесса содержат его ID в поле "parent".
+    """
+    errors = []
+    for parent, scope in scopes(data):
+        scope_errors = _scope_errors(ProcessGraph(scope))
+        if parent is not None:
+            name = scope.get("name") or parent
+            for err in scope_errors:
+                err["parent"] = parent
+                err["message"] = f"Подпроцесс '{name}': {err['message']}"
+        errors.extend(scope_errors)
+    return errors
+
+
+def _scope_errors(graph: ProcessGraph) -> List[dict]:
+    errors = []
+    starts = graph.ids_of_type("start")
+    ends = graph.ids_of_type("end")
+
+    # 1. Проверка стартового события
+    if not starts:
+        errors.append(_error("NO_START", "Отсутствует стартовое событие", []))
+
+    # 2. Проверка конечного события
+    if not ends:
+        errors.append(_error("NO_END", "Отсутствует конечное событие", []))
+
+    # 3. Поиск висячих элементов
+    orphans = set()
+    for node_id, node in graph.nodes.items():
+        if not graph.successors[node_id] and not graph.predecessors[node_id]:
+            orphans.add(node_id)
+            if node.get("type") not in ("start", "end"):
+                errors.append(_error("ORPHAN_ELEMENT", f"Несвязанный элемент: {node.get('name')}", [node_id]))
+
+    # 4. Проверка шлюзов
+    for node_id, node in graph.nodes.items():
+        if node.get("type") == "gateway" and "gateway_type" not in node:
+            errors.append(_error("GATEWAY_TYPE_MISSING", f"Шлюз {node.get('name')} не имеет типа", [node_id]))
+
+    # 5. Потоки: ссылки на несуществующие элементы и повторы
+    for flow in graph.dangling_flows:
+        errors.append(_error(
+            "UNKNOWN_FLOW_REFERENCE",
+            f"Поток {flow.get('source')} -> {flow.get('target')} ссылается на несуществующий элемент",
+            [ref for ref in (flow.get("source"), flow.get("target")) if ref in graph.nodes]
+        ))
+    for source, target in graph.duplicate_flows:
+        errors.append(_error(
+            "DUPLICATE_FLOW",
+            f"Повторяющийся поток '{graph.name(source)}' -> '{graph.name(target)}'",
+            [source, target]
+        ))
+
+    # 6. Начало и конец не должны иметь входящих / исходящих потоков
+    for node_id in starts:
+        if graph.predecessors[node_id]:
+            errors.append(_error("START_HAS_INCOMING",
+                                 f"В стартовое событие '{graph.name(node_id)}' входят потоки", [node_id]))
+    for node_id in ends:
+        if graph.successors[node_id]:
+            errors.append(_error("END_HAS_OUTGOING",
+                                 f"Из конечного события '{graph.name(node_id)}' выходят потоки", [node_id]))
+
+    # 7. Циклы без выхода: компонента сильной связности, из которой нет потоков наружу
+    trapped = set()
+    for component in graph.strongly_connected_components():
+        members = set(component)
+        looped = len(component) > 1 or component[0] in graph.successors[component[0]]
+        if not looped or any(successor not in members
+                             for node_id in component for successor in graph.successors[node_id]):
+            continue
+        trapped |= members
+        errors.append(_error(
+            "CYCLE_WITHOUT_EXIT",
+            "Цикл без выхода: " + ", ".join(f"'{graph.name(node_id)}'" for node_id in component),
+            component
+        ))
+
+    # 8. Достижимость от старта, тупики и пути к концу
+    if starts:
+        reachable = graph.reachable(starts)
+        for node_id in graph.nodes:
+            if node_id not in reachable and node_id not in orphans:
+                errors.append(_error("UNREACHABLE",
+                                     f"Элемент '{graph.name(node_id)}' недостижим от стартового события", [node_id]))
+    for node_id, node in graph.nodes.items():
+        if node.get("type") != "end" and not graph.successors[node_id] and node_id not in orphans:
+            errors.append(_error("DEAD_END", f"Тупик: из элемента '{graph.name(node_id)}' нет исходящих потоков",
+                                 [node_id]))
+    if ends:
+        leads_to_end = graph.reachable(ends, reverse=True)
+        for node_id in graph.nodes:
+            if node_id in leads_to_end or node_id in orphans or node_id in trapped or not graph.successors[node_id]:
+                continue
+            errors.append(_error("NO_PATH_TO_END",
+                                 f"От элемента '{graph.name(node_id)}' нет пути к конечному событию", [node_id]))
+
+    # 9. Исключающий шлюз, который ничего не разветвляет и не сливает
+    for node_id in graph.gateways("exclusive"):
+        if len(graph.successors[node_id]) == 1 and len(graph.predecessors[node_id]) <= 1:
+            errors.append(_error("EXCLUSIVE_SINGLE_OUTGOING",
+                                 f"Исключающий шлюз '{graph.name(node_id)}' имеет единственный исходящий поток",
+                                 [node_id]))
+
+    # 10. Парность параллельных шлюзов: ветви разветвления должны сходиться в параллельном слиянии,
+    # а слияние - получать ветви только от параллельного разветвления
+    errors.extend(_parallel_pairing_errors(graph))
+    return errors
+
+
+def _parallel_pairing_errors(graph: ProcessGraph) -> List[dict]:
+    errors = []
+    parallel = graph.gateways("parallel")
+    splits = [node_id for node_id in parallel if len(graph.successors[node_id]) > 1]
+    joins = [node_id for node_id in parallel if len(graph.predecessors[node_id]) > 1]
+
+    # Один обратный обход от всех слияний: откуда слияние вообще достижимо
+    reaches_join = graph.reachable(joins, reverse=True)
+    for node_id in splits:
+        branches = [successor for successor in graph.successors[node_id] if successor not in reaches_join]
+        if branches:
+            errors.append(_error(
+                "PARALLEL_SPLIT_UNMATCHED",
+                f"Ветви параллельного шлюза '{graph.name(node_id)}' не сходятся в параллельном слиянии: "
+                + ", ".join(f"'{graph.name(branch)}'" for branch in branches),
+                [node_id, *branches]
+            ))
+
+    # Один прямой обход от всех разветвлений: куда доходят параллельные ветви
+    after_split = graph.reachable(successor for node_id in splits for successor in graph.successors[node_id])
+    for node_id in joins:
+        foreign = [predecessor for predecessor in graph.predecessors[node_id]
+                   if predecessor not in after_split and predecessor not in splits]
+        if foreign:
+            errors.append(_error(
+                "PARALLEL_JOIN_UNMATCHED",
+                f"Параллельное слияние '{graph.name(node_id)}' получает ветви не из параллельного разветвления: "
+                + ", ".join(f"'{graph.name(branch)}'" for branch in foreign),
+                [node_id, *foreign]
+            ))
+    return errors
@@ -0,0 +1,125 @@
+# prompt_cache.py
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixCache:
+    """
+    KV-кэш неизменных префиксов промптов агентов.
+
+    Для каждого зарегистрированного префикса один раз вычисляется состояние контекста
+    llama.cpp (save_state) и, если задан cache_dir, сохраняется на диск, чтобы пережить
+    перезапуск. Перед генерацией prepare() загружает состояние с подходящим префиксом,
+    и llama.cpp вычисляет только переменную часть промпта.
+
+    Все методы, работающие с моделью, должны вызываться из потока-владельца модели
+    (рабочего потока InferenceScheduler).
+    """
+
+    def __init__(self, model: Any = None, cache_dir: Optional[str] = None):
+        self.model = model
+        self.cache_dir = cache_dir
+        self._prefixes: Dict[str, str] = {}
+        self._tokens: Dict[str, List[int]] = {}
+        self._states: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stats = {"reused": 0, "restored": 0, "missed": 0, "loaded_from_disk": 0, "computed": 0}
+
+    def register(self, name: str, prefix: str):
+        self._prefixes[name] = prefix
+
+    def warm_up(self):
+        """Готовит состояния всех префиксов: с диска, если возможно, иначе вычисляет заново"""
+        for name, prefix in self._prefixes.items():
+            if name in self._states:
+                continue
+            try:
+                self._tokens[name] = self.model.tokenize(prefix.encode("utf-8"), special=True)
+                state = self._load_from_disk(name)
+                if state is None:
+                    self.model.reset()
+                    self.model.eval(self._tokens[name])
+                    state = self.model.save_state()
+                    self._count("computed")
+                    self._save_to_disk(name, state)
+                else:
+                    self._count("loaded_from_disk")
+                self._states[name] = state
+                logger.info("KV-кэш префикса '%s' готов (%d токенов)", name, len(self._tokens[name]))
+            except Exception:
+                logger.exception("Не удалось подготовить KV-кэш префикса '%s'", name)
+
+    def prepare(self, prompt: str):
+        """Загружает в модель состояние для самого длинного подходящего префикса"""
+        name = self._match(prompt)
+        if name is None:
+            self._count("missed")
+            return
+        tokens = self._tokens[name]
+        n = len(tokens)
+        if self.model.n_tokens >= n and self.model.input_ids[:n].tolist() == tokens:
+            # Контекст уже начинается с этого префикса, llama.cpp переиспользует его сам
+            self._count("reused")
+            return
+        self.model.load_state(self._states[name])
+        self._count("restored")
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["prefixes"] = sorted(self._states)
+        return stats
+
+    def _match(self, prompt: str) -> Optional[str]:
+        best = None
+        for name, prefix in self._prefixes.items():
+            if name in self._states and prompt.startswith(prefix):
+                if best is None or len(prefix) > len(self._prefixes[best]):
+                    best = name
+        return best
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _state_path(self, name: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        # Ключ зависит от файла модели, размера контекста (реплики могут отличаться) и текста префикса:
+        # при их изменении кэш не подхватится
+        model_path = getattr(self.model, "model_path", "")
+        n_ctx = self.model.n_ctx() if callable(getattr(self.model, "n_ctx", None)) else ""
+        key = f"{model_path}\0{n_ctx}\0{self._prefixes[name]}"
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}_{digest}.state")
+
+    def _load_from_disk(self, name: str):
+        path = self._state_path(name)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            logger.warning("Повреждённый файл KV-кэша %s, пересчитываем", path)
+            return None
+
+    def _save_to_disk(self, name: str, state: Any):
+        path = self._state_path(name)
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Реплики модели готовят одни и те же префиксы одновременно - у каждой свой временный файл
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Не удалось сохранить KV-кэш в %s", path)
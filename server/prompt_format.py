@@ -0,0 +1,45 @@
+# prompt_format.py
+from typing import Iterable, List
+
+from process_graph import scopes
+
+# Компактное представление диаграмм и ошибок для промптов.
+# Вместо json.dumps(..., indent=2) (отступы, повтор ключей, кириллица в \uXXXX)
+# диаграмма передаётся построчно: элемент - "id | тип | имя", поток - "source -> target".
+# ID сохраняются без изменений, поэтому ответы модели ссылаются на те же элементы.
+# Содержимое развёрнутого подпроцесса - отдельные разделы "Подпроцесс <id>" после верхнего уровня.
+
+
+def encode_diagram(data: dict) -> str:
+    lines = []
+    for parent, scope in scopes(data):
+        section = "" if parent is None else f"Подпроцесс {parent}. "
+        lines.append(f"{section}Элементы (id | тип | имя):")
+        for node in scope.get("nodes", []):
+            node_type = node.get("type", "")
+            if node.get("gateway_type"):
+                node_type = f"{node_type}:{node['gateway_type']}"
+            lines.append(f"{node.get('id')} | {node_type} | {_one_line(node.get('name', ''))}")
+        lines.append(f"{section}Потоки (source -> target):")
+        for flow in scope.get("flows", []):
+            lines.append(f"{flow.get('source')} -> {flow.get('target')}")
+    return "\n".join(lines)
+
+
+def encode_errors(errors: Iterable[dict]) -> str:
+    """Строка на ошибку: "- [КОД] сообщение (элементы: a, b)"; служебные поля не передаются"""
+    lines = []
+    for err in errors:
+        line = f"- [{err.get('code')}] {err.get('message')}"
+        if err.get("elements"):
+            line += f" (элементы: {', '.join(map(str, err['elements']))})"
+        lines.append(line)
+    return "\n".join(lines) or "нет"
+
+
+def encode_issues(issues: List[str]) -> str:
+    return "\n".join(f"- {_one_line(issue)}" for issue in issues) or "нет"
+
+
+def _one_line(text: str) -> str:
+    return " ".join(str(text).split())
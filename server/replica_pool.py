@@ -0,0 +1,83 @@
+# replica_pool.py
+import itertools
+import queue
+import threading
+from typing import Any, List, Sequence, Tuple
+
+from inference_scheduler import (
+    PRIORITY_NORMAL, InferenceRequest, ModelNotReadyError, QueueFullError, current_request_options
+)
+
+# Показатели планировщиков, которые в сводке по пулу складываются
+_SUMMED = ("queue_depth", "max_queue_size", "submitted", "completed", "failed", "rejected", "cancelled",
+           "timed_out", "wait_seconds_total", "run_seconds_total", "prompt_tokens_total",
+           "completion_tokens_total", "generation_seconds_total")
+
+
+class ReplicaPool:
+    """
+    Диспетчер реплик модели: у каждой реплики свой Llama, свой KV-кэш префиксов и свой
+    InferenceScheduler (см. ModelReplica в model_runtime.py). Запрос уходит готовой реплике
+    с наименьшей загрузкой (очередь + идущая генерация); при равной загрузке - по кругу.
+    Если очередь выбранной реплики переполнена, пробуется следующая.
+
+    Интерфейс тот же, что у InferenceScheduler (llm_callable, submit, metrics), поэтому
+    агенты и сервер модели работают с пулом так же, как с одним планировщиком.
+    """
+
+    def __init__(self, replicas: Sequence[Any]):
+        self.replicas = list(replicas)
+        self._rotation = itertools.count()
+        # Выбор и постановка в очередь атомарны: одновременные запросы видят загрузку друг друга
+        self._lock = threading.Lock()
+
+    def submit(self, prompt: str, **kwargs) -> InferenceRequest:
+        return self._submit(prompt, kwargs)[1]
+
+    def __call__(self, prompt: str, stream: bool = False, **kwargs):
+        options = current_request_options()
+        tokens: queue.Queue = queue.Queue()
+        replica, request = self._submit(prompt, dict(
+            kwargs,
+            priority=options.get("priority", PRIORITY_NORMAL),
+            timeout=options.get("timeout"),
+            cancel_event=options.get("cancel_event"),
+            on_token=tokens.put if stream else None,
+        ))
+        if stream:
+            return replica.scheduler.stream(request, tokens)
+        return replica.scheduler.wait(request)
+
+    def _submit(self, prompt: str, kwargs: dict) -> Tuple[Any, InferenceRequest]:
+        with self._lock:
+            for replica in self._candidates():
+                try:
+                    return replica, replica.scheduler.submit(prompt, **kwargs)
+                except (QueueFullError, ModelNotReadyError):
+                    continue
+        raise QueueFullError("Очереди генерации всех реплик переполнены, повторите запрос позже")
+
+    def _candidates(self) -> List[Any]:
+        available = [replica for replica in self.replicas if replica.available]
+        if not available:
+            raise ModelNotReadyError("Модель ещё загружается, повторите запрос позже")
+        start = next(self._rotation) % len(available)
+        # sorted устойчива: среди одинаково загруженных реплик первой идёт очередная по кругу
+        return sorted(available[start:] + available[:start], key=lambda replica: replica.scheduler.load())
+
+    def metrics(self) -> dict:
+        """Сводка по всем репликам и показатели каждой в "replicas" """
+        replicas = [{"name": replica.name, "cpus": replica.cpus, "state": replica.loader.status()["state"],
+                     **replica.scheduler.metrics()} for replica in self.replicas]
+        total = {key: sum(item[key] for item in replicas) for key in _SUMMED}
+        finished = total["completed"] + total["failed"] + total["cancelled"] + total["timed_out"]
+        return {
+            **total,
+            "busy": sum(1 for item in replicas if item["busy"]),
+            "worker_alive": any(item["worker_alive"] for item in replicas),
+            "avg_wait_seconds": total["wait_seconds_total"] / finished if finished else 0.0,
+            "avg_run_seconds": total["run_seconds_total"] / total["completed"] if total["completed"] else 0.0,
+            "avg_tokens_per_second": (total["completion_tokens_total"] / total["generation_seconds_total"]
+                                      if total["generation_seconds_total"] else 0.0),
+            "replicas": replicas,
+        }
@@ -0,0 +1,119 @@
+# response_cache.py
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в записях) чистить устаревшие строки на диске
+DISK_PURGE_EVERY = 256
+
+
+def normalize_text(text: str) -> str:
+    """
+    Описания, отличающиеся только пробелами и переносами строк, дают один ключ.
+    Регистр сохраняется: модель видит текст как есть, и ответ на него может отличаться
+    """
+    return " ".join(text.split())
+
+
+def make_cache_key(agent: str, payload: Any, prompt_version: str, sampling: dict, model_file: str) -> str:
+    if isinstance(payload, str):
+        payload = normalize_text(payload)
+    raw = json.dumps(
+        {"agent": agent, "input": payload, "prompt_version": prompt_version,
+         "sampling": sampling, "model": model_file},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Кэш ответов агентов с адресацией по содержимому запроса.
+    В памяти - LRU с ограничением по числу записей и TTL; при заданном db_path
+    дополнительно хранится в SQLite и переживает перезапуск сервера.
+    Значения хранятся в виде JSON, поэтому каждый get() возвращает независимую копию.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400.0, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return True, json.loads(value)
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM response_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self._remember(key, row[1], row[0])
+                    self._stats["disk_hits"] += 1
+                    return True, json.loads(row[0])
+
+            self._stats["misses"] += 1
+            return False, None
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, now, serialized)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO response_cache (key, value, created_at) VALUES (?, ?, ?)",
+                        (key, serialized, now)
+                    )
+                    self._writes += 1
+                    if self._writes % DISK_PURGE_EVERY == 0:
+                        self._db.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl,))
+                    self._db.commit()
+                except sqlite3.Error:
+                    logger.exception("Не удалось записать ответ в дисковый кэш")
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        stats["max_entries"] = self.max_entries
+        stats["disk_enabled"] = self._db is not None
+        return stats
+
+    def _remember(self, key: str, created_at: float, serialized: str):
+        self._memory[key] = (created_at, serialized)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,170 @@
+# response_schemas.py
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Схемы ответов агентов. По ним строится грамматика llama.cpp, поэтому модель
+# физически не может выдать невалидный JSON и останавливается, как только объект закрыт.
+EVENT_CHAIN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "type": {"type": "string", "enum": ["start", "end", "task", "gateway", "intermediate"]},
+                    "gateway_type": {"type": "string", "enum": ["exclusive", "parallel"]},
+                },
+                "required": ["id", "name", "type"],
+                "additionalProperties": False,
+            },
+        },
+        "flows": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "source": {"type": "string"},
+                    "target": {"type": "string"},
+                },
+                "required": ["source", "target"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["nodes", "flows"],
+    "additionalProperties": False,
+}
+
+# Исправленная цепочка (critic_fixes): элементы верхнего уровня могут быть подпроцессами
+# со своими nodes/flows - как у иерархических и импортированных диаграмм. Вложенность одна:
+# глубже исправление идёт операциями правки (см. CriticAgent.fix_mode_for)
+HIERARCHICAL_CHAIN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "type": {"type": "string",
+                             "enum": ["start", "end", "task", "gateway", "intermediate", "subprocess"]},
+                    "gateway_type": {"type": "string", "enum": ["exclusive", "parallel"]},
+                    "nodes": EVENT_CHAIN_SCHEMA["properties"]["nodes"],
+                    "flows": EVENT_CHAIN_SCHEMA["properties"]["flows"],
+                },
+                "required": ["id", "name", "type"],
+                "additionalProperties": False,
+            },
+        },
+        "flows": EVENT_CHAIN_SCHEMA["properties"]["flows"],
+    },
+    "required": ["nodes", "flows"],
+    "additionalProperties": False,
+}
+HIERARCHICAL_CHAIN_MAX_DEPTH = 1
+
+# План процесса верхнего уровня: этапы - подпроцессы с описанием, детали строятся отдельно
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "type": {"type": "string", "enum": ["start", "end", "subprocess", "gateway", "intermediate"]},
+                    "gateway_type": {"type": "string", "enum": ["exclusive", "parallel"]},
+                    "description": {"type": "string"},
+                },
+                "required": ["id", "name", "type"],
+                "additionalProperties": False,
+            },
+        },
+        "flows": EVENT_CHAIN_SCHEMA["properties"]["flows"],
+    },
+    "required": ["nodes", "flows"],
+    "additionalProperties": False,
+}
+
+CRITIQUE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "assessment": {"type": "string"},
+        "recommendations": {"type": "array", "items": {"type": "string"}, "minItems": 1, "maxItems": 4},
+        "critical_issues": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["assessment", "recommendations", "critical_issues"],
+    "additionalProperties": False,
+}
+
+PATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "operations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "op": {"type": "string", "enum": ["add_node", "remove_node", "rename_node",
+                                                      "add_flow", "remove_flow", "set_gateway_type"]},
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "type": {"type": "string",
+                             "enum": ["start", "end", "task", "gateway", "intermediate", "subprocess"]},
+                    "gateway_type": {"type": "string", "enum": ["exclusive", "parallel"]},
+                    "source": {"type": "string"},
+                    "target": {"type": "string"},
+                    "parent": {"type": "string"},
+                },
+                "required": ["op"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["operations"],
+    "additionalProperties": False,
+}
+
+SCHEMAS = {
+    "event_chain": EVENT_CHAIN_SCHEMA,
+    "hierarchical_chain": HIERARCHICAL_CHAIN_SCHEMA,
+    "outline": OUTLINE_SCHEMA,
+    "critique": CRITIQUE_SCHEMA,
+    "patch": PATCH_SCHEMA,
+}
+
+
+# Скомпилированные грамматики по имени схемы; неудачи не запоминаются
+_grammars: Dict[str, Any] = {}
+_grammars_lock = threading.Lock()
+
+
+def build_grammar(name: str) -> Optional[Any]:
+    """
+    Компилирует грамматику llama.cpp для схемы по её имени (один раз на процесс).
+    Возвращает None, если грамматику построить нельзя - тогда генерация идёт без ограничений,
+    а следующий вызов попробует снова.
+    """
+    with _grammars_lock:
+        if name in _grammars:
+            return _grammars[name]
+        try:
+            from llama_cpp import LlamaGrammar
+            grammar = LlamaGrammar.from_json_schema(json.dumps(SCHEMAS[name]), verbose=False)
+        except Exception:
+            logger.exception("Не удалось построить грамматику для схемы '%s'", name)
+            return None
+        if grammar is not None:
+            _grammars[name] = grammar
+        return grammar
@@ -0,0 +1,87 @@
+# single_flight.py
+import copy
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple, Type
+
+from inference_scheduler import (
+    WAIT_POLL_INTERVAL, DeadlineExceededError, RequestCancelledError, current_request_options
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    Схлопывание одинаковых одновременных вызовов: первый вызов с данным ключом
+    выполняет функцию, остальные ждут и получают копию его результата (или его исключение).
+
+    Если ведущий вызов завершился исключением из retry_on (например, его клиент отключился
+    и генерация была отменена), ожидающие не наследуют ошибку, а повторяют попытку сами.
+    Ожидающий соблюдает собственные отмену и таймаут из request_options(): ведущий
+    вызов при этом продолжается для остальных.
+    """
+
+    def __init__(self, retry_on: Tuple[Type[BaseException], ...] = ()):
+        self.retry_on = retry_on
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "retried": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self._stats["leaders"] += 1
+                else:
+                    self._stats["coalesced"] += 1
+
+            if leader:
+                try:
+                    call.result = fn()
+                    return call.result
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+
+            self._wait(call)
+            if call.error is None:
+                return copy.deepcopy(call.result)
+            if isinstance(call.error, self.retry_on):
+                with self._lock:
+                    self._stats["retried"] += 1
+                continue
+            raise call.error
+
+    @staticmethod
+    def _wait(call: _Call):
+        options = current_request_options()
+        cancel_event = options.get("cancel_event")
+        timeout = options.get("timeout")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not call.done.wait(WAIT_POLL_INTERVAL):
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelledError("Запрос отменён клиентом")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceededError("Истекло время ожидания генерации")
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
@@ -0,0 +1,43 @@
+# test_auto_repair.py
+from auto_repair import repair
+from process_graph import find_structural_errors
+
+
+def test_dead_end_inside_subprocess_is_led_to_its_end():
+    data = {
+        "nodes": [
+            {"id": "s", "name": "Начало", "type": "start"},
+            {"id": "p1", "name": "Оформление", "type": "subprocess",
+             "nodes": [
+                 {"id": "p1_s", "name": "Начало этапа", "type": "start"},
+                 {"id": "p1_t", "name": "Заполнить заявку", "type": "task"},
+                 {"id": "p1_e", "name": "Конец этапа", "type": "end"},
+             ],
+             "flows": [{"source": "p1_s", "target": "p1_t"}]},
+            {"id": "e", "name": "Конец", "type": "end"},
+        ],
+        "flows": [{"source": "s", "target": "p1"}, {"source": "p1", "target": "e"}],
+    }
+    repaired, applied, errors = repair(data)
+    assert errors == []
+    assert applied == [{"op": "add_flow", "source": "p1_t", "target": "p1_e", "parent": "p1"}]
+    assert repaired["flows"] == data["flows"]
+    assert {"source": "p1_t", "target": "p1_e"} in repaired["nodes"][1]["flows"]
+
+
+def test_missing_events_are_added_inside_subprocess_with_unique_ids():
+    data = {
+        "nodes": [
+            {"id": "auto_start", "name": "Начало", "type": "start"},
+            {"id": "p1", "name": "Оформление", "type": "subprocess",
+             "nodes": [{"id": "p1_a", "name": "A", "type": "task"}, {"id": "p1_b", "name": "B", "type": "task"}],
+             "flows": [{"source": "p1_a", "target": "p1_b"}]},
+            {"id": "e", "name": "Конец", "type": "end"},
+        ],
+        "flows": [{"source": "auto_start", "target": "p1"}, {"source": "p1", "target": "e"}],
+    }
+    repaired, applied, errors = repair(data)
+    assert find_structural_errors(repaired) == errors == []
+    added = [op for op in applied if op["op"] == "add_node"]
+    assert {op["id"] for op in added} == {"auto_start_2", "auto_end"}
+    assert all(op["parent"] == "p1" for op in applied)
@@ -0,0 +1,30 @@
+# test_bpmn_agent.py
+import re
+
+from bpmn_agent import BPMNAgent
+
+CHAIN = {
+    "nodes": [
+        {"id": "s", "name": "Начало", "type": "start"},
+        {"id": "t", "name": "Заполнить заявку", "type": "task"},
+        {"id": "e", "name": "Конец", "type": "end"},
+    ],
+    "flows": [{"source": "s", "target": "t"}, {"source": "t", "target": "e"}],
+}
+
+
+def test_legacy_file_is_laid_out_on_read(tmp_path):
+    bpmn_xml, _ = BPMNAgent(persist=False).generate_raw_bpmn(CHAIN)
+    # Старые файлы сохранялись без раскладки: все узлы в одной точке
+    legacy = re.sub(r'\b([xy])="[0-9.]+"', r'\1="0"', bpmn_xml)
+    (tmp_path / "old.bpmn").write_text(legacy, encoding="utf-8")
+
+    loaded = BPMNAgent(output_dir=str(tmp_path)).load_diagram("old.bpmn")
+
+    assert len(set(re.findall(r'Bounds[^>]*\bx="([0-9.]+)"', loaded))) == len(CHAIN["nodes"])
+
+
+def test_unparsable_legacy_file_is_returned_as_is(tmp_path):
+    (tmp_path / "broken.bpmn").write_text("not a diagram", encoding="utf-8")
+
+    assert BPMNAgent(output_dir=str(tmp_path)).load_diagram("broken.bpmn") == "not a diagram"
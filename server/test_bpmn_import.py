@@ -0,0 +1,32 @@
+# test_bpmn_import.py
+from bpmn_agent import BPMNAgent
+from bpmn_import import parse_bpmn
+from critic_agent import VERDICT_BROKEN, CriticAgent
+
+
+def test_imported_subprocess_content_is_analyzed():
+    chain = {
+        "nodes": [
+            {"id": "s", "name": "Начало", "type": "start"},
+            {"id": "p1", "name": "Оформление", "type": "subprocess",
+             "nodes": [
+                 {"id": "p1_s", "name": "Начало этапа", "type": "start"},
+                 {"id": "p1_t", "name": "Заполнить заявку", "type": "task"},
+                 {"id": "p1_e", "name": "Конец этапа", "type": "end"},
+             ],
+             "flows": [{"source": "p1_s", "target": "p1_t"}]},
+            {"id": "e", "name": "Конец", "type": "end"},
+        ],
+        "flows": [{"source": "s", "target": "p1"}, {"source": "p1", "target": "e"}],
+    }
+    bpmn_xml, _ = BPMNAgent(persist=False).generate_raw_bpmn(chain)
+    imported = parse_bpmn(bpmn_xml.encode("utf-8"))
+
+    subprocess = next(node for node in imported["nodes"] if node["type"] == "subprocess")
+    assert len(subprocess["nodes"]) == 3
+
+    analysis = CriticAgent(None).fast_analysis(imported)
+    assert analysis["verdict"] == VERDICT_BROKEN
+    errors = analysis["algorithm_errors"]
+    assert "DEAD_END" in {err["code"] for err in errors}
+    assert all(err["parent"] == subprocess["id"] for err in errors)
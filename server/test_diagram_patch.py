@@ -0,0 +1,94 @@
+# test_diagram_patch.py
+from diagram_patch import apply_operations
+
+
+def chain():
+    return {
+        "nodes": [
+            {"id": "s", "name": "Старт", "type": "start"},
+            {"id": "t", "name": "Задача", "type": "task"},
+            {"id": "e", "name": "Конец", "type": "end"},
+        ],
+        "flows": [{"source": "s", "target": "t"}, {"source": "t", "target": "e"}],
+    }
+
+
+def test_rename_after_colliding_add_targets_new_node():
+    patched, applied, rejected = apply_operations(chain(), [
+        {"op": "add_node", "id": "t", "name": "Новая", "type": "task"},
+        {"op": "rename_node", "id": "t", "name": "Z"},
+    ])
+    assert not rejected
+    new_id = applied[0]["id"]
+    assert new_id != "t"
+    names = {node["id"]: node["name"] for node in patched["nodes"]}
+    assert names == {"s": "Старт", "t": "Задача", "e": "Конец", new_id: "Z"}
+    assert applied[1]["id"] == new_id
+
+
+def test_remove_and_gateway_type_after_colliding_add_target_new_node():
+    patched, applied, rejected = apply_operations(chain(), [
+        {"op": "add_node", "id": "t", "name": "Шлюз", "type": "gateway", "gateway_type": "exclusive"},
+        {"op": "set_gateway_type", "id": "t", "gateway_type": "parallel"},
+        {"op": "add_flow", "source": "s", "target": "t"},
+        {"op": "remove_node", "id": "t"},
+    ])
+    assert not rejected
+    assert [node["id"] for node in patched["nodes"]] == ["s", "t", "e"]
+    assert applied[1]["gateway_type"] == "parallel"
+    assert patched["flows"] == chain()["flows"]
+
+
+def test_original_data_is_not_modified():
+    data = chain()
+    apply_operations(data, [{"op": "remove_node", "id": "t"}])
+    assert data == chain()
+
+
+def test_invalid_operation_is_rejected_without_stopping_others():
+    patched, applied, rejected = apply_operations(chain(), [
+        {"op": "rename_node", "id": "missing", "name": "X"},
+        {"op": "rename_node", "id": "t", "name": "X"},
+    ])
+    assert [item["id"] for item in rejected] == ["missing"]
+    assert patched["nodes"][1]["name"] == "X"
+
+
+def hierarchical():
+    data = chain()
+    data["nodes"].insert(2, {"id": "p", "name": "Этап", "type": "subprocess",
+                             "nodes": [{"id": "p_s", "name": "Начало этапа", "type": "start"}], "flows": []})
+    return data
+
+
+def test_parent_adds_node_and_flow_inside_subprocess():
+    patched, applied, rejected = apply_operations(hierarchical(), [
+        {"op": "add_node", "id": "p_e", "name": "Конец этапа", "type": "end", "parent": "p"},
+        {"op": "add_flow", "source": "p_s", "target": "p_e"},
+        {"op": "rename_node", "id": "p_s", "name": "Старт"},
+    ])
+    assert not rejected
+    subprocess = patched["nodes"][2]
+    assert [node["id"] for node in subprocess["nodes"]] == ["p_s", "p_e"]
+    assert subprocess["nodes"][0]["name"] == "Старт"
+    assert subprocess["flows"] == [{"source": "p_s", "target": "p_e"}]
+    assert [node["id"] for node in patched["nodes"]] == ["s", "t", "p", "e"]
+
+
+def test_flow_across_subprocess_boundary_is_rejected():
+    patched, applied, rejected = apply_operations(hierarchical(), [
+        {"op": "add_flow", "source": "t", "target": "p_s"},
+        {"op": "add_node", "id": "x", "name": "X", "type": "task", "parent": "t"},
+    ])
+    assert len(rejected) == 2
+    assert patched == hierarchical()
+
+
+def test_remove_node_inside_subprocess():
+    data = hierarchical()
+    data["nodes"][2]["nodes"].append({"id": "p_t", "name": "Задача этапа", "type": "task"})
+    data["nodes"][2]["flows"].append({"source": "p_s", "target": "p_t"})
+    patched, _, rejected = apply_operations(data, [{"op": "remove_node", "id": "p_t"}])
+    assert not rejected
+    assert patched["nodes"][2]["nodes"] == [{"id": "p_s", "name": "Начало этапа", "type": "start"}]
+    assert patched["nodes"][2]["flows"] == []
@@ -0,0 +1,143 @@
+# test_diagram_store.py
+import sqlite3
+import threading
+
+import pytest
+
+import diagram_store
+from diagram_store import DiagramStore, content_hash
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(diagram_store, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "diagrams.sqlite3")
+
+
+def xml(label: str) -> str:
+    return f'<definitions><process id="{label}"/></definitions>'
+
+
+def test_save_under_same_name_adds_versions(db_path, clock):
+    store = DiagramStore(db_path)
+    chain = {"nodes": [{"id": "s", "name": "Начало", "type": "start"}], "flows": []}
+    assert store.save("d.bpmn", xml("v1"), chain, "Продажа товаров")["version"] == 1
+    clock.now += 1
+    saved = store.save("d.bpmn", xml("v2"))
+
+    assert saved == {"name": "d.bpmn", "version": 2, "content_hash": content_hash(xml("v2"))}
+    latest = store.get("d.bpmn")
+    assert (latest["version"], latest["bpmn_xml"], latest["event_chain"]) == (2, xml("v2"), None)
+    # Сохранение без описания не стирает прежнее
+    assert latest["description"] == "Продажа товаров"
+    first = store.get("d.bpmn", version=1)
+    assert (first["bpmn_xml"], first["event_chain"]) == (xml("v1"), chain)
+    assert [item["version"] for item in store.versions("d.bpmn")] == [2, 1]
+    assert store.get("missing.bpmn") is None and store.versions("missing.bpmn") is None
+
+
+def test_old_versions_beyond_limit_are_dropped(db_path, clock):
+    store = DiagramStore(db_path, max_versions=2)
+    for label in ("v1", "v2", "v3"):
+        store.save("d.bpmn", xml(label))
+
+    assert [item["version"] for item in store.versions("d.bpmn")] == [3, 2]
+    assert store.get("d.bpmn", version=1) is None
+    assert store.get("d.bpmn")["bpmn_xml"] == xml("v3")
+
+
+def test_gc_removes_expired_and_excess_diagrams(db_path, clock):
+    store = DiagramStore(db_path, max_age=250, max_diagrams=2)
+    for name in ("old.bpmn", "a.bpmn", "b.bpmn", "c.bpmn", "d.bpmn"):
+        store.save(name, xml(name))
+        clock.now += 60
+
+    # old.bpmn старше max_age, из оставшихся max_diagrams=2 сохраняются самые свежие
+    assert store.gc() == {"versions": 0, "diagrams": 3}
+    assert [item["name"] for item in store.list()[0]] == ["d.bpmn", "c.bpmn"]
+    assert store.metrics()["versions"] == 2
+
+
+def test_list_pages_by_cursor_without_gaps(db_path, clock):
+    store = DiagramStore(db_path)
+    names = [f"d{i}.bpmn" for i in range(7)]
+    for name in names:
+        store.save(name, xml(name))
+    # Одинаковое время изменения: порядок задаёт ID, страницы всё равно не пересекаются
+    store.save("d7.bpmn", xml("d7"))
+    names.append("d7.bpmn")
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.list(limit=3, cursor=cursor)
+        assert len(page) <= 3
+        seen += [item["name"] for item in page]
+        if cursor is None:
+            break
+    assert seen == names[::-1]
+    with pytest.raises(ValueError):
+        store.list(cursor="not-a-cursor")
+
+
+def test_list_filters(db_path, clock):
+    store = DiagramStore(db_path)
+    store.save("sales_1.bpmn", xml("s1"), description="Продажа  товаров\n со склада")
+    store.save("sales_2.bpmn", xml("s2"), description="Закупка")
+    store.save("hr_1.bpmn", xml("h1"))
+
+    def names(**filters):
+        return sorted(item["name"] for item in store.list(**filters)[0])
+
+    assert names(name_prefix="sales_") == ["sales_1.bpmn", "sales_2.bpmn"]
+    assert names(description="Продажа товаров со склада") == ["sales_1.bpmn"]
+    assert names(description="продажа товаров со склада") == []
+    assert names(content=content_hash(xml("h1"))) == ["hr_1.bpmn"]
+
+
+def test_concurrent_saves_from_separate_connections_get_distinct_versions(db_path):
+    # Отдельные соединения ведут себя как разные веб-процессы: общая только блокировка SQLite
+    stores = [DiagramStore(db_path) for _ in range(4)]
+    errors = []
+
+    def save_many(store):
+        try:
+            for i in range(10):
+                store.save("shared.bpmn", xml(str(i)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save_many, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [item["version"] for item in stores[0].versions("shared.bpmn")] == list(range(40, 20, -1))
+    for store in stores:
+        store.close()
+
+
+def test_failed_save_is_rolled_back(db_path, clock):
+    store = DiagramStore(db_path)
+    store.save("d.bpmn", xml("v1"))
+    # Ошибка внутри транзакции: без отката следующий BEGIN IMMEDIATE бы не прошёл
+    with pytest.raises(sqlite3.IntegrityError):
+        store.save(None, xml("v2"))
+
+    assert store.save("d.bpmn", xml("v2"))["version"] == 2
+    assert store.metrics()["diagrams"] == 1
@@ -0,0 +1,249 @@
+# test_process_graph.py
+from critic_agent import VERDICT_BROKEN, VERDICT_SOUND, CriticAgent
+from process_graph import SEVERITY_WARNING, find_structural_errors, nesting_depth
+
+
+def hierarchical(phase_nodes, phase_flows):
+    return {
+        "nodes": [
+            {"id": "s", "name": "Начало", "type": "start"},
+            {"id": "p1", "name": "Оформление", "type": "subprocess", "nodes": phase_nodes, "flows": phase_flows},
+            {"id": "e", "name": "Конец", "type": "end"},
+        ],
+        "flows": [{"source": "s", "target": "p1"}, {"source": "p1", "target": "e"}],
+    }
+
+
+def sound_phase():
+    return hierarchical(
+        [
+            {"id": "p1_s", "name": "Начало этапа", "type": "start"},
+            {"id": "p1_t", "name": "Заполнить заявку", "type": "task"},
+            {"id": "p1_e", "name": "Конец этапа", "type": "end"},
+        ],
+        [{"source": "p1_s", "target": "p1_t"}, {"source": "p1_t", "target": "p1_e"}],
+    )
+
+
+def test_sound_hierarchical_chain_has_no_errors():
+    data = sound_phase()
+    assert find_structural_errors(data) == []
+    assert CriticAgent(None).fast_analysis(data)["verdict"] == VERDICT_SOUND
+    assert nesting_depth(data) == 1
+
+
+def test_orphan_inside_subprocess_is_reported():
+    data = hierarchical(
+        [
+            {"id": "p1_s", "name": "Начало этапа", "type": "start"},
+            {"id": "p1_t", "name": "Заполнить заявку", "type": "task"},
+            {"id": "p1_e", "name": "Конец этапа", "type": "end"},
+        ],
+        [],
+    )
+    errors = find_structural_errors(data)
+    assert [(err["code"], err["elements"], err["parent"]) for err in errors] == [
+        ("ORPHAN_ELEMENT", ["p1_t"], "p1")
+    ]
+    assert errors[0]["message"].startswith("Подпроцесс 'Оформление': ")
+    assert CriticAgent(None).fast_analysis(data)["verdict"] == VERDICT_BROKEN
+
+
+def test_dead_end_inside_subprocess_is_reported():
+    data = hierarchical(
+        [
+            {"id": "p1_s", "name": "Начало этапа", "type": "start"},
+            {"id": "p1_t1", "name": "Заполнить заявку", "type": "task"},
+            {"id": "p1_t2", "name": "Проверить заявку", "type": "task"},
+            {"id": "p1_e", "name": "Конец этапа", "type": "end"},
+        ],
+        [{"source": "p1_s", "target": "p1_t1"}],
+    )
+    codes = {(err["code"], tuple(err["elements"])) for err in find_structural_errors(data)}
+    assert ("DEAD_END", ("p1_t1",)) in codes
+    assert ("ORPHAN_ELEMENT", ("p1_t2",)) in codes
+    assert all(err.get("parent") == "p1" for err in find_structural_errors(data))
+
+
+def test_nested_subprocesses_are_checked_at_every_depth():
+    inner = {"id": "p1_sub", "name": "Согласование", "type": "subprocess",
+             "nodes": [{"id": "p1_sub_t", "name": "Согласовать", "type": "task"}], "flows": []}
+    data = hierarchical(
+        [{"id": "p1_s", "name": "Начало этапа", "type": "start"}, inner,
+         {"id": "p1_e", "name": "Конец этапа", "type": "end"}],
+        [{"source": "p1_s", "target": "p1_sub"}, {"source": "p1_sub", "target": "p1_e"}],
+    )
+    assert nesting_depth(data) == 2
+    assert {err["code"] for err in find_structural_errors(data) if err.get("parent") == "p1_sub"} == {
+        "NO_START", "NO_END", "ORPHAN_ELEMENT"
+    }
+
+
+def test_collapsed_subprocess_is_a_plain_node():
+    data = hierarchical([], [])
+    assert find_structural_errors(data) == []
+
+
+def chain(nodes, flows):
+    """nodes - (id, type[, gateway_type]), flows - (source, target); имена совпадают с ID"""
+    built = []
+    for node_id, node_type, *gateway_type in nodes:
+        node = {"id": node_id, "name": node_id, "type": node_type}
+        if gateway_type:
+            node["gateway_type"] = gateway_type[0]
+        built.append(node)
+    return {"nodes": built, "flows": [{"source": source, "target": target} for source, target in flows]}
+
+
+def reported(data, code):
+    return [err["elements"] for err in find_structural_errors(data) if err["code"] == code]
+
+
+def test_parallel_branches_joined_in_parallel_gateway_are_paired():
+    data = chain(
+        [("s", "start"), ("split", "gateway", "parallel"), ("a", "task"), ("b", "task"),
+         ("join", "gateway", "parallel"), ("e", "end")],
+        [("s", "split"), ("split", "a"), ("split", "b"), ("a", "join"), ("b", "join"), ("join", "e")],
+    )
+    assert find_structural_errors(data) == []
+
+
+def test_parallel_split_without_join_is_reported():
+    data = chain(
+        [("s", "start"), ("split", "gateway", "parallel"), ("a", "task"), ("b", "task"), ("e", "end")],
+        [("s", "split"), ("split", "a"), ("split", "b"), ("a", "e"), ("b", "e")],
+    )
+    assert reported(data, "PARALLEL_SPLIT_UNMATCHED") == [["split", "a", "b"]]
+    assert reported(data, "PARALLEL_JOIN_UNMATCHED") == []
+
+
+def test_parallel_join_after_exclusive_split_is_reported():
+    data = chain(
+        [("s", "start"), ("choice", "gateway", "exclusive"), ("a", "task"), ("b", "task"),
+         ("join", "gateway", "parallel"), ("e", "end")],
+        [("s", "choice"), ("choice", "a"), ("choice", "b"), ("a", "join"), ("b", "join"), ("join", "e")],
+    )
+    assert reported(data, "PARALLEL_JOIN_UNMATCHED") == [["join", "a", "b"]]
+    assert reported(data, "PARALLEL_SPLIT_UNMATCHED") == []
+
+
+def test_exclusive_gateway_with_single_outgoing_is_reported():
+    data = chain(
+        [("s", "start"), ("choice", "gateway", "exclusive"), ("t", "task"), ("e", "end")],
+        [("s", "choice"), ("choice", "t"), ("t", "e")],
+    )
+    assert reported(data, "EXCLUSIVE_SINGLE_OUTGOING") == [["choice"]]
+    assert {err["severity"] for err in find_structural_errors(data)} == {SEVERITY_WARNING}
+
+
+def test_exclusive_merge_with_single_outgoing_is_not_reported():
+    data = chain(
+        [("s", "start"), ("choice", "gateway", "exclusive"), ("a", "task"), ("b", "task"),
+         ("merge", "gateway", "exclusive"), ("e", "end")],
+        [("s", "choice"), ("choice", "a"), ("choice", "b"), ("a", "merge"), ("b", "merge"), ("merge", "e")],
+    )
+    assert find_structural_errors(data) == []
+
+
+def test_cycle_without_exit_is_reported():
+    data = chain(
+        [("s", "start"), ("a", "task"), ("b", "task"), ("e", "end")],
+        [("s", "a"), ("a", "b"), ("b", "a")],
+    )
+    assert [sorted(elements) for elements in reported(data, "CYCLE_WITHOUT_EXIT")] == [["a", "b"]]
+    # Узлы цикла уже названы в этой ошибке; "нет пути к концу" - только у входа в цикл
+    assert reported(data, "NO_PATH_TO_END") == [["s"]]
+
+
+def test_cycle_with_exit_is_not_reported():
+    data = chain(
+        [("s", "start"), ("a", "task"), ("b", "task"), ("e", "end")],
+        [("s", "a"), ("a", "b"), ("b", "a"), ("b", "e")],
+    )
+    assert find_structural_errors(data) == []
+
+
+def test_duplicate_flow_is_reported():
+    data = chain(
+        [("s", "start"), ("t", "task"), ("e", "end")],
+        [("s", "t"), ("s", "t"), ("t", "e")],
+    )
+    assert reported(data, "DUPLICATE_FLOW") == [["s", "t"]]
+    assert {err["severity"] for err in find_structural_errors(data)} == {SEVERITY_WARNING}
+
+
+def test_flows_sharing_a_source_are_not_duplicates():
+    data = chain(
+        [("s", "start"), ("t", "task"), ("e", "end")],
+        [("s", "t"), ("s", "e"), ("t", "e")],
+    )
+    assert find_structural_errors(data) == []
+
+
+def test_unreachable_element_is_reported():
+    data = chain(
+        [("s", "start"), ("t", "task"), ("e", "end")],
+        [("s", "e"), ("t", "e")],
+    )
+    assert reported(data, "UNREACHABLE") == [["t"]]
+
+
+def test_orphan_element_is_not_reported_as_unreachable():
+    data = chain(
+        [("s", "start"), ("t", "task"), ("e", "end")],
+        [("s", "e")],
+    )
+    assert reported(data, "UNREACHABLE") == []
+    assert reported(data, "ORPHAN_ELEMENT") == [["t"]]
+
+
+def test_dead_end_is_reported():
+    data = chain(
+        [("s", "start"), ("t", "task"), ("e", "end")],
+        [("s", "t"), ("s", "e")],
+    )
+    assert reported(data, "DEAD_END") == [["t"]]
+
+
+def test_end_event_and_orphan_are_not_dead_ends():
+    data = chain(
+        [("s", "start"), ("t", "task"), ("lost", "task"), ("e", "end")],
+        [("s", "t"), ("t", "e")],
+    )
+    assert reported(data, "DEAD_END") == []
+
+
+def test_element_without_path_to_end_is_reported():
+    data = chain(
+        [("s", "start"), ("a", "task"), ("t", "task"), ("e", "end")],
+        [("s", "a"), ("a", "t"), ("s", "e")],
+    )
+    assert reported(data, "NO_PATH_TO_END") == [["a"]]
+    # Сам тупик - отдельная ошибка
+    assert reported(data, "DEAD_END") == [["t"]]
+
+
+def test_branch_rejoining_main_path_has_path_to_end():
+    data = chain(
+        [("s", "start"), ("choice", "gateway", "exclusive"), ("a", "task"), ("b", "task"), ("e", "end")],
+        [("s", "choice"), ("choice", "a"), ("choice", "b"), ("a", "b"), ("b", "e")],
+    )
+    assert reported(data, "NO_PATH_TO_END") == []
+
+
+def test_start_with_incoming_and_end_with_outgoing_are_reported():
+    data = chain(
+        [("s", "start"), ("t", "task"), ("e1", "end"), ("e2", "end")],
+        [("s", "t"), ("t", "s"), ("t", "e1"), ("e1", "e2")],
+    )
+    assert reported(data, "START_HAS_INCOMING") == [["s"]]
+    assert reported(data, "END_HAS_OUTGOING") == [["e1"]]
+
+
+def test_events_with_flows_on_the_right_side_are_not_reported():
+    data = chain(
+        [("s", "start"), ("t", "task"), ("e1", "end"), ("e2", "end")],
+        [("s", "t"), ("t", "e1"), ("t", "e2")],
+    )
+    assert reported(data, "START_HAS_INCOMING") == []
+    assert reported(data, "END_HAS_OUTGOING") == []
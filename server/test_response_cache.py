@@ -0,0 +1,72 @@
+# test_response_cache.py
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, make_cache_key, normalize_text
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+
+def test_normalize_text_collapses_whitespace_and_keeps_case():
+    assert normalize_text("  Продажа \n\t товаров ") == "Продажа товаров"
+    assert make_cache_key("a", " Продажа  товаров", "1", {}, "m") == make_cache_key("a", "Продажа товаров", "1", {}, "m")
+    assert make_cache_key("a", "Продажа", "1", {}, "m") != make_cache_key("a", "продажа", "1", {}, "m")
+
+
+def test_key_depends_on_prompt_version_sampling_and_model():
+    base = make_cache_key("a", {"x": 1}, "1", {"temperature": 0.3}, "m")
+    assert base != make_cache_key("a", {"x": 1}, "2", {"temperature": 0.3}, "m")
+    assert base != make_cache_key("a", {"x": 1}, "1", {"temperature": 0.5}, "m")
+    assert base != make_cache_key("a", {"x": 1}, "1", {"temperature": 0.3}, "other")
+
+
+def test_get_returns_independent_copy(clock):
+    cache = ResponseCache()
+    cache.set("k", {"nodes": []})
+    found, value = cache.get("k")
+    value["nodes"].append(1)
+    assert cache.get("k") == (True, {"nodes": []})
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ResponseCache(ttl=10)
+    cache.set("k", 1)
+    clock.now += 10
+    assert cache.get("k") == (True, 1)
+    clock.now += 0.5
+    assert cache.get("k") == (False, None)
+    assert cache.metrics()["memory_entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+
+
+def test_disk_cache_survives_restart_and_honours_ttl(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ResponseCache(ttl=10, db_path=path).set("k", {"v": 1})
+    restarted = ResponseCache(ttl=10, db_path=path)
+    assert restarted.get("k") == (True, {"v": 1})
+    assert restarted.metrics()["disk_hits"] == 1
+    clock.now += 11
+    assert ResponseCache(ttl=10, db_path=path).get("k") == (False, None)
@@ -0,0 +1,111 @@
+# test_single_flight.py
+import threading
+import time
+
+import pytest
+
+from inference_scheduler import DeadlineExceededError, RequestCancelledError, request_options
+from single_flight import SingleFlight
+
+
+def start_leader(flight: SingleFlight, release: threading.Event, result=None, error=None):
+    started = threading.Event()
+
+    def leader():
+        started.set()
+        release.wait(5)
+        if error is not None:
+            raise error
+        return result
+
+    thread = threading.Thread(target=lambda: _swallow(flight.do, "k", leader))
+    thread.start()
+    started.wait(5)
+    return thread
+
+
+def _swallow(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        pass
+
+
+def test_followers_get_copies_of_leader_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = start_leader(flight, release, result={"nodes": []})
+    results = []
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", lambda: pytest.fail("повтор"))))
+                 for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert results == [{"nodes": []}] * 3
+    assert len({id(result) for result in results}) == 3
+    assert flight.metrics() == {"leaders": 1, "coalesced": 3, "retried": 0, "in_flight": 0}
+
+
+def test_follower_timeout_does_not_wait_for_leader():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = start_leader(flight, release)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceededError), request_options(timeout=0.3):
+        flight.do("k", lambda: None)
+    assert time.monotonic() - started < 2
+    release.set()
+    leader.join(5)
+
+
+def test_follower_cancel_does_not_stop_leader():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = start_leader(flight, release, result=1)
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+    with pytest.raises(RequestCancelledError), request_options(cancel_event=cancel):
+        flight.do("k", lambda: None)
+    assert flight.metrics()["in_flight"] == 1
+    release.set()
+    leader.join(5)
+    assert flight.do("k", lambda: 2) == 2
+
+
+def test_follower_retries_after_retryable_leader_error():
+    flight = SingleFlight(retry_on=(RequestCancelledError,))
+    release = threading.Event()
+    leader = start_leader(flight, release, error=RequestCancelledError("клиент отключился"))
+    result = []
+    follower = threading.Thread(target=lambda: result.append(flight.do("k", lambda: "own")))
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert result == ["own"]
+    assert flight.metrics()["retried"] == 1
+
+
+def test_follower_inherits_other_leader_errors():
+    flight = SingleFlight(retry_on=(RequestCancelledError,))
+    release = threading.Event()
+    leader = start_leader(flight, release, error=ValueError("сбой"))
+    errors = []
+    follower = threading.Thread(target=lambda: _collect(errors, flight.do, "k", lambda: "own"))
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert [type(e) for e in errors] == [ValueError]
+
+
+def _collect(errors, func, *args):
+    try:
+        func(*args)
+    except Exception as e:
+        errors.append(e)
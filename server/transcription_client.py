@@ -0,0 +1,139 @@
+# transcription_client.py
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+ASSEMBLYAI_BASE_URL = "https://api.assemblyai.com/v2"
+
+
+class TranscriptionError(Exception):
+    pass
+
+
+class AssemblyAIClient:
+    """
+    Асинхронный клиент AssemblyAI с общим пулом соединений.
+
+    - аудио загружается потоково, без чтения файла в память целиком;
+    - готовность транскрипции ожидается с экспоненциальной паузой между опросами,
+      а при заданном webhook_url - по уведомлению (опрос остаётся страховкой); ожидающие
+      запросы хранятся в памяти процесса, поэтому уведомление, пришедшее в другой веб-процесс,
+      ничего не ускоряет;
+    - число одновременных транскрипций ограничено max_concurrency.
+
+    base_url и transport позволяют направить клиент на локальную заглушку API.
+    """
+
+    def __init__(self, api_key: str, base_url: str = ASSEMBLYAI_BASE_URL, max_concurrency: int = 4,
+                 request_timeout: float = 30.0, total_timeout: float = 300.0,
+                 poll_initial: float = 1.0, poll_max: float = 10.0, poll_factor: float = 1.5,
+                 webhook_url: Optional[str] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.request_timeout = request_timeout
+        self.total_timeout = total_timeout
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.poll_factor = poll_factor
+        self.webhook_url = webhook_url
+        self.max_concurrency = max_concurrency
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        # Создаётся в работающем event loop: в Python 3.9 примитивы asyncio привязываются к циклу при создании
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._notifications: Dict[str, asyncio.Event] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"authorization": self.api_key},
+                timeout=self.request_timeout,
+                transport=self._transport,
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def transcribe(self, audio: AsyncIterator[bytes]) -> str:
+        """Полный цикл: загрузка, создание задачи и ожидание текста"""
+        async with self.semaphore:
+            with timed("transcription_upload"):
+                upload_url = await self.upload(audio)
+            with timed("transcription_create"):
+                transcript_id = await self.create_transcript(upload_url)
+            with timed("transcription_wait"):
+                return await self.wait_for_transcript(transcript_id)
+
+    async def upload(self, audio: AsyncIterator[bytes]) -> str:
+        """Загружает аудио (chunked transfer) и возвращает upload_url"""
+        res = await self.client.post("/upload", content=audio)
+        res.raise_for_status()
+        return res.json()["upload_url"]
+
+    async def create_transcript(self, audio_url: str) -> str:
+        """Создаёт задачу транскрипции и возвращает её ID"""
+        data = {
+            "audio_url": audio_url,
+            "language_code": "ru",
+            "speech_model": "best"
+        }
+        if self.webhook_url:
+            data["webhook_url"] = self.webhook_url
+        res = await self.client.post("/transcript", json=data)
+        res.raise_for_status()
+        return res.json()["id"]
+
+    async def wait_for_transcript(self, transcript_id: str) -> str:
+        """Ожидает готовности транскрипции и возвращает текст"""
+        notified = self._notifications.setdefault(transcript_id, asyncio.Event())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_timeout
+        delay = self.poll_initial
+        try:
+            while True:
+                res = await self.client.get(f"/transcript/{transcript_id}")
+                res.raise_for_status()
+                data = res.json()
+                if data["status"] == "completed":
+                    return data["text"]
+                if data["status"] == "error":
+                    raise TranscriptionError(f"AssemblyAI error: {data.get('error')}")
+
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError("Таймаут транскрипции")
+                try:
+                    # Просыпаемся раньше, если пришёл webhook
+                    await asyncio.wait_for(notified.wait(), timeout=min(delay, remaining))
+                    notified.clear()
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * self.poll_factor, self.poll_max)
+        finally:
+            self._notifications.pop(transcript_id, None)
+
+    def notify(self, transcript_id: str):
+        """
+        Вызывается обработчиком webhook: транскрипция сменила статус.
+        Только из event loop - asyncio.Event не потокобезопасен
+        """
+        event = self._notifications.get(transcript_id)
+        if event is not None:
+            event.set()